@@ -0,0 +1,4 @@
+from .tsplib import (Instance, OPTIMA, load_instance, available_instances,
+                     load_optimal_tour, tour_length)
+from .suite import (configurations, run_benchmark, run_suite, compare,
+                    OPTIMIZERS, SHUFFLERS)
@@ -0,0 +1,51 @@
+import sys
+import json
+import logging
+import argparse
+
+from .tsplib import available_instances
+from .suite import (DEFAULT_MATRIX, DEFAULT_THRESHOLDS, configurations,
+                    run_suite, compare, write_report)
+
+# python -m gopt.bench pcb442 --optimizer local_search annealing \
+#     --population 8 32 --max-time 30 --output report.json
+# python -m gopt.bench --compare baseline.json report.json
+parser = argparse.ArgumentParser(description='GOPT benchmarks')
+parser.add_argument('instances', nargs='*',
+                    help='TSPLIB instances (names or paths), all the '
+                         'available ones by default')
+for axis, default in DEFAULT_MATRIX.items():
+    kind = int if axis in ('population', 'threads') else str
+    parser.add_argument(f'--{axis}', nargs='+', type=kind, default=default)
+parser.add_argument('--max-time', type=float, default=10.0,
+                    help='Optimization time of each benchmark (seconds)')
+parser.add_argument('--slice-time', type=float, default=0.5,
+                    help='Resolution of the times to target (seconds)')
+parser.add_argument('--thresholds', nargs='+', type=float,
+                    default=DEFAULT_THRESHOLDS,
+                    help='Gaps to the optimum to time (0.01 for 1%%)')
+parser.add_argument('--output', default='-', help='Report file')
+parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                    help='Compare two reports instead of running, exits '
+                         'with 1 if there are regressions')
+parser.add_argument('--tolerance', type=float, default=0.1)
+args = parser.parse_args()
+
+logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s',
+                    level=logging.WARNING)
+logging.getLogger('gopt').getChild('bench').setLevel(logging.INFO)
+
+if args.compare:
+    with open(args.compare[0]) as f:
+        baseline = json.load(f)
+    with open(args.compare[1]) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.tolerance)
+    write_report(regressions, args.output)
+    sys.exit(1 if regressions else 0)
+
+configs = configurations(**{axis: getattr(args, axis)
+                            for axis in DEFAULT_MATRIX})
+report = run_suite(args.instances or available_instances(), configs,
+                   args.max_time, args.slice_time, args.thresholds)
+write_report(report, args.output)
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import logging
+import platform
+import itertools
+import subprocess
+from time import time
+import numba
+import numpy as np
+
+from ..compiler import Compiler
+from ..problems import EuclieanTSP
+from ..optimizers import RandomLocalSearch, SimulatedAnnealing
+from ..shufflers import (IndependentShuffler, WinnerTakesAll, IslandShuffler,
+                         MemeticShuffler)
+from ..runners import CPURunner
+from ..telemetry import ITERATIONS
+from .tsplib import load_instance, tour_length
+
+logger = logging.getLogger('gopt').getChild('bench')
+
+# Benchmarks run every combination of the values of these axes (see
+# configurations) on every instance
+AXES = ['neighborhood', 'init', 'optimizer', 'shuffler', 'population',
+        'threads']
+
+DEFAULT_MATRIX = dict(
+    neighborhood=['2-opt'],
+    init=['NN'],
+    optimizer=['local_search'],
+    shuffler=['independent'],
+    population=[8],
+    threads=[1]
+)
+
+# Gaps to the optimum for which the time to reach them is reported
+DEFAULT_THRESHOLDS = [0.1, 0.05, 0.02, 0.01]
+
+ISLAND_SIZE = 4
+
+
+def islands(Optimizer, population):
+    if population % ISLAND_SIZE != 0:
+        raise ValueError(f"The population of islands should be a multiple "
+                         f"of {ISLAND_SIZE}")
+    return IslandShuffler(Optimizer, population // ISLAND_SIZE, ISLAND_SIZE)
+
+
+# Builders of the optimizers and shufflers available to the benchmarks, more
+# can be registered by adding entries
+OPTIMIZERS = {
+    'local_search': lambda Problem: RandomLocalSearch(Problem),
+    'annealing': lambda Problem: SimulatedAnnealing(Problem,
+                                                    schedule='adaptive')
+}
+
+SHUFFLERS = {
+    'independent': lambda Optimizer, population:
+        IndependentShuffler(Optimizer, population),
+    'winner_takes_all': lambda Optimizer, population:
+        WinnerTakesAll(Optimizer, population),
+    'islands': lambda Optimizer, population:
+        islands(Optimizer, population),
+    'memetic': lambda Optimizer, population:
+        MemeticShuffler(Optimizer, population, max(population // 4, 1))
+}
+
+
+# Every combination of the axes, values not given come from DEFAULT_MATRIX
+def configurations(**axes):
+    unknown = set(axes) - set(AXES)
+    if unknown:
+        raise ValueError(f"Unknown axes {', '.join(sorted(unknown))}, "
+                         f"available: {', '.join(AXES)}")
+    matrix = {**DEFAULT_MATRIX, **axes}
+    values = [matrix[axis] for axis in AXES]
+    return [dict(zip(AXES, combination))
+            for combination in itertools.product(*values)]
+
+
+def threshold_name(threshold):
+    return f'{threshold * 100:g}%'
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(__file__), timeout=5,
+            check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    return dict(
+        gopt_revision=git_revision(),
+        python=platform.python_version(),
+        numba=numba.__version__,
+        numpy=np.__version__,
+        platform=platform.platform(),
+        machine=platform.machine(),
+        processor=platform.processor(),
+        cpu_count=os.cpu_count(),
+        threading_layer=Compiler.threading_layer,
+        kernel_cache=Compiler.cache,
+        fastmath=Compiler.fastmath
+    )
+
+
+# Runs one configuration on one instance for max_time seconds of
+# optimization.
+#
+# The loss of EuclieanTSP is not the TSPLIB length of the tour (it sums
+# squared distances) so the run is split in runs of slice_time seconds after
+# which the TSPLIB length of the best tour is computed. Times to target are
+# measured in optimization time at the end of the slice where the target is
+# reached, they are accurate to slice_time.
+#
+# Reported times:
+# - compile_time: everything before the first iteration except the
+#   initialization of the population (generating and compiling the code,
+#   preparing the problem data). Small if the kernels come from the cache
+# - init_time: initialization of the population
+def run_benchmark(instance, config, max_time=10.0, slice_time=0.5,
+                  thresholds=DEFAULT_THRESHOLDS):
+    start_time = time()
+    Problem = EuclieanTSP(instance.num_cities, 2,
+                          neighborhood=config['neighborhood'],
+                          init=config['init'])
+    Optimizer = OPTIMIZERS[config['optimizer']](Problem)
+    Shuffler = SHUFFLERS[config['shuffler']](Optimizer, config['population'])
+    runner = CPURunner(Shuffler, instance.coords.astype(np.float32),
+                       num_cores=config['threads'])
+    runner.progress = False
+    runner.compile()
+    compile_time = time() - start_time - runner.init_time
+
+    # TSPLIB length of the tour of the member with the lowest loss
+    def best_length():
+        best = int(np.argmin(runner.solution_losses[:, 0]))
+        solution = runner.Problem.export_solution(
+            runner.solution_states[best, 0], runner.problem_data)
+        return tour_length(instance.coords, solution['order'])
+
+    initial_length = best_length()
+    length = initial_length
+    time_to_target = {threshold_name(t): None for t in thresholds}
+    elapsed = 0.0
+    slices = 0
+    while elapsed < max_time:
+        slice_start = time()
+        runner.run(max_time=min(slice_time, max_time - elapsed))
+        elapsed += time() - slice_start
+        slices += 1
+
+        length = min(length, best_length())
+        gap = instance.gap(length)
+        if gap is None:
+            continue
+        for threshold in thresholds:
+            name = threshold_name(threshold)
+            if time_to_target[name] is None and gap <= threshold:
+                time_to_target[name] = elapsed
+        if gap <= 0:
+            break
+
+    iterations = int(runner.counters[:, ITERATIONS].sum())
+    return dict(
+        instance=instance.name,
+        num_cities=instance.num_cities,
+        optimum=instance.optimum,
+        config=dict(config),
+        compile_time=compile_time,
+        init_time=runner.init_time,
+        optimization_time=elapsed,
+        slices=slices,
+        iterations=iterations,
+        iterations_per_second=iterations / max(elapsed, 1e-9),
+        initial_length=initial_length,
+        initial_gap=instance.gap(initial_length),
+        best_length=length,
+        gap=instance.gap(length),
+        time_to_target=time_to_target
+    )
+
+
+# Runs every configuration on every instance (names or paths, see
+# tsplib.load_instance) and returns the report, which can be dumped as JSON.
+# A configuration that can't be built is reported with its error
+def run_suite(instances, configs, max_time=10.0, slice_time=0.5,
+              thresholds=DEFAULT_THRESHOLDS):
+    report = dict(
+        environment=environment(),
+        settings=dict(max_time=max_time, slice_time=slice_time,
+                      thresholds=list(thresholds)),
+        started_at=time(),
+        results=[]
+    )
+    for name in instances:
+        instance = load_instance(name)
+        for config in configs:
+            logger.info(f'Benchmarking {instance.name} {config}')
+            try:
+                result = run_benchmark(instance, config, max_time,
+                                       slice_time, thresholds)
+            except (ValueError, KeyError) as e:
+                logger.warning(f'{instance.name} {config} failed: {e}')
+                result = dict(instance=instance.name, config=dict(config),
+                              error=str(e))
+            report['results'].append(result)
+    return report
+
+
+def result_key(result):
+    return json.dumps([result['instance'], result['config']], sort_keys=True)
+
+
+# Compares two reports of run_suite, returns the regressions of current
+# relative to baseline: the configurations where a metric got worse by more
+# than tolerance (relative):
+# - iterations_per_second decreased
+# - compile_time or init_time increased (ignoring differences below
+#   min_seconds, they are mostly noise)
+# - a target reached in the baseline is not reached anymore or took longer
+#   (these are only as accurate as the slices of the runs)
+def compare(baseline, current, tolerance=0.1, min_seconds=0.1):
+    baseline_results = {result_key(r): r for r in baseline['results']
+                        if 'error' not in r}
+    regressions = []
+
+    def regression(result, metric, before, after):
+        regressions.append(dict(instance=result['instance'],
+                                config=result['config'], metric=metric,
+                                baseline=before, current=after))
+
+    for result in current['results']:
+        before = baseline_results.get(result_key(result))
+        if before is None:
+            continue
+        if 'error' in result:
+            regression(result, 'error', None, result['error'])
+            continue
+
+        if (result['iterations_per_second']
+                < before['iterations_per_second'] * (1 - tolerance)):
+            regression(result, 'iterations_per_second',
+                       before['iterations_per_second'],
+                       result['iterations_per_second'])
+
+        for metric in ('compile_time', 'init_time'):
+            if (result[metric] > before[metric] * (1 + tolerance)
+                    and result[metric] - before[metric] > min_seconds):
+                regression(result, metric, before[metric], result[metric])
+
+        for name, reached in before['time_to_target'].items():
+            if reached is None:
+                continue
+            now = result['time_to_target'].get(name)
+            if now is None or (now > reached * (1 + tolerance)
+                               and now - reached > min_seconds):
+                regression(result, f'time_to_{name}', reached, now)
+
+    return regressions
+
+
+def write_report(report, path=None):
+    content = json.dumps(report, indent=2)
+    if path is None or path == '-':
+        sys.stdout.write(content + '\n')
+    else:
+        with open(path, 'w') as f:
+            f.write(content + '\n')
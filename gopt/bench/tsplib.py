@@ -0,0 +1,217 @@
+import os
+import numpy as np
+
+from ..io import read_tsplib, open_text
+
+# TSPLIB instances for the benchmarks
+#
+# Only symmetric instances with EDGE_WEIGHT_TYPE EUC_2D are supported: the
+# distance between two cities is their euclidean distance rounded to the
+# nearest integer (nint), the lengths of the optimal tours published with
+# TSPLIB use these distances.
+#
+# Instances are looked up by name (pcb442...) in the directories of
+# $GOPT_TSPLIB_DIR (separated by os.pathsep) and then in the data directory
+# of this package, as name.tsp or name.tsp.gz. A path to a .tsp file works
+# too. Optimal tours published with TSPLIB (name.opt.tour) are looked up
+# the same way.
+#
+# Bundled: pr107 and pcb442 (with its optimal tour)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+# Length of the optimal tours of the EUC_2D instances of TSPLIB
+OPTIMA = {
+    'eil51': 426,
+    'berlin52': 7542,
+    'st70': 675,
+    'eil76': 538,
+    'pr76': 108159,
+    'rat99': 1211,
+    'kroA100': 21282,
+    'kroB100': 22141,
+    'kroC100': 20749,
+    'kroD100': 21294,
+    'kroE100': 22068,
+    'rd100': 7910,
+    'eil101': 629,
+    'lin105': 14379,
+    'pr107': 44303,
+    'pr124': 59030,
+    'bier127': 118282,
+    'ch130': 6110,
+    'pr136': 96772,
+    'pr144': 58537,
+    'ch150': 6528,
+    'kroA150': 26524,
+    'kroB150': 26130,
+    'pr152': 73682,
+    'u159': 42080,
+    'rat195': 2323,
+    'd198': 15780,
+    'kroA200': 29368,
+    'kroB200': 29437,
+    'ts225': 126643,
+    'tsp225': 3916,
+    'pr226': 80369,
+    'gil262': 2378,
+    'pr264': 49135,
+    'a280': 2579,
+    'pr299': 48191,
+    'lin318': 42029,
+    'rd400': 15281,
+    'fl417': 11861,
+    'pr439': 107217,
+    'pcb442': 50778,
+    'd493': 35002,
+    'rat575': 6773,
+    'p654': 34643,
+    'd657': 48912,
+    'u724': 41910,
+    'rat783': 8806,
+    'pr1002': 259045,
+    'u1060': 224094,
+    'vm1084': 239297,
+    'pcb1173': 56892,
+    'd1291': 50801,
+    'rl1304': 252948,
+    'rl1323': 270199,
+    'nrw1379': 56638,
+    'fl1400': 20127,
+    'u1432': 152970,
+    'fl1577': 22249,
+    'd1655': 62128,
+    'vm1748': 336556,
+    'u1817': 57201,
+    'rl1889': 316536,
+    'd2103': 80450,
+    'u2152': 64253,
+    'u2319': 234256,
+    'pr2392': 378032,
+    'pcb3038': 137694,
+    'fl3795': 28772,
+    'fnl4461': 182566,
+    'rl5915': 565530,
+    'rl5934': 556045,
+    'rl11849': 923288,
+    'usa13509': 19982859,
+    'brd14051': 469385,
+    'd15112': 1573084,
+    'd18512': 645238
+}
+
+
+class Instance:
+
+    # optimum is None when it is not known, the gaps to the optimum are not
+    # computed then
+    def __init__(self, name, coords, optimum=None, comment=''):
+        self.name = name
+        self.coords = coords
+        self.optimum = optimum
+        self.comment = comment
+
+    @property
+    def num_cities(self):
+        return self.coords.shape[0]
+
+    # Relative gap of a tour of the given length to the optimum
+    def gap(self, length):
+        if self.optimum is None:
+            return None
+        return (length - self.optimum) / self.optimum
+
+    def __repr__(self):
+        return (f"Instance({self.name}, num_cities={self.num_cities}, "
+                f"optimum={self.optimum})")
+
+
+# Returns the header and the (DIMENSION, 2) float64 coordinates of a .tsp
+# file (see gopt.io.read_tsplib)
+def read_tsp(path):
+    header, coords, _ = read_tsplib(path)
+    if header.get('EDGE_WEIGHT_TYPE') != 'EUC_2D':
+        raise ValueError(f"{path}: only EUC_2D instances are supported, "
+                         f"got {header.get('EDGE_WEIGHT_TYPE')}")
+    if coords is None:
+        raise ValueError(f"{path}: no NODE_COORD_SECTION")
+    return header, coords
+
+
+def search_path():
+    directories = [d for d in os.environ.get('GOPT_TSPLIB_DIR', '')
+                   .split(os.pathsep) if d]
+    return directories + [DATA_DIR]
+
+
+def find_file(name, extensions, kind):
+    if os.path.exists(name):
+        return name
+    for directory in search_path():
+        for extension in extensions:
+            path = os.path.join(directory, name + extension)
+            if os.path.exists(path):
+                return path
+    raise FileNotFoundError(f"{kind} {name} not found in "
+                            f"{', '.join(search_path())}")
+
+
+def find_instance(name):
+    return find_file(name, ('.tsp', '.tsp.gz'), 'TSPLIB instance')
+
+
+# Names of the instances that can be loaded without a path
+def available_instances():
+    names = set()
+    for directory in search_path():
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            for extension in ('.tsp', '.tsp.gz'):
+                if filename.endswith(extension):
+                    names.add(filename[:-len(extension)])
+    return sorted(names)
+
+
+# name is the name of an instance or the path of a .tsp file. The optimum
+# comes from OPTIMA unless given
+def load_instance(name, optimum=None):
+    header, coords = read_tsp(find_instance(name))
+    instance_name = header.get('NAME', os.path.basename(name))
+    if optimum is None:
+        optimum = OPTIMA.get(instance_name)
+    return Instance(instance_name, coords, optimum,
+                    header.get('COMMENT', ''))
+
+
+# The cities (from 0) in the order of the TOUR_SECTION of a .tour file
+def read_tour(path):
+    order = []
+    with open_text(path) as f:
+        lines = iter(f)
+        for line in lines:
+            if line.strip().upper().startswith('TOUR_SECTION'):
+                break
+        else:
+            raise ValueError(f"{path}: no TOUR_SECTION")
+        for line in lines:
+            for value in line.split():
+                if value == '-1':
+                    return np.array(order, dtype=np.int64) - 1
+                order.append(int(value))
+    raise ValueError(f"{path}: TOUR_SECTION should end with -1")
+
+
+# The optimal tour of an instance (name or path of a .opt.tour file)
+def load_optimal_tour(name):
+    return read_tour(find_file(name, ('.opt.tour', '.opt.tour.gz'),
+                               'Optimal tour of'))
+
+
+# Length of the tour visiting the cities in `order` with the TSPLIB EUC_2D
+# distances
+def tour_length(coords, order):
+    tour = np.asarray(coords, dtype=np.float64)[np.asarray(order)]
+    steps = tour - np.roll(tour, -1, axis=0)
+    distances = np.sqrt((steps ** 2).sum(axis=1))
+    return int(np.floor(distances + 0.5).sum())
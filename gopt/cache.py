@@ -0,0 +1,273 @@
+import os
+import sys
+import types
+import inspect
+import hashlib
+import logging
+import sysconfig
+
+import numba
+import llvmlite
+import numpy as np
+from numba.core import typeinfer
+from numba.core.caching import (FunctionCache, CompileResultCacheImpl,
+                                IndexDataCacheFile, _CacheLocator,
+                                _SourceFileBackedLocatorMixin)
+from numba.core.dispatcher import Dispatcher
+
+
+# On-disk cache for the kernels generated by GOPT
+#
+# Numba's own cache (cache=True) keys closures on a pickle of their cell
+# contents. Since our kernels capture other dispatchers (whose pickle contains
+# a per-process uuid) it never hits. Instead we key each kernel on a
+# fingerprint of everything it was specialized on: the bytecode of the kernel
+# and of all the kernels it calls, the constants it captured (num_cities,
+# neighborhood, population_size, ...), the code they reach through modules
+# and classes of the project, the Compiler flags and the numba/llvmlite
+# versions.
+
+logger = logging.getLogger('gopt.compiler')
+
+
+# $GOPT_CACHE_DIR, or gopt in the user cache directory ($XDG_CACHE_HOME or
+# ~/.cache)
+def default_cache_dir():
+    env_dir = os.environ.get('GOPT_CACHE_DIR')
+    if env_dir:
+        return env_dir
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'gopt')
+
+
+_INSTALL_PATHS = tuple(os.path.join(os.path.realpath(path), '')
+                       for path in {sysconfig.get_path(name) for name in
+                                    ('stdlib', 'platstdlib', 'purelib',
+                                     'platlib')}
+                       if path)
+
+
+# Whether module is part of an installed distribution (standard library,
+# site-packages), whose code only changes with its version. The code of
+# other modules (GOPT itself, user code) can change at any time
+def _installed(module):
+    if module is None:
+        return True
+    top_level = module.__name__.partition('.')[0]
+    if top_level == 'gopt':
+        return False
+    if top_level in sys.builtin_module_names:
+        return True
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return False
+    return os.path.realpath(path).startswith(_INSTALL_PATHS)
+
+
+# Update the hasher *h* with a stable description of obj
+#
+# Functions are hashed on their bytecode, constants, referenced globals and
+# closure. Dispatchers are hashed on their python function and options.
+# Modules and classes are hashed on their name (and version), the ones of
+# the project also on the attributes in `names`: the names referenced by the
+# function using them, which covers code reached as module.function or
+# Class.attribute
+def _feed(h, obj, seen, names=()):
+    if isinstance(obj, Dispatcher):
+        h.update(b'dispatcher')
+        _feed(h, sorted(obj.targetoptions.items()), seen)
+        _feed(h, obj.py_func, seen)
+    elif isinstance(obj, types.FunctionType):
+        if id(obj) in seen:
+            h.update(b'recursion')
+            return
+        seen.add(id(obj))
+        h.update(obj.__qualname__.encode())
+        _feed(h, obj.__code__, seen)
+        referenced = sorted(_referenced_names(obj.__code__))
+        for name in referenced:
+            if name in obj.__globals__:
+                h.update(name.encode())
+                _feed(h, obj.__globals__[name], seen, referenced)
+        if obj.__closure__ is not None:
+            for cell in obj.__closure__:
+                try:
+                    _feed(h, cell.cell_contents, seen)
+                except ValueError:  # Empty cell
+                    h.update(b'empty cell')
+    elif isinstance(obj, types.CodeType):
+        h.update(obj.co_code)
+        _feed(h, obj.co_consts, seen)
+    elif isinstance(obj, types.ModuleType):
+        h.update(b'module' + obj.__name__.encode())
+        _feed_attributes(h, obj, obj, seen, names)
+    elif isinstance(obj, np.ndarray):
+        h.update(str(obj.dtype.descr).encode())
+        h.update(str(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, np.dtype):
+        h.update(str(obj.descr).encode())
+    elif isinstance(obj, (tuple, list)):
+        h.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for item in obj:
+            _feed(h, item, seen)
+    elif isinstance(obj, type):
+        h.update(f'{obj.__module__}.{obj.__qualname__}'.encode())
+        _feed_attributes(h, obj, sys.modules.get(obj.__module__), seen,
+                         names)
+    else:
+        h.update(f'{type(obj).__name__}:{obj!r}'.encode())
+
+
+# obj is a module or a class defined in module
+def _feed_attributes(h, obj, module, seen, names):
+    if _installed(module):
+        top_level = None
+        if module is not None:
+            top_level = sys.modules.get(module.__name__.partition('.')[0])
+        version = getattr(top_level, '__version__', None)
+        h.update(f'version:{version}'.encode())
+        return
+    key = (id(obj), tuple(names))
+    if key in seen:
+        h.update(b'recursion')
+        return
+    seen.add(key)
+    for name in names:
+        try:
+            value = getattr(obj, name)
+        except AttributeError:
+            continue
+        h.update(name.encode())
+        # package.module.function and Class.Nested.attribute
+        _feed(h, value, seen, names)
+
+
+def _referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _referenced_names(const)
+    return names
+
+
+def fingerprint(*objs):
+    h = hashlib.sha256()
+    _feed(h, (numba.__version__, llvmlite.__version__) + objs, set())
+    return h.hexdigest()
+
+
+class _KernelCacheLocator(_SourceFileBackedLocatorMixin, _CacheLocator):
+
+    def __init__(self, py_func, py_file, cache_dir):
+        self._py_file = py_file
+        self._lineno = py_func.__code__.co_firstlineno
+        self._cache_path = cache_dir
+
+    def get_cache_path(self):
+        return self._cache_path
+
+
+class _KernelCacheImpl(CompileResultCacheImpl):
+
+    def __init__(self, py_func, cache_dir):
+        self._lineno = py_func.__code__.co_firstlineno
+        source_path = inspect.getfile(py_func)
+        self._locator = _KernelCacheLocator(py_func, source_path, cache_dir)
+        modname = os.path.splitext(os.path.basename(source_path))[0]
+        fullname = f'{modname}.{py_func.__qualname__}'
+        abiflags = getattr(sys, 'abiflags', '')
+        self._filename_base = self.get_filename_base(fullname, abiflags)
+
+
+class _KernelCacheFile(IndexDataCacheFile):
+
+    def __init__(self, cache_path, filename_base, source_stamp, max_size):
+        super().__init__(cache_path, filename_base, source_stamp)
+        self._max_size = max_size
+
+    def _load_data(self, name):
+        data = super()._load_data(name)
+        # Mark the entry as recently used
+        try:
+            os.utime(self._data_path(name))
+        except OSError:
+            pass
+        return data
+
+    def _save_data(self, name, data):
+        super()._save_data(name, data)
+        evict(self._cache_path, self._max_size)
+
+
+class KernelCache(FunctionCache):
+
+    def __init__(self, py_func, key, cache_dir, max_size):
+        self._name = repr(py_func)
+        self._py_func = py_func
+        self._key = key
+        self._impl = _KernelCacheImpl(py_func, cache_dir)
+        self._cache_path = cache_dir
+        self._cache_file = _KernelCacheFile(
+            cache_path=cache_dir,
+            filename_base=self._impl.filename_base,
+            source_stamp=self._impl.locator.get_source_stamp(),
+            max_size=max_size
+        )
+        self.enable()
+
+    def _index_key(self, sig, codegen):
+        return (sig, codegen.magic_tuple(), self._key)
+
+
+# Remove the least recently used compiled kernels until the cache fits in
+# max_size bytes. Index files are tiny and stale entries are ignored by numba
+# so only the data files are evicted.
+def evict(cache_dir, max_size):
+    if max_size is None:
+        return
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.nbc'):
+            continue
+        try:
+            st = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+
+    total_size = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, name in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            logger.debug(f'Evicted {name} from the kernel cache')
+        except OSError:
+            pass
+        total_size -= size
+
+
+# Equivalent of numba.njit(signature, **options)(code) going through the
+# on-disk cache. If signature is None, compilation is deferred to the first
+# call as usual (but will still use the cache)
+#
+# Returns the dispatcher and whether it was loaded from the cache
+def cached_njit(code, signature, key, cache_dir, max_size, **options):
+    dispatcher = numba.njit(**options)(code)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        dispatcher._cache = KernelCache(code, key, cache_dir, max_size)
+    except OSError as e:
+        logger.warning(f'Kernel cache unavailable ({e})')
+
+    if signature is not None:
+        with typeinfer.register_dispatcher(dispatcher):
+            dispatcher.compile(signature)
+        dispatcher.disable_compile()
+
+    return dispatcher, sum(dispatcher.stats.cache_hits.values()) > 0
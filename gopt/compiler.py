@@ -1,8 +1,11 @@
 import logging
+from time import time
 import numba
 import numpy as np
 from boltons.strutils import bytes2human
 
+from . import cache as kernel_cache
+
 
 # This is the compiler class of GOPT
 # Its main use is to let the user configure some potentially preformance
@@ -21,6 +24,19 @@ class Compiler:
 
     threading_layer = 'tbb'
 
+    # Whether to store compiled kernels on disk and reuse them across
+    # processes. Kernels are keyed on everything they are specialized on
+    # (problem size, neighborhood, optimizer parameters, flags above...)
+    cache = True
+
+    # Where to store the kernels (defaults to $GOPT_CACHE_DIR or gopt in
+    # $XDG_CACHE_HOME, ~/.cache if unset)
+    cache_dir = None
+
+    # Maximum size of the cache on disk in bytes, least recently used kernels
+    # are evicted first (None for unbounded)
+    cache_size = 1 << 30
+
     @classmethod
     def getLogger(cls, clz):
         logger = logging.getLogger('gopt.compiler')
@@ -55,18 +71,67 @@ class Compiler:
         return allocator
 
     @classmethod
-    def jit(cls, clz, name, signature, code, parallel=False):
+    def jit(cls, clz, name, signature, code, parallel=False, inline=None,
+            nogil=False):
         numba.config.THREADING_LAYER = cls.threading_layer
         if cls.debug:
             return code
 
-        cls.getLogger(clz).info(f'Compiling {name}')
-        return numba.njit(signature, inline=cls.inline,
-                          fastmath=cls.fastmath, parallel=parallel)(code)
+        if inline is None:
+            inline = cls.inline
+
+        options = dict(inline=inline, fastmath=cls.fastmath,
+                       parallel=parallel)
+        # Lets other python threads run while the kernel runs
+        if nogil:
+            options['nogil'] = True
+
+        if not cls.cache:
+            cls.getLogger(clz).info(f'Compiling {name}')
+            return numba.njit(signature, **options)(code)
+
+        cache_dir = cls.cache_dir
+        if cache_dir is None:
+            cache_dir = kernel_cache.default_cache_dir()
+
+        key = kernel_cache.fingerprint(clz, name, code,
+                                       sorted(options.items()),
+                                       cls.threading_layer)
+
+        start_time = time()
+        compiled, hit = kernel_cache.cached_njit(code, signature, key,
+                                                 cache_dir, cls.cache_size,
+                                                 **options)
+        elapsed = time() - start_time
+
+        if signature is None:
+            cls.getLogger(clz).info(f'Compiling {name} (lazy)')
+        elif hit:
+            cls.getLogger(clz).info(
+                f'Loaded {name} from cache ({elapsed:.2f}sec)')
+        else:
+            cls.getLogger(clz).info(
+                f'Compiled {name}, cache miss ({elapsed:.2f}sec)')
+
+        return compiled
 
-    loss_dtype = np.float32
-    loss_ntype = numba.typeof(loss_dtype).dtype
-    loss_array_ntype = numba.types.Array(numba.float32, 1, 'C')
+    # Type of the losses (and of the loss differences of the moves). The
+    # optimizers update the losses incrementally with the deltas of the
+    # moves they accept, in float32 the rounding errors of billions of
+    # deltas add up. Change it with set_loss_dtype before compiling anything
+    loss_dtype = np.float64
+    loss_ntype = numba.float64
+    loss_array_ntype = numba.types.Array(numba.float64, 1, 'C')
+
+    @classmethod
+    def set_loss_dtype(cls, dtype):
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError("The loss dtype should be np.float32 or "
+                             "np.float64")
+        cls.loss_dtype = dtype.type
+        cls.loss_ntype = numba.from_dtype(dtype)
+        cls.loss_array_ntype = numba.types.Array(cls.loss_ntype, 1, 'C')
 
 
 # This is a class extended by anything that can be compiled
@@ -0,0 +1,480 @@
+import os
+import gzip
+import itertools
+import numpy as np
+
+from .compiler import Compiler
+from .cache import default_cache_dir, fingerprint
+
+# Loading instances from files
+#
+# Supported formats:
+# - 'tsplib': TSPLIB files (.tsp, .tsp.gz), NODE_COORD_SECTION and
+#   EDGE_WEIGHT_SECTION (any EDGE_WEIGHT_FORMAT of symmetric instances)
+# - 'csv': one city per line (.csv, .txt, optionally gzipped), a header
+#   line is skipped
+# - 'npy': .npy files
+# - 'binary': raw C ordered coordinates (source_dtype, dimensionality)
+#
+# Text files are parsed by chunks of chunk_size lines written directly into
+# the result, the whole file is never held in memory.
+#
+# Parsing multi-million city files takes a while so with cache=True the
+# result is written to a memory mapped .npy file in the cache directory
+# (Compiler.cache_dir, $GOPT_CACHE_DIR or ~/.cache/gopt, under data/) and
+# later loads of the same file (same path, size and modification time) map
+# it instead of parsing again. load_problem_data does the same with the
+# problem data prepared by Problem.prepare_data, which runners use in place
+# without copying it.
+
+FORMATS = ['tsplib', 'csv', 'npy', 'binary']
+
+# Lines parsed at once
+CHUNK_SIZE = 1 << 16
+
+# How the values of EDGE_WEIGHT_SECTION are laid out: for each format the
+# length and the first column of row i of a matrix of size n. Since the
+# matrix is symmetric the column formats are the row formats of the
+# transposed matrix
+EDGE_WEIGHT_LAYOUTS = {
+    'FULL_MATRIX': lambda i, n: (np.full_like(i, n), np.zeros_like(i)),
+    'UPPER_ROW': lambda i, n: (n - 1 - i, i + 1),
+    'LOWER_ROW': lambda i, n: (i, np.zeros_like(i)),
+    'UPPER_DIAG_ROW': lambda i, n: (n - i, i),
+    'LOWER_DIAG_ROW': lambda i, n: (i + 1, np.zeros_like(i)),
+}
+EDGE_WEIGHT_LAYOUTS.update({
+    'LOWER_COL': EDGE_WEIGHT_LAYOUTS['UPPER_ROW'],
+    'UPPER_COL': EDGE_WEIGHT_LAYOUTS['LOWER_ROW'],
+    'LOWER_DIAG_COL': EDGE_WEIGHT_LAYOUTS['UPPER_DIAG_ROW'],
+    'UPPER_DIAG_COL': EDGE_WEIGHT_LAYOUTS['LOWER_DIAG_ROW'],
+})
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.tsp':
+        return 'tsplib'
+    if extension in ('.csv', '.txt'):
+        return 'csv'
+    if extension == '.npy':
+        return 'npy'
+    return 'binary'
+
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+def allocate_in_memory(name, shape, dtype):
+    return np.zeros(shape, dtype=dtype)
+
+
+# Non empty lines of a file, lines can be given back with push
+class LineReader:
+
+    def __init__(self, f):
+        self.f = f
+        self.pending = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pending:
+            return self.pending.pop()
+        while True:
+            line = next(self.f).strip()
+            if line:
+                return line
+
+    def push(self, line):
+        self.pending.append(line)
+
+    # The values of the following lines by chunks, until the next keyword
+    def section(self, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = list(itertools.islice(self, chunk_size))
+            if not chunk:
+                return
+            end = next((i for i, line in enumerate(chunk)
+                        if line[0].isalpha()), None)
+            if end is not None:
+                for line in reversed(chunk[end:]):
+                    self.push(line)
+                chunk = chunk[:end]
+            if chunk:
+                yield chunk
+            if end is not None:
+                return
+
+
+def parse_values(lines):
+    try:
+        return np.array(' '.join(lines).split(), dtype=np.float64)
+    except ValueError as e:
+        raise ValueError(f"Invalid numeric data: {e}") from None
+
+
+def read_node_coords(reader, dimension, dtype, allocate, chunk_size):
+    coords = None
+    count = 0
+    for chunk in reader.section(chunk_size):
+        if coords is None:
+            dimensionality = len(chunk[0].split()) - 1
+            coords = allocate('coords', (dimension, dimensionality), dtype)
+        values = parse_values(chunk)
+        if values.size != len(chunk) * (dimensionality + 1):
+            raise ValueError("Every line of NODE_COORD_SECTION should have "
+                             f"an id and {dimensionality} coordinates")
+        values = values.reshape(len(chunk), dimensionality + 1)
+        ids = values[:, 0].astype(np.int64) - 1
+        if ids.min() < 0 or ids.max() >= dimension:
+            raise ValueError(f"Node ids should be in [1, {dimension}]")
+        coords[ids] = values[:, 1:]
+        count += len(chunk)
+    if count != dimension:
+        raise ValueError(f"Expected {dimension} nodes, got {count}")
+    return coords
+
+
+# Edge weights are returned as the packed lower triangle (without the
+# diagonal) used by EuclieanTSP's 'matrix' distance mode: the weight of
+# (a, b) with a > b is at a * (a - 1) // 2 + b
+def read_edge_weights(reader, dimension, edge_weight_format, dtype,
+                      allocate, chunk_size):
+    layout = EDGE_WEIGHT_LAYOUTS.get(edge_weight_format)
+    if layout is None:
+        raise ValueError(f"EDGE_WEIGHT_FORMAT {edge_weight_format} not "
+                         f"supported, choose from "
+                         f"{', '.join(EDGE_WEIGHT_LAYOUTS)}")
+    rows = np.arange(dimension, dtype=np.int64)
+    lengths, first_columns = layout(rows, dimension)
+    starts = np.concatenate([[0], np.cumsum(lengths)])
+    total = int(starts[-1])
+
+    weights = allocate('edge_weights', (dimension * (dimension - 1) // 2,),
+                       dtype)
+    position = 0
+    for chunk in reader.section(chunk_size):
+        values = parse_values(chunk)
+        if position + values.size > total:
+            raise ValueError(f"Expected {total} edge weights, got more")
+        positions = np.arange(position, position + values.size)
+        row = np.searchsorted(starts, positions, side='right') - 1
+        column = first_columns[row] + positions - starts[row]
+        a = np.maximum(row, column)
+        b = np.minimum(row, column)
+        # The full matrix has every weight twice, we keep the lower half
+        if edge_weight_format == 'FULL_MATRIX':
+            keep = row > column
+        else:
+            keep = a != b
+        a, b = a[keep], b[keep]
+        weights[a * (a - 1) // 2 + b] = values[keep]
+        position += values.size
+    if position != total:
+        raise ValueError(f"Expected {total} edge weights, got {position}")
+    return weights
+
+
+# Returns the header (keys in upper case), the (DIMENSION, dimensionality)
+# coordinates and the packed edge weights (see read_edge_weights) of a
+# TSPLIB file, None for the sections it does not have. Cities are
+# renumbered from 0 in the order of their ids.
+#
+# allocate(name, shape, dtype) creates the arrays ('coords' or
+# 'edge_weights') the sections are written to
+def read_tsplib(path, dtype=np.float64, weights_dtype=np.float32,
+                allocate=allocate_in_memory, chunk_size=CHUNK_SIZE):
+    header = {}
+    coords = None
+    edge_weights = None
+    with open_text(path) as f:
+        reader = LineReader(f)
+        for line in reader:
+            key, _, value = line.partition(':')
+            key = key.strip().upper()
+            if key == 'EOF':
+                break
+            if not key.endswith('_SECTION'):
+                header[key] = value.strip()
+                continue
+
+            if 'DIMENSION' not in header:
+                raise ValueError(f"{path}: DIMENSION should come before "
+                                 f"{key}")
+            dimension = int(header['DIMENSION'])
+            if key == 'NODE_COORD_SECTION':
+                coords = read_node_coords(reader, dimension, dtype, allocate,
+                                          chunk_size)
+            elif key == 'EDGE_WEIGHT_SECTION':
+                edge_weights = read_edge_weights(
+                    reader, dimension,
+                    header.get('EDGE_WEIGHT_FORMAT', 'FULL_MATRIX'),
+                    weights_dtype, allocate, chunk_size)
+            else:
+                # Sections we don't use (DISPLAY_DATA_SECTION...)
+                for _ in reader.section(chunk_size):
+                    pass
+
+    if header.get('TYPE', 'TSP') != 'TSP':
+        raise ValueError(f"{path}: only symmetric TSP instances are "
+                         f"supported, got {header['TYPE']}")
+    return header, coords, edge_weights
+
+
+def count_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    count = 0
+    with opener(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            count += block.count(b'\n')
+            last = block
+    # The last line might not end with a newline
+    if count and not last.endswith(b'\n'):
+        count += 1
+    return count
+
+
+# Reads the coordinates of a text file with one city per line. delimiter is
+# ',' for .csv files and whitespace otherwise, usecols selects the columns
+# of the coordinates (all by default). A first line that is not numeric is
+# a header and skipped
+def read_csv(path, dtype=np.float64, delimiter=None, usecols=None,
+             allocate=allocate_in_memory, chunk_size=CHUNK_SIZE):
+    if delimiter is None and '.csv' in os.path.basename(path).lower():
+        delimiter = ','
+
+    def parse(lines):
+        return np.loadtxt(lines, delimiter=delimiter, usecols=usecols,
+                          dtype=np.float64, ndmin=2)
+
+    num_lines = count_lines(path)
+    coords = None
+    count = 0
+    with open_text(path) as f:
+        lines = (line for line in f if line.strip())
+        first = next(lines, None)
+        if first is None:
+            raise ValueError(f"{path} is empty")
+        try:
+            pending = [first] if parse([first]).size else []
+        except ValueError:
+            # Header
+            num_lines -= 1
+            pending = []
+
+        while True:
+            chunk = pending + list(itertools.islice(lines, chunk_size))
+            pending = []
+            if not chunk:
+                break
+            values = parse(chunk)
+            if coords is None:
+                # Upper bound, blank lines are dropped below
+                coords = allocate('coords', (num_lines, values.shape[1]),
+                                  dtype)
+            coords[count:count + len(values)] = values
+            count += len(values)
+
+    if coords is None:
+        raise ValueError(f"{path} has no coordinates")
+    if count != len(coords):
+        coords = coords[:count]
+    return coords
+
+
+# Maps the coordinates of an .npy or raw binary file (no copy if dtype is
+# the dtype of the file)
+def read_binary(path, source_dtype=np.float32, dimensionality=None,
+                offset=0):
+    if detect_format(path) == 'npy':
+        coords = np.load(path, mmap_mode='r')
+    else:
+        if dimensionality is None:
+            raise ValueError("The dimensionality of raw binary files should "
+                             "be given")
+        coords = np.memmap(path, dtype=source_dtype, mode='r', offset=offset)
+        if coords.size % dimensionality != 0:
+            raise ValueError(f"The size of {path} is not a multiple of "
+                             f"{dimensionality} coordinates")
+        coords = coords.reshape(-1, dimensionality)
+    if coords.ndim != 2:
+        raise ValueError(f"Expected (num_cities, dimensionality) "
+                         f"coordinates, got {coords.shape}")
+    return coords
+
+
+def data_cache_dir(cache_dir=None):
+    if cache_dir is None:
+        cache_dir = Compiler.cache_dir
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    return os.path.join(cache_dir, 'data')
+
+
+# The cache file of what is loaded from path with the given parameters, it
+# changes when the file does
+def cache_file(path, kind, cache_dir, *parameters):
+    stat = os.stat(path)
+    key = fingerprint(kind, os.path.abspath(path), stat.st_size,
+                      stat.st_mtime_ns, *parameters)
+    name = os.path.basename(path).split('.')[0]
+    return os.path.join(data_cache_dir(cache_dir),
+                        f'{name}-{kind}-{key[:16]}.npy')
+
+
+# Creates the cache file target with fill(allocate), fill creates its arrays
+# with allocate(name, shape, dtype) (only one of them can be cached) and
+# returns the cached one. The file is written under a temporary name and
+# renamed when complete so that a load interrupted half way never leaves a
+# corrupted cache behind
+def write_cache(target, fill, array_name):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    mapped = []
+
+    def allocate(name, shape, dtype):
+        if name != array_name:
+            return allocate_in_memory(name, shape, dtype)
+        array = np.lib.format.open_memmap(temporary, mode='w+', dtype=dtype,
+                                          shape=shape)
+        mapped.append(array)
+        return array
+
+    try:
+        result = fill(allocate)
+        if result is None:
+            raise ValueError(f"No {array_name} found")
+        if mapped and result is mapped[0]:
+            result.flush()
+        else:
+            # Truncated (see read_csv), the file has the wrong shape
+            np.save(f'{temporary}.npy', result)
+            os.replace(f'{temporary}.npy', temporary)
+        del result, mapped[:]
+        os.replace(temporary, target)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def read_array(path, name, format, dtype, weights_dtype, source_dtype,
+               dimensionality, delimiter, usecols, allocate, chunk_size):
+    if format == 'tsplib':
+        _, coords, edge_weights = read_tsplib(path, dtype, weights_dtype,
+                                              allocate, chunk_size)
+        return coords if name == 'coords' else edge_weights
+    if name != 'coords':
+        raise ValueError(f"{format} files only have coordinates")
+    if format == 'csv':
+        return read_csv(path, dtype, delimiter, usecols, allocate,
+                        chunk_size)
+    if format in ('npy', 'binary'):
+        source = read_binary(path, source_dtype, dimensionality)
+        coords = allocate('coords', source.shape, dtype)
+        for start in range(0, len(source), chunk_size):
+            coords[start:start + chunk_size] = source[start:start
+                                                      + chunk_size]
+        return coords
+    raise ValueError(f"{format} not available, choose from "
+                     f"{', '.join(FORMATS)}")
+
+
+def load_array(path, name, format=None, dtype=np.float32,
+               weights_dtype=np.float32, source_dtype=np.float32,
+               dimensionality=None, delimiter=None, usecols=None, cache=True,
+               cache_dir=None, chunk_size=CHUNK_SIZE):
+    if format is None:
+        format = detect_format(path)
+
+    def fill(allocate):
+        return read_array(path, name, format, dtype, weights_dtype,
+                          source_dtype, dimensionality, delimiter, usecols,
+                          allocate, chunk_size)
+
+    # Binary files already in the right dtype are mapped directly
+    if format in ('npy', 'binary'):
+        source = read_binary(path, source_dtype, dimensionality)
+        if source.dtype == np.dtype(dtype):
+            return source
+
+    if not cache:
+        result = fill(allocate_in_memory)
+        if result is None:
+            raise ValueError(f"{path} has no {name}")
+        return result
+
+    target = cache_file(path, name, cache_dir, format, np.dtype(dtype),
+                        np.dtype(weights_dtype), np.dtype(source_dtype),
+                        dimensionality, delimiter, usecols)
+    if not os.path.exists(target):
+        try:
+            write_cache(target, fill, name)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from None
+    return np.load(target, mmap_mode='r')
+
+
+# The (num_cities, dimensionality) coordinates of the instance in path (see
+# the top of this file for the formats and the cache). Binary files have
+# coordinates of source_dtype
+def load_coordinates(path, format=None, dtype=np.float32,
+                     source_dtype=np.float32, dimensionality=None,
+                     delimiter=None, usecols=None, cache=True, cache_dir=None,
+                     chunk_size=CHUNK_SIZE):
+    return load_array(path, 'coords', format=format, dtype=dtype,
+                      source_dtype=source_dtype,
+                      dimensionality=dimensionality, delimiter=delimiter,
+                      usecols=usecols, cache=cache, cache_dir=cache_dir,
+                      chunk_size=chunk_size)
+
+
+# The packed edge weights of the EDGE_WEIGHT_SECTION of a TSPLIB file (see
+# read_edge_weights)
+def load_edge_weights(path, dtype=np.float32, cache=True, cache_dir=None,
+                      chunk_size=CHUNK_SIZE):
+    return load_array(path, 'edge_weights', format='tsplib',
+                      weights_dtype=dtype, cache=cache, cache_dir=cache_dir,
+                      chunk_size=chunk_size)
+
+
+# The problem data of Problem for the instance in path, as a one element
+# array of Problem.problem_data_dtype that can be given to the runners in
+# place of the coordinates. options are given to load_coordinates, the
+# coordinates are converted to the dtype of the problem (float64 if it
+# quantizes them).
+#
+# With cache=True the prepared data is cached too (keyed on the file, the
+# problem data dtype and the code of Problem.prepare_data) and mapped copy on
+# write: runners use it without copying or parsing anything and never write
+# to the cache file
+def load_problem_data(Problem, path, cache=True, cache_dir=None, **options):
+    dtype = Problem.problem_data_dtype
+    if dtype is None or 'coords' not in dtype.names:
+        raise ValueError(f"{Problem.__name__} does not take coordinates")
+
+    # Grid coordinates are computed by prepare_data from the original ones
+    coords_dtype = dtype['coords'].base
+    if not np.issubdtype(coords_dtype, np.floating):
+        coords_dtype = np.float64
+
+    def fill(allocate):
+        coords = load_coordinates(path, dtype=coords_dtype, cache=cache,
+                                  cache_dir=cache_dir, **options)
+        problem_data = allocate('problem_data', (1,), dtype)
+        problem_data[0] = Problem.prepare_data(coords)
+        return problem_data
+
+    if not cache:
+        return fill(allocate_in_memory)
+
+    target = cache_file(path, 'problem_data', cache_dir, dtype,
+                        Problem.prepare_data, sorted(options.items()))
+    if not os.path.exists(target):
+        write_cache(target, fill, 'problem_data')
+    return np.asarray(np.load(target, mmap_mode='c'))
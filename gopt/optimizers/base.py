@@ -30,18 +30,24 @@ class Optimizer(Compilable, metaclass=ABCMeta):
     # Since this is compiled and really fast we need to run a decent
     # number of iterations before going back to python
     #
+    # counters is the row of the member in the telemetry counters, the
+    # optimizer adds the moves it accepted and the ones that improved its
+    # best solution (see gopt.telemetry)
+    #
     # Please note the lack of *self* as the first argument!
     @staticmethod
     @abstractmethod
     def step(my_state, solution_states, solution_losses, problem_data,
-             iterations):
+             iterations, counters):
         raise NotImplementedError
 
     # This is the function called to initialize the state of the optimizer
+    # pop_id is the index of the member in the population
     #
     # Please note the lack of *self* as the first argument!
     @staticmethod
-    def init(my_state, solution_states, solution_losses, problem_data):
+    def init(my_state, solution_states, solution_losses, problem_data,
+             pop_id):
         pass
 
     # Since the generated code depends on the Problem, it has to be
@@ -60,13 +66,14 @@ class Optimizer(Compilable, metaclass=ABCMeta):
             cls.state_ntype = numba.typeof(cls.state_dtype).dtype
 
         # Should be the signature of the function returned by
-        # generate_state_code
-        step_signature = numba.float32(  # Return the loss of its best solution
+        # generate_state_code (it returns the loss of its best solution)
+        step_signature = Compiler.loss_ntype(
             cls.state_ntype,
             numba.types.Array(cls.Problem.state_ntype, 1, 'C'),
             Compiler.loss_array_ntype,
             cls.Problem.pdata_ntype,
-            numba.int64
+            numba.int64,
+            numba.types.Array(numba.int64, 1, 'C')
         )
 
         # Should be the signature of the function returned by
@@ -76,6 +83,7 @@ class Optimizer(Compilable, metaclass=ABCMeta):
             numba.types.Array(cls.Problem.state_ntype, 1, 'C'),
             Compiler.loss_array_ntype,
             cls.Problem.pdata_ntype,
+            numba.int64
         )
 
         state_allocator = Compiler.generate_allocator(cls.__name__,
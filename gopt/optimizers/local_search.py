@@ -2,6 +2,7 @@ import numpy as np
 import numba
 
 from .base import Optimizer
+from ..telemetry import ACCEPTED, IMPROVED
 
 def RandomLocalSearch(Problem):
 
@@ -11,43 +12,115 @@ def RandomLocalSearch(Problem):
     # Otherwise numba will be confused
     copy_state = problem.copy_state
     neighbor_loss = problem.neighbor_loss
+    undo = problem.undo
+    move_delta = problem.move_delta
+    apply_move = problem.apply_move
+    sample_move = problem.sample_move
 
     problem_nh_dim = np.array(Problem.neighbor_dimensionality).astype('int32')
 
+    # Moves are tried on a copy of the best solution, accepted moves are
+    # copied back and rejected ones are overwritten by the best solution
+    def step_with_copy(my_state, solution_states, solution_losses,
+                       problem_data, iterations, counters):
+
+        # The original loss has been computed in the init function
+        best_so_far = solution_losses[0]
+
+        copy_state(solution_states, 0, solution_states, 1)
+
+        direction = np.zeros(len(problem_nh_dim), dtype='int32')
+        # Only improving moves are accepted
+        improved = 0
+
+        for _ in range(iterations):
+            sample_move(solution_states[1], problem_data, direction)
+            new_loss = neighbor_loss(solution_states[1], problem_data,
+                                     direction, best_so_far)
+            if new_loss < best_so_far:
+                best_so_far = new_loss
+                improved += 1
+                copy_state(solution_states, 1, solution_states, 0)
+            else:
+                copy_state(solution_states, 0, solution_states, 1)
+
+        solution_losses[0] = best_so_far
+        counters[ACCEPTED] += improved
+        counters[IMPROVED] += improved
+
+        return best_so_far
+
+    # Moves are applied in place on the best solution and rejected ones are
+    # reverted with the undo function of the problem
+    def step_with_undo(my_state, solution_states, solution_losses,
+                       problem_data, iterations, counters):
+
+        # The original loss has been computed in the init function
+        best_so_far = solution_losses[0]
+
+        direction = np.zeros(len(problem_nh_dim), dtype='int32')
+        # Only improving moves are accepted
+        improved = 0
+
+        for _ in range(iterations):
+            sample_move(solution_states[0], problem_data, direction)
+            new_loss = neighbor_loss(solution_states[0], problem_data,
+                                     direction, best_so_far)
+            if new_loss < best_so_far:
+                best_so_far = new_loss
+                improved += 1
+            else:
+                undo(solution_states[0], problem_data, direction)
+
+        solution_losses[0] = best_so_far
+        counters[ACCEPTED] += improved
+        counters[IMPROVED] += improved
+
+        return best_so_far
+
+    # Moves are evaluated without touching the state and only the accepted
+    # ones are applied to the best solution
+    def step_with_delta(my_state, solution_states, solution_losses,
+                        problem_data, iterations, counters):
+
+        # The original loss has been computed in the init function
+        best_so_far = solution_losses[0]
+
+        direction = np.zeros(len(problem_nh_dim), dtype='int32')
+        # Only improving moves are accepted
+        improved = 0
+
+        for _ in range(iterations):
+            sample_move(solution_states[0], problem_data, direction)
+            new_loss = best_so_far + move_delta(solution_states[0],
+                                                problem_data, direction)
+            if new_loss < best_so_far:
+                best_so_far = new_loss
+                improved += 1
+                apply_move(solution_states[0], problem_data, direction)
+
+        solution_losses[0] = best_so_far
+        counters[ACCEPTED] += improved
+        counters[IMPROVED] += improved
+
+        return best_so_far
+
     class RandomLocalSearch(Optimizer):
         # This optimizer doesn't need anything other than
         # the state of solutions
         state_dtype = None
 
         # Needs two solutions, the current best one (by convention at index 0)
-        # and the current one
-        states_required = 2
-
-        @staticmethod
-        def step(my_state, solution_states, solution_losses, problem_data,
-                 iterations):
-
-            # The original loss has been computed in the init function
-            best_so_far = solution_losses[0]
-
-            copy_state(solution_states, 0, solution_states, 1)
-
-            direction = np.zeros(len(problem_nh_dim), dtype='int32')
-
-            for _ in range(iterations):
-                for i, max_val in enumerate(problem_nh_dim):
-                    direction[i] = np.random.randint(0, max_val)
-                new_loss = neighbor_loss(solution_states[1], problem_data,
-                                         direction, best_so_far)
-                if new_loss < best_so_far:
-                    best_so_far = new_loss
-                    copy_state(solution_states, 1, solution_states, 0)
-                else:
-                    copy_state(solution_states, 0, solution_states, 1)
-
-            solution_losses[0] = best_so_far
-
-            return best_so_far
+        # and the current one, unless the problem knows how to undo its
+        # moves
+        states_required = 2 if undo is None and move_delta is None else 1
+
+    if move_delta is not None:
+        RandomLocalSearch.step = staticmethod(step_with_delta)
+    elif undo is not None:
+        RandomLocalSearch.step = staticmethod(step_with_undo)
+    else:
+        RandomLocalSearch.step = staticmethod(step_with_copy)
 
     RandomLocalSearch.Problem = Problem
 
@@ -1,48 +1,281 @@
 import numpy as np
 
 from .base import Optimizer
+from ..compiler import Compiler
+from ..telemetry import ACCEPTED, IMPROVED
 
-def SimulatedAnnealing(Problem, start_temp=1000, temp_decay=1e-5):
+SCHEDULES = ['geometric', 'linear', 'adaptive']
+
+# Simulated annealing
+#
+# Every member of the population keeps its own temperature so members can be
+# at different stages of the annealing (after a reheat, a migration...)
+#
+# schedule:
+# - 'geometric': temperature *= 1 - temp_decay after each iteration
+# - 'linear': temperature -= temp_decay after each iteration
+# - 'adaptive': the temperature is adjusted after each batch of
+#   batch_size iterations to keep the acceptance rate of the moves close
+#   to target_acceptance
+# Temperature never goes below min_temp
+#
+# reheat_after: if the best solution of a member did not improve for that
+# many iterations its temperature is set back to reheat_temp (start_temp by
+# default)
+#
+# temperatures: if provided, the i-th member runs at the fixed temperature
+# temperatures[i] (no schedule, no reheating). This is the ladder used by
+# the ParallelTempering shuffler
+#
+# The Metropolis test exp(-delta / T) > u is done as delta < T * -log(u).
+# The -log(u) thresholds are drawn by batches of batch_size so the hot loop
+# only does a multiplication and a comparison
+def SimulatedAnnealing(Problem, start_temp=1000, temp_decay=1e-5,
+                       schedule='geometric', min_temp=1e-9,
+                       target_acceptance=0.1, adaptation_rate=0.05,
+                       reheat_after=None, reheat_temp=None, batch_size=256,
+                       temperatures=None):
+
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Unknown schedule {schedule}, "
+                         f"available: {', '.join(SCHEDULES)}")
+    if reheat_temp is None:
+        reheat_temp = start_temp
+    reheat = reheat_after is not None
+    if not reheat:
+        reheat_after = 0
+    geometric = schedule == 'geometric'
+    linear = schedule == 'linear'
+    adaptive = schedule == 'adaptive'
+
+    ladder = temperatures is not None
+    if ladder:
+        temperatures = np.array(temperatures, dtype=np.float64)
+        if temperatures.ndim != 1 or np.any(temperatures <= 0):
+            raise ValueError("temperatures should be a list of positive "
+                             "temperatures")
+        geometric = linear = adaptive = reheat = False
+    else:
+        temperatures = np.full(1, start_temp, dtype=np.float64)
 
     problem = Problem.compile()
 
     # We have to extract the functions from the namespace object
     # Otherwise numba will be confused
-    loss = problem.loss
     copy_state = problem.copy_state
+    neighbor = problem.neighbor
     neighbor_loss = problem.neighbor_loss
+    undo = problem.undo
+    move_delta = problem.move_delta
+    apply_move = problem.apply_move
+    sample_move = problem.sample_move
+
+    problem_nh_dim = np.array(Problem.neighbor_dimensionality).astype('int32')
+
+    # The best solution and the current one, plus a scratch one if the
+    # problem can't evaluate or undo moves
+    states_required = 3 if undo is None and move_delta is None else 2
+
+    # States are organized as:
+    # - 0: the best solution found by this member
+    # - 1: the current solution of the chain
+    # - 2: the candidate solution (only if the problem can't undo its moves)
+    #
+    # While the chain improves on its best, state 0 is not updated. It is
+    # only written back when the chain is about to move away from it (or at
+    # the end of the step) so that long descents don't copy the solution at
+    # every iteration
+
+    @Compiler.ufunc
+    def fill_thresholds(thresholds):
+        for i in range(len(thresholds)):
+            thresholds[i] = -np.log(1.0 - np.random.random())
+
+    @Compiler.ufunc
+    def cool(temperature):
+        if geometric:
+            temperature *= 1 - temp_decay
+        elif linear:
+            temperature -= temp_decay
+        return max(temperature, min_temp)
+
+    @Compiler.ufunc
+    def adapt(temperature, accepted, tried):
+        if adaptive:
+            if accepted < target_acceptance * tried:
+                temperature *= 1 + adaptation_rate
+            else:
+                temperature *= 1 - adaptation_rate
+        return max(temperature, min_temp)
+
+    # Generates the step function, evaluate_move(solution_states,
+    # problem_data, direction, current_loss, move) returns the loss of the
+    # move drawn in direction and accept_move/reject_move are called
+    # depending on the outcome of the Metropolis test. save_current writes
+    # the current solution, without the move being accepted, in state 0.
+    # move is scratch space to keep a copy of the direction
+    def generate_step(evaluate_move, accept_move, reject_move, save_current):
+
+        def step(my_state, solution_states, solution_losses, problem_data,
+                 iterations, counters):
+
+            best_so_far = solution_losses[0]
+            current_loss = solution_losses[1]
+            # Whether the current solution is the best one (and state 0 is
+            # possibly outdated)
+            at_best = current_loss <= best_so_far
+
+            temperature = my_state['temperature']
+            stagnation = my_state['stagnation']
+
+            direction = np.zeros(len(problem_nh_dim), dtype='int32')
+            move = np.zeros(len(problem_nh_dim), dtype='int32')
+            thresholds = np.empty(batch_size)
+
+            total_accepted = 0
+            improved = 0
+            done = 0
+            while done < iterations:
+                batch = min(batch_size, iterations - done)
+                fill_thresholds(thresholds[:batch])
+                accepted = 0
+
+                for i in range(batch):
+                    sample_move(solution_states[1], problem_data, direction)
+                    new_loss = evaluate_move(solution_states, problem_data,
+                                             direction, current_loss, move)
+                    delta = new_loss - current_loss
+
+                    if delta < temperature * thresholds[i]:
+                        if at_best and delta > 0:
+                            save_current(solution_states, problem_data,
+                                         direction, move)
+                            at_best = False
+                        accept_move(solution_states, problem_data, direction)
+                        current_loss = new_loss
+                        accepted += 1
+                        if current_loss < best_so_far:
+                            best_so_far = current_loss
+                            at_best = True
+                            stagnation = 0
+                            improved += 1
+                    else:
+                        reject_move(solution_states, problem_data, direction)
+
+                    stagnation += 1
+                    temperature = cool(temperature)
+                    if reheat and stagnation > reheat_after:
+                        temperature = reheat_temp
+                        stagnation = 0
+
+                temperature = adapt(temperature, accepted, batch)
+                total_accepted += accepted
+                done += batch
+
+            if at_best:
+                copy_state(solution_states, 1, solution_states, 0)
+
+            solution_losses[0] = best_so_far
+            solution_losses[1] = current_loss
+            my_state['temperature'] = temperature
+            my_state['stagnation'] = stagnation
+            counters[ACCEPTED] += total_accepted
+            counters[IMPROVED] += improved
+
+            # Reading it back from the array rather than returning
+            # best_so_far keeps numba's parallel reduction analysis of the
+            # runner from following the cycle between the losses once
+            # everything is inlined
+            return solution_losses[0]
+
+        return step
+
+    # The move is not applied to the current solution yet
+    def save_unchanged(solution_states, problem_data, direction, move):
+        copy_state(solution_states, 1, solution_states, 0)
+
+    # Moves are evaluated without touching the state and only the accepted
+    # ones are applied
+    def evaluate_with_delta(solution_states, problem_data, direction,
+                            current_loss, move):
+        return current_loss + move_delta(solution_states[1], problem_data,
+                                         direction)
+
+    def accept_with_delta(solution_states, problem_data, direction):
+        apply_move(solution_states[1], problem_data, direction)
+
+    def reject_with_delta(solution_states, problem_data, direction):
+        pass
+
+    # Moves are applied in place and rejected ones are reverted
+    # neighbor can overwrite direction with what undo needs so the move
+    # drawn is kept in move
+    def evaluate_with_undo(solution_states, problem_data, direction,
+                           current_loss, move):
+        move[:] = direction
+        return neighbor_loss(solution_states[1], problem_data, direction,
+                             current_loss)
+
+    def accept_with_undo(solution_states, problem_data, direction):
+        pass
+
+    def reject_with_undo(solution_states, problem_data, direction):
+        undo(solution_states[1], problem_data, direction)
+
+    # The move is already applied: it is reverted to save the solution and
+    # applied again
+    def save_with_undo(solution_states, problem_data, direction, move):
+        undo(solution_states[1], problem_data, direction)
+        copy_state(solution_states, 1, solution_states, 0)
+        neighbor(solution_states[1], problem_data, move)
+
+    # Moves are tried on a copy of the current solution
+    def evaluate_with_copy(solution_states, problem_data, direction,
+                           current_loss, move):
+        copy_state(solution_states, 1, solution_states, 2)
+        return neighbor_loss(solution_states[2], problem_data, direction,
+                             current_loss)
+
+    def accept_with_copy(solution_states, problem_data, direction):
+        copy_state(solution_states, 2, solution_states, 1)
+
+    def reject_with_copy(solution_states, problem_data, direction):
+        pass
 
     class SimulatedAnnealing(Optimizer):
-        # This optimizer doesn't need anything other than
-        # the state of solutions
         state_dtype = np.dtype([
-            ('current_temp', np.float32),
-            ('temp_decay', np.float32)
+            ('temperature', np.float64),
+            # Iterations since the last improvement of the best solution
+            ('stagnation', np.int64)
         ])
 
-        # Needs two solutions, the current best one (by convention at index 0)
-        # and the current one
-        states_required = 2
-
         @staticmethod
-        def init(optimizer_state, problem_data):
-            optimizer_state['current_temp'] = start_temp
-            optimizer_state['temp_decay'] = temp_decay
+        def init(my_state, solution_states, solution_losses, problem_data,
+                 pop_id):
+            if ladder:
+                my_state['temperature'] = temperatures[pop_id]
+            else:
+                my_state['temperature'] = start_temp
+            my_state['stagnation'] = 0
+            # The chain starts from the initial solution
+            for i in range(1, states_required):
+                copy_state(solution_states, 0, solution_states, i)
+                solution_losses[i] = solution_losses[0]
 
-        @staticmethod
-        def step(optimizer_state, solution_states, problem_data, iterations):
-            best_so_far = loss(solution_states[0], problem_data)
-            copy_state(solution_states, 0, solution_states, 1)
-
-            for _ in range(iterations):
-                new_loss = neighbor_loss(solution_states[1], problem_data,
-                                         best_so_far)
-                if new_loss < best_so_far:
-                    best_so_far = new_loss
-                    copy_state(solution_states, 1, solution_states, 0)
-                else:
-                    copy_state(solution_states, 0, solution_states, 1)
-            return best_so_far
+    if move_delta is not None:
+        moves = (evaluate_with_delta, accept_with_delta, reject_with_delta,
+                 save_unchanged)
+    elif undo is not None:
+        moves = (evaluate_with_undo, accept_with_undo, reject_with_undo,
+                 save_with_undo)
+    else:
+        moves = (evaluate_with_copy, accept_with_copy, reject_with_copy,
+                 save_unchanged)
+
+    SimulatedAnnealing.states_required = states_required
+    SimulatedAnnealing.temperatures = temperatures if ladder else None
+    SimulatedAnnealing.step = staticmethod(generate_step(
+        *(Compiler.ufunc(f) for f in moves)))
 
     SimulatedAnnealing.Problem = Problem
 
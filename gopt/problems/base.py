@@ -44,6 +44,73 @@ class Problem(Compilable, metaclass=ABCMeta):
     def neighbor(state, problem_data, direction):
         raise NotImplementedError
 
+    # Optional: reverts the move applied by the last call to neighbor
+    # It receives the same direction array that neighbor got. neighbor is
+    # allowed to overwrite it with whatever it needs to undo the move (swapped
+    # indices, bounds of a reversed segment...) so undo only has to touch
+    # the part of the state that changed.
+    # When it is provided optimizers don't need to keep a copy of the state
+    # to be able to reject a move
+    #
+    # Please note the lack of *self* as the first argument!
+    # def undo(state, problem_data, direction):
+    undo = None
+
+    # Optional: pure version of neighbor, returns the loss difference the
+    # move would make without modifying the state. It must be provided
+    # together with apply_move which applies the move to the state.
+    # Optimizers rejecting most moves then never pay for applying them
+    #
+    # Please note the lack of *self* as the first argument!
+    # def move_delta(state, problem_data, direction):
+    # def apply_move(state, problem_data, direction):
+    move_delta = None
+    apply_move = None
+
+    # Optional: fills direction with the next move to try
+    # By default moves are drawn uniformly in neighbor_dimensionality
+    #
+    # Please note the lack of *self* as the first argument!
+    # def sample_move(state, problem_data, direction):
+    sample_move = None
+
+    # Optional: writes in child a recombination of the solutions parent_a
+    # and parent_b. Used by evolutionary shufflers
+    #
+    # Please note the lack of *self* as the first argument!
+    # def crossover(parent_a, parent_b, child, problem_data):
+    crossover = None
+
+    # Converts the data provided by the user into an instance of
+    # problem_data_dtype (precomputations, extra fields...)
+    # This one is not compiled and is called once by the runner
+    @staticmethod
+    def prepare_data(data):
+        return data
+
+    # Converts a solution back to the representation of the user (undoing
+    # what prepare_data might have done, renumbering...)
+    # This one is not compiled and is called by the runner on the result
+    @staticmethod
+    def export_solution(state, problem_data):
+        return state
+
+    # Compact binary representation of a solution, used to send solutions
+    # to other machines. decode_solution writes the solution back in state,
+    # it raises a ValueError if data is not a valid solution
+    # These are not compiled
+    @staticmethod
+    def encode_solution(state):
+        return state.tobytes()
+
+    @classmethod
+    def decode_solution(cls, data, state):
+        if len(data) != cls.state_dtype.itemsize:
+            raise ValueError("Invalid encoded solution")
+        decoded = np.frombuffer(data, dtype=cls.state_dtype)[0]
+        for name in cls.state_dtype.names:
+            state[name] = decoded[name]
+
     ######
     # GOPT internals, do not overwrite!
     ######
@@ -61,19 +128,29 @@ class Problem(Compilable, metaclass=ABCMeta):
         direction_ntype = numba.types.Array(numba.int32, 1, 'C')
 
         # Signatures
-        loss_signature = numba.float32(state_ntype, pdata_ntype)
-        neighbor_signature = numba.optional(numba.float32)(state_ntype,
-                                                           pdata_ntype,
-                                                           direction_ntype)
-        neighbor_loss_signature = numba.float32(state_ntype,
-                                                pdata_ntype,
-                                                direction_ntype,
-                                                numba.optional(numba.float32))
+        loss_ntype = Compiler.loss_ntype
+        loss_signature = loss_ntype(state_ntype, pdata_ntype)
+        neighbor_signature = numba.optional(loss_ntype)(state_ntype,
+                                                        pdata_ntype,
+                                                        direction_ntype)
+        neighbor_loss_signature = loss_ntype(state_ntype,
+                                             pdata_ntype,
+                                             direction_ntype,
+                                             numba.optional(loss_ntype))
         copy_signature = numba.void(numba.types.Array(state_ntype, 1, 'C'),
                                     numba.int64,
                                     numba.types.Array(state_ntype, 1, 'C'),
                                     numba.int64)
         init_state_signature = numba.void(state_ntype, pdata_ntype)
+        undo_signature = numba.void(state_ntype, pdata_ntype, direction_ntype)
+        sample_move_signature = numba.void(state_ntype, pdata_ntype,
+                                           direction_ntype)
+        move_delta_signature = loss_ntype(state_ntype, pdata_ntype,
+                                          direction_ntype)
+        apply_move_signature = numba.void(state_ntype, pdata_ntype,
+                                          direction_ntype)
+        crossover_signature = numba.void(state_ntype, state_ntype,
+                                         state_ntype, pdata_ntype)
 
         cls.state_ntype = state_ntype
         cls.pdata_ntype = pdata_ntype
@@ -82,6 +159,17 @@ class Problem(Compilable, metaclass=ABCMeta):
         def copy(source, source_ix, dest, dest_ix):
             dest[dest_ix:dest_ix + 1] = source[source_ix:source_ix + 1]
 
+        nh_dim = np.array(cls.neighbor_dimensionality).astype('int32')
+
+        def uniform_sample_move(state, problem_data, direction):
+            for i, max_val in enumerate(nh_dim):
+                direction[i] = np.random.randint(0, max_val)
+
+        if cls.sample_move is None:
+            sample_move = uniform_sample_move
+        else:
+            sample_move = cls.sample_move
+
         allocator = Compiler.generate_allocator(cls.__name__, cls.state_dtype)
 
         # Compilation of all the functions
@@ -91,6 +179,32 @@ class Problem(Compilable, metaclass=ABCMeta):
                             cls.state_init)
         neighbor = Compiler.jit(cls.__name__, 'movement function',
                                 neighbor_signature, cls.neighbor)
+        sample_move = Compiler.jit(cls.__name__, 'move sampler',
+                                   sample_move_signature, sample_move)
+        if cls.undo is None:
+            undo = None
+        else:
+            undo = Compiler.jit(cls.__name__, 'undo function',
+                                undo_signature, cls.undo)
+
+        if (cls.move_delta is None) != (cls.apply_move is None):
+            raise AssertionError(
+                "move_delta and apply_move have to be provided together")
+
+        if cls.move_delta is None:
+            move_delta = None
+            apply_move = None
+        else:
+            move_delta = Compiler.jit(cls.__name__, 'move delta function',
+                                      move_delta_signature, cls.move_delta)
+            apply_move = Compiler.jit(cls.__name__, 'apply move function',
+                                      apply_move_signature, cls.apply_move)
+
+        if cls.crossover is None:
+            crossover = None
+        else:
+            crossover = Compiler.jit(cls.__name__, 'crossover',
+                                     crossover_signature, cls.crossover)
 
         def pre_neighbor_loss(state, problem_data, direction,
                               previous_loss=None):
@@ -122,6 +236,11 @@ class Problem(Compilable, metaclass=ABCMeta):
         cls._compiled = SimpleNamespace(allocator=allocator, copy_state=copy,
                                         init_state=init, loss=loss,
                                         neighbor=neighbor,
-                                        neighbor_loss=neighbor_loss)
+                                        neighbor_loss=neighbor_loss,
+                                        sample_move=sample_move,
+                                        undo=undo,
+                                        move_delta=move_delta,
+                                        apply_move=apply_move,
+                                        crossover=crossover)
 
         return cls._compiled
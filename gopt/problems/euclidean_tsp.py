@@ -1,54 +1,316 @@
 import logging
-from os import stat
 import numba
 import numpy as np
 from ..compiler import Compiler
 
 from .base import Problem
+from . import spatial
+from .spatial import nearest_neighbors
+from .tsp_construction import TSPConstructions, INIT_CANDIDATES
+from .tsp_crossover import TSPCrossovers
+from .tsp_two_level import TwoLevelList, two_level_fields, tour_order, build_tour
 
+DISTANCE_MODES = ['coords', 'matrix', 'auto']
+TOURS = ['array', 'two-level']
+CROSSOVERS = ['OX', 'EAX']
+
+# Largest grid coordinate of each integer coordinate dtype. Squared
+# distances are computed in float64 from the grid coordinates (see
+# coords_distance): exactly for uint16 grids, rounded to the precision of
+# float64 for int32 grids. These stop at 2 ** 30 so that the differences of
+# coordinates fit in an int32
+GRID_LEVELS = {
+    np.dtype(np.uint16): (1 << 16) - 1,
+    np.dtype(np.int32): (1 << 30) - 1
+}
+
+# Levels of the quantized distance matrix, 0 is kept for null distances
+DISTANCE_LEVELS = 1 << 16
+# Tours are stored as int16 below this number of cities
+INT16_CITIES = 1 << 15
+
+# candidates: if provided, moves are generated from each city and one of its
+# `candidates` nearest neighbors instead of uniformly at random. This is what
+# makes local search scale to large instances
+#
+# distance_mode: how distances are obtained
+# - 'coords': computed from the coordinates every time
+# - 'matrix': precomputed in a packed triangular matrix of matrix_dtype
+#   (np.float32, or np.uint16 to quantize them: distances are rounded on a
+#   logarithmic scale going from the shortest distance between neighboring
+#   cities to the longest one, so every distance is stored with the same
+#   relative precision, about 1e-4 on uniform instances)
+# - 'auto': 'matrix' if it fits in memory_budget bytes, otherwise 'coords'
+#
+# renumber: if True cities are renumbered along a Hilbert curve so that
+# cities close in space are close in memory. Solutions given back in the
+# Result use the original numbering
+#
+# crossover: recombination used by evolutionary shufflers, order crossover
+# ('OX') or edge assembly crossover ('EAX'), see tsp_crossover.py
+#
+# dtype: type of the coordinates. With an integer type (np.uint16 or
+# np.int32) coordinates are quantized on a grid: they are stored in grid
+# units as round((x - grid_offset) / grid_scale), with the same scale for
+# every dimension, which divides the memory traffic of the coordinates by 2
+# (uint16) compared to float32. Distances are computed from the grid
+# coordinates and converted back to the original unit, they are off by at
+# most about a grid step (the largest extent of the instance divided by
+# 65535 for uint16, 2 ** 30 - 1 for int32)
+#
+# Tours are stored as int16 for instances of less than 32768 cities and
+# int32 otherwise
+#
+# tour: layout of the tour in the state
+# - 'array': the cities in visiting order, reversing a segment of the tour
+#   costs its length (at most n / 2, the shorter side is reversed)
+# - 'two-level': a two-level doubly linked list (see tsp_two_level.py),
+#   2-opt reversals cost O(sqrt(n)) but finding the successor of a city is
+#   a few indirections. Only available with the 2-opt neighborhood, moves
+#   are given as the cities at the ends of the reversed path
 def EuclieanTSP(num_cities, dimensionality, neighborhood='2-opt', init='NN',
-                dtype=np.float32):
+                dtype=np.float32, candidates=None, distance_mode='coords',
+                matrix_dtype=np.float32, memory_budget=1 << 29,
+                renumber=False, crossover='EAX', tour='array'):
     if dimensionality < 2:
         logging.warning("Seriously ? -_-")
 
-    @Compiler.ufunc
-    def distance(a, b, problem_data):
-        result = 0.0
-        for i in range(dimensionality):
-            result += (problem_data[a, i] - problem_data[b, i]) ** 2
-        return result
+    if tour not in TOURS:
+        raise ValueError(f"{tour} not available, choose from "
+                         f"{', '.join(TOURS)}")
+    two_level = tour == 'two-level'
+    if two_level and neighborhood != '2-opt':
+        raise ValueError("tour='two-level' is only available with the 2-opt "
+                         "neighborhood")
+
+    # Whether we maintain the position of each city in the tour
+    track_positions = candidates is not None and not two_level
+
+    if distance_mode not in DISTANCE_MODES:
+        raise ValueError(f"{distance_mode} not available, choose from "
+                         f"{', '.join(DISTANCE_MODES)}")
+
+    dtype = np.dtype(dtype)
+    grid = dtype in GRID_LEVELS
+    if not grid and dtype not in (np.float32, np.float64):
+        raise ValueError("dtype should be np.float32, np.float64, np.uint16 "
+                         "or np.int32")
+
+    matrix_dtype = np.dtype(matrix_dtype)
+    if matrix_dtype not in (np.float32, np.uint16):
+        raise ValueError("matrix_dtype should be np.float32 or np.uint16")
+
+    matrix_size = num_cities * (num_cities - 1) // 2
+
+    if distance_mode == 'auto':
+        if matrix_size * matrix_dtype.itemsize <= memory_budget:
+            distance_mode = 'matrix'
+        else:
+            distance_mode = 'coords'
+        logging.info(f"Using distance_mode='{distance_mode}'")
+
+    if crossover not in CROSSOVERS:
+        raise ValueError(f"{crossover} not available, choose from "
+                         f"{', '.join(CROSSOVERS)}")
+
+    quantized = matrix_dtype == np.uint16
+
+    # In grid units for grid coordinates (see point_distance)
+    if grid:
+        @Compiler.ufunc
+        def coords_distance(coords, a, b):
+            result = 0.0
+            for i in range(dimensionality):
+                result += (np.float64(coords[a, i]) - coords[b, i]) ** 2
+            return result
+    else:
+        @Compiler.ufunc
+        def coords_distance(coords, a, b):
+            result = 0.0
+            for i in range(dimensionality):
+                result += (coords[a, i] - coords[b, i]) ** 2
+            return result
+
+    # Distance between cities in the original unit
+    if grid:
+        @Compiler.ufunc
+        def point_distance(problem_data, a, b):
+            scale = problem_data['grid_scale']
+            return (coords_distance(problem_data['coords'], a, b)
+                    * scale * scale)
+    else:
+        @Compiler.ufunc
+        def point_distance(problem_data, a, b):
+            return coords_distance(problem_data['coords'], a, b)
+
+    if distance_mode == 'matrix' and quantized:
+        @Compiler.ufunc
+        def distance(a, b, problem_data):
+            if a == b:
+                return 0.0
+            if a < b:
+                a, b = b, a
+            ix = np.int64(a) * (a - 1) // 2 + b
+            return problem_data['distance_levels'][
+                problem_data['distances'][ix]]
+    elif distance_mode == 'matrix':
+        @Compiler.ufunc
+        def distance(a, b, problem_data):
+            if a == b:
+                return 0.0
+            if a < b:
+                a, b = b, a
+            ix = np.int64(a) * (a - 1) // 2 + b
+            return problem_data['distances'][ix] * problem_data['scale']
+    else:
+        @Compiler.ufunc
+        def distance(a, b, problem_data):
+            return point_distance(problem_data, a, b)
+
+    # Precomputations (only compiled if needed)
+    # They are in grid units for grid coordinates, prepare_data converts them
+    #
+    # Quantized distances d are stored as the level
+    # 1 + round(log(d / shortest) / step), see distance_levels
+    def fill_matrix(coords, matrix, shortest, step):
+        for a in numba.prange(1, num_cities):
+            start = np.int64(a) * (a - 1) // 2
+            for b in range(a):
+                value = coords_distance(coords, a, b)
+                if not quantized:
+                    matrix[start + b] = value
+                elif value == 0:
+                    matrix[start + b] = 0
+                else:
+                    level = np.rint(np.log(np.sqrt(value) / shortest) / step)
+                    matrix[start + b] = 1 + min(max(level, 0),
+                                                DISTANCE_LEVELS - 2)
 
     @Compiler.ufunc
     def f(i):
         return i % num_cities
 
+    # Primitives modifying the tour
+    # They are the only ones allowed to write to state['order'] so that the
+    # city -> position index stays consistent
+    if two_level:
+        two_level_tour = TwoLevelList(num_cities)
+        next_city = two_level_tour.next
+        prev_city = two_level_tour.prev
+        reverse_path = two_level_tour.reverse
+        linearize = two_level_tour.tour_order
+
+        # The initializers write the tour in state['order']
+        index_positions = two_level_tour.build
+    elif track_positions:
+        @Compiler.ufunc
+        def reverse(state, a, b):
+            order = state['order']
+            position = state['position']
+            for i in range(0, (b - a + 1) // 2):
+                order[a + i], order[b - i] = order[b - i], order[a + i]
+                position[order[a + i]] = a + i
+                position[order[b - i]] = b - i
+
+        @Compiler.ufunc
+        def swap(state, a, b):
+            order = state['order']
+            position = state['position']
+            order[a], order[b] = order[b], order[a]
+            position[order[a]] = a
+            position[order[b]] = b
+
+        @Compiler.ufunc
+        def index_positions(state):
+            order = state['order']
+            position = state['position']
+            for i in range(num_cities):
+                position[order[i]] = i
+    else:
+        @Compiler.ufunc
+        def reverse(state, a, b):
+            order = state['order']
+            for i in range(0, (b - a + 1) // 2):
+                order[a + i], order[b - i] = order[b - i], order[a + i]
+
+        @Compiler.ufunc
+        def swap(state, a, b):
+            order = state['order']
+            order[a], order[b] = order[b], order[a]
+
+        @Compiler.ufunc
+        def index_positions(state):
+            pass
+
+    # Reversing [a, b] or the rest of the tour gives the same cycle, we
+    # reverse whichever is shorter. At most half of the tour is touched
+    @Compiler.ufunc
+    def reverse_shorter(state, a, b):
+        if 2 * (b - a + 1) <= num_cities:
+            reverse(state, a, b)
+        else:
+            # The rest of the tour wraps around the end of the array
+            start = b + 1
+            end = a - 1 + num_cities
+            for i in range(0, (end - start + 1) // 2):
+                swap(state, f(start + i), f(end - i))
+
     def random_init(state, _):
-        for i in np.random.permutation(np.arange(num_cities)):
-            state['order'][i] = i
+        state['order'][:] = np.random.permutation(num_cities)
+        index_positions(state)
 
+    kdtree_sizes = Compiler.ufunc(spatial.kdtree_sizes)
+    kdtree_remove = Compiler.ufunc(spatial.kdtree_remove)
+    kdtree_nearest = Compiler.ufunc(spatial.kdtree_nearest)
+
+    # Nearest neighbor tour from a random city
+    # Closest unvisited cities are found with the kd-tree of the problem
+    # data so it is O(n log n)
     def nn_init(state, problem_data):
-        unvisited = []
-        for i in range(num_cities):
-            unvisited.append(i)
-        unvisited = np.array(unvisited)
-        curr_node = np.random.choice(unvisited)
-        unvisited = np.delete(unvisited, curr_node)
-        state['order'][0] = curr_node
-        i = 0
-        while i < num_cities - 1:
-            curr_node = int(state['order'][i])
-            best_node, best_idx = unvisited[0], 0
-            min_dist = distance(curr_node, best_node, problem_data)
-            for j in range(len(unvisited)):
-                node = unvisited[j]
-                dist = distance(curr_node, node, problem_data)
-                if dist < min_dist:
-                    best_node = node
-                    best_idx = j
-                    min_dist = dist
-            i += 1
-            unvisited = np.delete(unvisited, best_idx)
-            state['order'][i] = best_node
+        coords = problem_data['coords']
+        ix = problem_data['kdtree']
+        split_dims = problem_data['kdtree_dims']
+        tree_position = problem_data['kdtree_position']
+        order = state['order']
+
+        sizes = kdtree_sizes(num_cities)
+        alive = np.ones(num_cities, dtype=np.bool_)
+
+        curr_node = np.random.randint(0, num_cities)
+        kdtree_remove(sizes, alive, tree_position[curr_node])
+        order[0] = curr_node
+        for i in range(1, num_cities):
+            curr_node = kdtree_nearest(coords, ix, split_dims, sizes, alive,
+                                       curr_node)
+            kdtree_remove(sizes, alive, tree_position[curr_node])
+            order[i] = curr_node
+        index_positions(state)
+
+    # Constructions from tsp_construction.py
+    construction = None
+    if init in ('greedy', 'savings', 'hilbert'):
+        construction = TSPConstructions(num_cities, dimensionality)[init]
+
+    def construction_init(state, problem_data):
+        construction(state['order'], problem_data)
+        index_positions(state)
+
+    # Crossovers from tsp_crossover.py
+    recombine = TSPCrossovers(num_cities, distance, candidates)[crossover]
+
+    if two_level:
+        def crossover_func(parent_a, parent_b, child, problem_data):
+            tour_a = parent_a['order'].copy()
+            tour_b = parent_b['order'].copy()
+            linearize(parent_a, tour_a)
+            linearize(parent_b, tour_b)
+            recombine(tour_a, tour_b, child['order'], problem_data)
+            index_positions(child)
+    else:
+        def crossover_func(parent_a, parent_b, child, problem_data):
+            recombine(parent_a['order'], parent_b['order'], child['order'],
+                      problem_data)
+            index_positions(child)
 
     def neighbor_swapTwo(state, problem_data, direction):
         order = state['order']
@@ -66,7 +328,7 @@ def EuclieanTSP(num_cities, dimensionality, neighborhood='2-opt', init='NN',
 
         loss_diff = 0
         loss_diff -= d(a - 1, a) + d(a, a + 1) + d(b - 1, b) + d(b, b + 1)
-        order[a], order[b] = order[b], order[a]
+        swap(state, a, b)
         loss_diff += d(a - 1, a) + d(a, a + 1) + d(b - 1, b) + d(b, b + 1)
 
         return loss_diff
@@ -92,18 +354,329 @@ def EuclieanTSP(num_cities, dimensionality, neighborhood='2-opt', init='NN',
         loss_diff -= d(a - 1, a) + d(b, b + 1)
         loss_diff += d(a - 1, b) + d(a, b + 1)
 
-        for i in range(0, (b - a + 1) // 2):
-            order[a + i], order[b - i] = order[b - i], order[a + i]
+        reverse_shorter(state, a, b)
 
         return loss_diff
 
+    # Loss difference of neighbor_swapTwo without modifying the state
+    def delta_swapTwo(state, problem_data, direction):
+        order = state['order']
+
+        a = direction[0]
+        b = direction[1]
+
+        if (a == b):
+            return 0.0
+
+        # City at position i once a and b are swapped
+        def swapped(i):
+            i = f(i)
+            if i == a:
+                return order[b]
+            if i == b:
+                return order[a]
+            return order[i]
+
+        def d(x, y):
+            return distance(order[f(x)], order[f(y)], problem_data)
+
+        def new_d(x, y):
+            return distance(swapped(x), swapped(y), problem_data)
+
+        loss_diff = 0
+        loss_diff -= d(a - 1, a) + d(a, a + 1) + d(b - 1, b) + d(b, b + 1)
+        loss_diff += (new_d(a - 1, a) + new_d(a, a + 1)
+                      + new_d(b - 1, b) + new_d(b, b + 1))
+
+        return loss_diff
+
+    # Loss difference of neighbor_twoOpt without modifying the state
+    # Only the two edges at the ends of the segment change so it is O(1)
+    def delta_twoOpt(state, problem_data, direction):
+        order = state['order']
+        def d(a, b):
+            return distance(order[f(a)], order[f(b)], problem_data)
+
+        a = direction[0]
+        b = direction[1]
+
+        if b < a:
+            a, b = b, a
+
+        if (a == b) or (a == 0 and b == num_cities - 1):
+            return 0.0
+
+        loss_diff = 0
+        loss_diff -= d(a - 1, a) + d(b, b + 1)
+        loss_diff += d(a - 1, b) + d(a, b + 1)
+
+        return loss_diff
+
+    # Swapping two cities and reversing a segment are their own inverse so
+    # these are used both to apply and to undo moves
+    def apply_swapTwo(state, problem_data, direction):
+        swap(state, direction[0], direction[1])
+
+    def apply_twoOpt(state, problem_data, direction):
+        a = direction[0]
+        b = direction[1]
+
+        if b < a:
+            a, b = b, a
+
+        # neighbor_twoOpt doesn't touch the state in that case
+        if a == 0 and b == num_cities - 1:
+            return
+
+        # Applying it twice restores the state as the same side is reversed
+        reverse_shorter(state, a, b)
+
+    # 2-opt on the two-level list
+    # direction is the first and the last city of the reversed path
+    @Compiler.ufunc
+    def reversal_delta(state, problem_data, x, y):
+        if x == y:
+            return 0.0
+        before = prev_city(state, x)
+        after = next_city(state, y)
+        # Reversing the whole tour
+        if after == x:
+            return 0.0
+
+        loss_diff = 0
+        loss_diff -= (distance(before, x, problem_data)
+                      + distance(y, after, problem_data))
+        loss_diff += (distance(before, y, problem_data)
+                      + distance(x, after, problem_data))
+        return loss_diff
+
+    def neighbor_twoLevel(state, problem_data, direction):
+        loss_diff = reversal_delta(state, problem_data, direction[0],
+                                   direction[1])
+        reverse_path(state, direction[0], direction[1])
+        return loss_diff
+
+    def delta_twoLevel(state, problem_data, direction):
+        return reversal_delta(state, problem_data, direction[0],
+                              direction[1])
+
+    def apply_twoLevel(state, problem_data, direction):
+        reverse_path(state, direction[0], direction[1])
+
+    # The reversed path goes from y to x
+    def undo_twoLevel(state, problem_data, direction):
+        reverse_path(state, direction[1], direction[0])
+
+    # Segment insertion moves (or-opt and 3-opt)
+    #
+    # The segment [s, e] (s <= e, no wrap around) is moved right after
+    # position c (outside of the segment, c = -1 means at the start) and
+    # optionally reversed. It is implemented with reversals so it costs
+    # O(|c - s|) and keeps the position index up to date
+    @Compiler.ufunc
+    def move_segment(state, s, e, c, rev):
+        # Inserting the segment where it already is
+        if f(c + 1) == s:
+            if rev:
+                reverse(state, s, e)
+        elif c > e:
+            if not rev:
+                reverse(state, s, e)
+            reverse(state, e + 1, c)
+            reverse(state, s, c)
+        else:
+            reverse(state, c + 1, s - 1)
+            if not rev:
+                reverse(state, s, e)
+            reverse(state, c + 1, e)
+
+    # Only three edges change so it is O(1)
+    @Compiler.ufunc
+    def move_segment_delta(state, problem_data, s, e, c, rev):
+        order = state['order']
+        def d(a, b):
+            return distance(order[f(a)], order[f(b)], problem_data)
+
+        if f(c + 1) == s:
+            if not rev:
+                return 0.0
+            return d(s - 1, e) + d(s, e + 1) - d(s - 1, s) - d(e, e + 1)
+
+        first, last = s, e
+        if rev:
+            first, last = e, s
+
+        loss_diff = 0
+        loss_diff -= d(s - 1, s) + d(e, e + 1) + d(c, c + 1)
+        loss_diff += d(s - 1, e + 1) + d(c, first) + d(last, c + 1)
+        return loss_diff
+
+    # Parameters of the move that puts the segment back where it was
+    @Compiler.ufunc
+    def inverse_segment_move(s, e, c, rev):
+        length = e - s + 1
+        if f(c + 1) == s:
+            return s, e, c, rev
+        elif c > e:
+            return c - length + 1, c, s - 1, rev
+        else:
+            return c + 1, c + length, e, rev
+
+    # direction is (start, insert after, length - 1, reversed)
+    # Segments are of length 1 to 3
+    @Compiler.ufunc
+    def orOpt_move(direction):
+        s = direction[0]
+        e = s + direction[2]
+        c = direction[1]
+        valid = e < num_cities and not (s <= c <= e)
+        return valid, s, e, c, direction[3] == 1
+
+    # direction is (one end, other end, insert after, reversed)
+    @Compiler.ufunc
+    def threeOpt_move(direction):
+        s = direction[0]
+        e = direction[1]
+        if e < s:
+            s, e = e, s
+        c = direction[2]
+        valid = not (s <= c <= e) and not (s == 0 and e == num_cities - 1)
+        return valid, s, e, c, direction[3] == 1
+
+    # Generates the neighbor/delta/apply/undo functions of a segment
+    # insertion neighborhood from the function decoding its directions
+    def segment_moves(decode_move):
+        def neighbor(state, problem_data, direction):
+            valid, s, e, c, rev = decode_move(direction)
+            if not valid:
+                return 0.0
+            loss_diff = move_segment_delta(state, problem_data, s, e, c, rev)
+            move_segment(state, s, e, c, rev)
+            return loss_diff
+
+        def delta(state, problem_data, direction):
+            valid, s, e, c, rev = decode_move(direction)
+            if not valid:
+                return 0.0
+            return move_segment_delta(state, problem_data, s, e, c, rev)
+
+        def apply(state, problem_data, direction):
+            valid, s, e, c, rev = decode_move(direction)
+            if valid:
+                move_segment(state, s, e, c, rev)
+
+        def undo(state, problem_data, direction):
+            valid, s, e, c, rev = decode_move(direction)
+            if valid:
+                s, e, c, rev = inverse_segment_move(s, e, c, rev)
+                move_segment(state, s, e, c, rev)
+
+        return neighbor, delta, apply, undo
+
+    neighbor_orOpt, delta_orOpt, apply_orOpt, undo_orOpt = \
+        segment_moves(orOpt_move)
+    neighbor_threeOpt, delta_threeOpt, apply_threeOpt, undo_threeOpt = \
+        segment_moves(threeOpt_move)
+
+    # Candidate restricted samplers
+    # They pick a random city and one of its nearest neighbors and return
+    # the move that makes them adjacent in the tour
+    def sample_swapTwo(state, problem_data, direction):
+        c1 = np.random.randint(0, num_cities)
+        c2 = problem_data['candidates'][c1, np.random.randint(0, candidates)]
+        position = state['position']
+        # Bring c2 right after c1
+        direction[0] = f(position[c1] + 1)
+        direction[1] = position[c2]
+
+    def sample_twoOpt(state, problem_data, direction):
+        c1 = np.random.randint(0, num_cities)
+        c2 = problem_data['candidates'][c1, np.random.randint(0, candidates)]
+        position = state['position']
+        i = position[c1]
+        j = position[c2]
+        if j < i:
+            i, j = j, i
+        # Reversing [i + 1, j] creates the edges (order[i], order[j]) and
+        # (order[i + 1], order[j + 1]), reversing [i, j - 1] creates the
+        # edges (order[i - 1], order[j - 1]) and (order[i], order[j]). In
+        # both cases (order[i], order[j]) is the edge between c1 and c2
+        if np.random.randint(0, 2) == 0:
+            direction[0] = i + 1
+            direction[1] = j
+        else:
+            direction[0] = i
+            direction[1] = j - 1
+
+    # Reversing the path from the successor of c1 to c2 creates the edges
+    # (c1, c2) and (next(c1), next(c2)), reversing the path from c1 to the
+    # predecessor of c2 creates (prev(c1), prev(c2)) and (c1, c2)
+    def sample_twoLevel(state, problem_data, direction):
+        c1 = np.random.randint(0, num_cities)
+        c2 = problem_data['candidates'][c1, np.random.randint(0, candidates)]
+        if np.random.randint(0, 2) == 0:
+            direction[0] = next_city(state, c1)
+            direction[1] = c2
+        else:
+            direction[0] = c1
+            direction[1] = prev_city(state, c2)
+
+    # Move a segment starting with c2 right after c1
+    def sample_orOpt(state, problem_data, direction):
+        c1 = np.random.randint(0, num_cities)
+        c2 = problem_data['candidates'][c1, np.random.randint(0, candidates)]
+        position = state['position']
+        direction[0] = position[c2]
+        direction[1] = position[c1]
+        direction[2] = np.random.randint(0, 3)
+        direction[3] = 0
+
+    # Move a segment with c2 at one end right after c1, with c2 first
+    def sample_threeOpt(state, problem_data, direction):
+        c1 = np.random.randint(0, num_cities)
+        c2 = problem_data['candidates'][c1, np.random.randint(0, candidates)]
+        position = state['position']
+        direction[0] = position[c2]
+        direction[1] = np.random.randint(0, num_cities)
+        direction[2] = position[c1]
+        direction[3] = 0 if direction[0] <= direction[1] else 1
+
     init_funcs = {
         'random': random_init,
-        'NN': nn_init
+        'NN': nn_init,
+        'greedy': construction_init,
+        'savings': construction_init,
+        'hilbert': construction_init
     }
     neighbor_funcs = {
         'swap-2': neighbor_swapTwo,
-        '2-opt': neighbor_twoOpt
+        '2-opt': neighbor_twoOpt,
+        'or-opt': neighbor_orOpt,
+        '3-opt': neighbor_threeOpt
+    }
+    delta_funcs = {
+        'swap-2': delta_swapTwo,
+        '2-opt': delta_twoOpt,
+        'or-opt': delta_orOpt,
+        '3-opt': delta_threeOpt
+    }
+    apply_funcs = {
+        'swap-2': apply_swapTwo,
+        '2-opt': apply_twoOpt,
+        'or-opt': apply_orOpt,
+        '3-opt': apply_threeOpt
+    }
+    undo_funcs = {
+        'swap-2': apply_swapTwo,
+        '2-opt': apply_twoOpt,
+        'or-opt': undo_orOpt,
+        '3-opt': undo_threeOpt
+    }
+    neighbor_dims = {
+        'swap-2': (num_cities, num_cities),
+        '2-opt': (num_cities, num_cities),
+        'or-opt': (num_cities, num_cities, 3, 2),
+        '3-opt': (num_cities, num_cities, num_cities, 2)
     }
 
     init_func = init_funcs.get(init, None)
@@ -117,23 +690,209 @@ def EuclieanTSP(num_cities, dimensionality, neighborhood='2-opt', init='NN',
         raise ValueError(f"""{neighborhood} not available, choose from
                          {', '.join(neighbor_funcs.keys())}""")
 
+    sample_funcs = {
+        'swap-2': sample_swapTwo,
+        '2-opt': sample_twoOpt,
+        'or-opt': sample_orOpt,
+        '3-opt': sample_threeOpt
+    }
+
+    tour_dtype = np.int16 if num_cities < INT16_CITIES else np.int32
+    if two_level:
+        state_fields = two_level_fields(num_cities, tour_dtype)
+    else:
+        state_fields = [('order', (tour_dtype, num_cities))]
+    # What export_solution gives back
+    solution_dtype = np.dtype([('order', (tour_dtype, num_cities))])
+    data_fields = [('coords', (dtype, (num_cities, dimensionality)))]
+    if grid:
+        data_fields.append(('grid_scale', np.float64))
+        data_fields.append(('grid_offset', (np.float64, dimensionality)))
+    if track_positions:
+        state_fields.append(('position', (tour_dtype, num_cities)))
+    if candidates is not None:
+        data_fields.append(('candidates', (np.int32, (num_cities,
+                                                      candidates))))
+    # Whether the initializer needs the kd-tree / neighbor lists
+    init_kdtree = init in ('NN', 'greedy', 'savings')
+    init_candidates = min(INIT_CANDIDATES, num_cities - 1)
+    if init in ('greedy', 'savings'):
+        data_fields.append(('init_candidates',
+                            (np.int32, (num_cities, init_candidates))))
+    if renumber:
+        data_fields.append(('original_ids', (np.int32, num_cities)))
+    if init_kdtree:
+        data_fields.append(('kdtree', (np.int32, num_cities)))
+        data_fields.append(('kdtree_dims', (np.int32, num_cities)))
+        data_fields.append(('kdtree_position', (np.int32, num_cities)))
+    if distance_mode == 'matrix':
+        data_fields.append(('distances', (matrix_dtype, matrix_size)))
+    if distance_mode == 'matrix' and quantized:
+        data_fields.append(('distance_levels', (np.float64,
+                                                DISTANCE_LEVELS)))
+    elif distance_mode == 'matrix':
+        data_fields.append(('scale', np.float64))
+
+    order_dtype = np.uint16 if num_cities <= 1 << 16 else np.uint32
+
+    # Range of the logarithmic scale of the quantized matrix: from the
+    # shortest non null distance between a city and its nearest neighbor to
+    # an upper bound of the longest distance (in grid units for grid
+    # coordinates)
+    def distance_levels(coords):
+        coords = coords.astype(np.float64)
+        nearest = nearest_neighbors(coords, 1)[:, 0]
+        lengths = np.sqrt(((coords - coords[nearest]) ** 2).sum(axis=1))
+        lengths = lengths[lengths > 0]
+        shortest = lengths.min() if lengths.size else 1.0
+        longest = max(np.sqrt(((coords.max(axis=0) - coords.min(axis=0))
+                               ** 2).sum()), shortest * 2)
+        step = np.log(longest / shortest) / (DISTANCE_LEVELS - 2)
+        return float(shortest), float(step)
+
     class TSP(Problem):
         problem_name = 'TSP'
-        state_dtype = np.dtype([
-            ('order', (np.int32, num_cities))
-        ])
-        problem_data_dtype = np.dtype((dtype, (num_cities, dimensionality)))
+        state_dtype = np.dtype(state_fields)
+        problem_data_dtype = np.dtype(data_fields)
         # This describe the dim of the neighborhood
-        neighbor_dimensionality = (num_cities, num_cities)
+        neighbor_dimensionality = neighbor_dims[neighborhood]
 
+        if two_level:
+            @staticmethod
+            def loss(state_array, problem_data):
+                result = 0
+                city = state_array['order'][0]
+                for i in range(num_cities):
+                    following = next_city(state_array, city)
+                    result += distance(city, following, problem_data)
+                    city = following
+                return result
+        else:
+            @staticmethod
+            def loss(state_array, problem_data):
+                result = 0
+                order = state_array['order']
+                for i in range(num_cities):
+                    result += distance(order[f(i)], order[f(i + 1)],
+                                       problem_data)
+                return result
+
+        # Takes the coordinates of the cities as a (num_cities,
+        # dimensionality) array
         @staticmethod
-        def loss(state_array, problem_data):
-            result = 0
-            order = state_array['order']
-            for i in range(num_cities):
-                result += distance(order[f(i)], order[f(i + 1)], problem_data)
+        def prepare_data(data):
+            data = np.asarray(data)
+            if data.shape != (num_cities, dimensionality):
+                raise ValueError(f"Expected coordinates of shape "
+                                 f"{(num_cities, dimensionality)}, "
+                                 f"got {data.shape}")
+
+            problem_data = np.zeros(1, dtype=TSP.problem_data_dtype)[0]
+            if renumber:
+                original_ids = spatial.hilbert_order(data)
+                problem_data['original_ids'] = original_ids
+                data = data[original_ids]
+            # Squared grid step, to convert the distances computed from the
+            # grid coordinates
+            unit = 1.0
+            if grid:
+                data = data.astype(np.float64)
+                offset = data.min(axis=0)
+                grid_extent = float((data.max(axis=0) - offset).max())
+                grid_scale = 1.0
+                if grid_extent > 0:
+                    grid_scale = grid_extent / GRID_LEVELS[dtype]
+                problem_data['grid_scale'] = grid_scale
+                problem_data['grid_offset'] = offset
+                problem_data['coords'] = np.rint((data - offset) / grid_scale)
+                unit = grid_scale * grid_scale
+            else:
+                problem_data['coords'] = data
+            if candidates is not None:
+                problem_data['candidates'] = nearest_neighbors(data,
+                                                               candidates)
+
+            coords = problem_data['coords']
+            if init in ('greedy', 'savings'):
+                problem_data['init_candidates'] = nearest_neighbors(
+                    coords, init_candidates)
+            if init_kdtree:
+                ix, split_dims = spatial.kdtree(coords)
+                problem_data['kdtree'] = ix
+                problem_data['kdtree_dims'] = split_dims
+                problem_data['kdtree_position'][ix] = np.arange(num_cities)
+
+            if distance_mode == 'matrix':
+                shortest, step = 1.0, 1.0
+                if quantized:
+                    shortest, step = distance_levels(coords)
+                    levels = np.arange(DISTANCE_LEVELS - 1)
+                    problem_data['distance_levels'][1:] = (
+                        shortest * np.exp(levels * step)) ** 2 * unit
+                else:
+                    problem_data['scale'] = unit
+                fill = Compiler.jit(TSP.__name__, 'distance matrix', None,
+                                    fill_matrix, parallel=True)
+                fill(coords, problem_data['distances'], shortest, step)
+
+            return problem_data
+
+        # The two-level list is converted to the array layout
+        @staticmethod
+        def export_solution(state, problem_data):
+            if two_level:
+                solution = np.zeros(1, dtype=solution_dtype)[0]
+                tour_order(state, solution['order'])
+                state = solution
+            if not renumber:
+                return state
+            original_ids = problem_data['original_ids']
+            result = np.zeros(1, dtype=state.dtype)[0]
+            result['order'] = original_ids[state['order']]
+            if track_positions:
+                result['position'][original_ids] = state['position']
             return result
 
-    TSP.neighbor = staticmethod(neighbor_func)
+        # Only the order is sent, with the smallest integer type that fits
+        @staticmethod
+        def encode_solution(state):
+            order = state['order']
+            if two_level:
+                order = np.empty_like(order)
+                tour_order(state, order)
+            return order.astype(order_dtype).tobytes()
+
+        @staticmethod
+        def decode_solution(data, state):
+            # Comes from the network: anything else than a permutation of
+            # the cities would make the kernels read out of bounds
+            if len(data) != num_cities * np.dtype(order_dtype).itemsize:
+                raise ValueError("Invalid encoded tour")
+            order = np.frombuffer(data, dtype=order_dtype)
+            if (order.max() >= num_cities or not
+                    (np.bincount(order, minlength=num_cities) == 1).all()):
+                raise ValueError("The encoded tour is not a permutation of "
+                                 "the cities")
+            state['order'] = order
+            if track_positions:
+                state['position'][order] = np.arange(num_cities)
+            if two_level:
+                build_tour(state)
+
+    if two_level:
+        TSP.neighbor = staticmethod(neighbor_twoLevel)
+        TSP.move_delta = staticmethod(delta_twoLevel)
+        TSP.apply_move = staticmethod(apply_twoLevel)
+        TSP.undo = staticmethod(undo_twoLevel)
+        if candidates is not None:
+            TSP.sample_move = staticmethod(sample_twoLevel)
+    else:
+        TSP.neighbor = staticmethod(neighbor_func)
+        TSP.move_delta = staticmethod(delta_funcs[neighborhood])
+        TSP.apply_move = staticmethod(apply_funcs[neighborhood])
+        TSP.undo = staticmethod(undo_funcs[neighborhood])
+        if track_positions:
+            TSP.sample_move = staticmethod(sample_funcs[neighborhood])
     TSP.state_init = staticmethod(init_func)
+    TSP.crossover = staticmethod(crossover_func)
     return TSP
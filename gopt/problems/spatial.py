@@ -0,0 +1,293 @@
+import numba
+import numpy as np
+
+from ..compiler import Compiler
+
+# Spatial indexing helpers used to prepare the data of geometric problems
+#
+# Points can have integer coordinates (see the grid coordinates of
+# EuclieanTSP), differences are computed in float64 so that unsigned
+# coordinates don't wrap around.
+#
+# They are compiled the first time they are used so that they pick up the
+# Compiler settings chosen by the user
+
+# A kd-tree is stored implicitly as a permutation of the points: the node
+# covering the range [lo, hi) is the point at (lo + hi) // 2, its left
+# subtree covers [lo, mid) and its right subtree [mid + 1, hi).
+# split_dims[mid] is the dimension used to split at that node
+def build_kdtree(points):
+    n, dimensionality = points.shape
+    ix = np.arange(n)
+    split_dims = np.zeros(n, dtype=np.int32)
+
+    stack = [(0, n)]
+    while len(stack) > 0:
+        lo, hi = stack.pop()
+        if hi - lo <= 0:
+            continue
+
+        # Split along the dimension with the largest spread
+        best_dim = 0
+        best_spread = -1.0
+        for dim in range(dimensionality):
+            low = np.inf
+            high = -np.inf
+            for i in range(lo, hi):
+                value = points[ix[i], dim]
+                low = min(low, value)
+                high = max(high, value)
+            if high - low > best_spread:
+                best_spread = high - low
+                best_dim = dim
+
+        sub = ix[lo:hi].copy()
+        ix[lo:hi] = sub[np.argsort(points[sub, best_dim])]
+
+        mid = (lo + hi) // 2
+        split_dims[mid] = best_dim
+        stack.append((lo, mid))
+        stack.append((mid + 1, hi))
+
+    return ix, split_dims
+
+
+# Number of points in each subtree of an implicit kd-tree of n points,
+# indexed by the position of the root of the subtree
+def kdtree_sizes(n):
+    sizes = np.empty(n, dtype=np.int32)
+    stack = [(0, n)]
+    while len(stack) > 0:
+        lo, hi = stack.pop()
+        if hi - lo <= 0:
+            continue
+        mid = (lo + hi) // 2
+        sizes[mid] = hi - lo
+        stack.append((lo, mid))
+        stack.append((mid + 1, hi))
+    return sizes
+
+
+# Removes the point at position p of the tree, sizes and alive are updated
+def kdtree_remove(sizes, alive, p):
+    lo = 0
+    hi = len(sizes)
+    while True:
+        mid = (lo + hi) // 2
+        sizes[mid] -= 1
+        if mid == p:
+            break
+        if p < mid:
+            hi = mid
+        else:
+            lo = mid + 1
+    alive[p] = False
+
+
+# Point still in the tree that is the closest to the point `query`
+# Subtrees without any point left are skipped so a query is O(log n) on
+# average
+def kdtree_nearest(points, ix, split_dims, sizes, alive, query):
+    n, dimensionality = points.shape
+    best = -1
+    best_dist = np.inf
+
+    stack_lo = np.empty(128, dtype=np.int64)
+    stack_hi = np.empty(128, dtype=np.int64)
+    stack_bound = np.empty(128, dtype=np.float64)
+    stack_lo[0] = 0
+    stack_hi[0] = n
+    stack_bound[0] = 0.0
+    stack_size = 1
+
+    while stack_size > 0:
+        stack_size -= 1
+        lo = stack_lo[stack_size]
+        hi = stack_hi[stack_size]
+        if hi - lo <= 0 or stack_bound[stack_size] >= best_dist:
+            continue
+        mid = (lo + hi) // 2
+        if sizes[mid] == 0:
+            continue
+
+        point = ix[mid]
+        if alive[mid]:
+            dist = 0.0
+            for dim in range(dimensionality):
+                dist += (np.float64(points[query, dim])
+                         - points[point, dim]) ** 2
+            if dist < best_dist:
+                best_dist = dist
+                best = point
+
+        dim = split_dims[mid]
+        diff = np.float64(points[query, dim]) - points[point, dim]
+
+        if diff < 0:
+            near_lo, near_hi, far_lo, far_hi = lo, mid, mid + 1, hi
+        else:
+            near_lo, near_hi, far_lo, far_hi = mid + 1, hi, lo, mid
+
+        stack_lo[stack_size] = far_lo
+        stack_hi[stack_size] = far_hi
+        stack_bound[stack_size] = diff * diff
+        stack_lo[stack_size + 1] = near_lo
+        stack_hi[stack_size + 1] = near_hi
+        stack_bound[stack_size + 1] = 0.0
+        stack_size += 2
+
+    return best
+
+
+# Position of the cell (x, y) along a Hilbert curve covering a grid of
+# 2 ** bits x 2 ** bits cells
+def hilbert_index(bits, x, y):
+    n = 1 << bits
+    d = 0
+    s = n // 2
+    while s > 0:
+        rx = 1 if (x & s) > 0 else 0
+        ry = 1 if (y & s) > 0 else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s //= 2
+    return d
+
+
+_compiled = {}
+
+
+def compile_build_kdtree():
+    if 'build_kdtree' not in _compiled:
+        _compiled['build_kdtree'] = Compiler.ufunc(build_kdtree)
+    return _compiled['build_kdtree']
+
+
+def compile_knn():
+    if 'knn' in _compiled:
+        return _compiled['knn']
+
+    compiled_build_kdtree = compile_build_kdtree()
+
+    # k nearest neighbors (excluding itself) of every point sorted by
+    # increasing distance
+    def knn(points, k):
+        n, dimensionality = points.shape
+        ix, split_dims = compiled_build_kdtree(points)
+        result = np.empty((n, k), dtype=np.int32)
+
+        for query in numba.prange(n):
+            best_dist = np.full(k, np.inf)
+            best_ix = np.zeros(k, dtype=np.int32)
+
+            # Ranges left to explore with a lower bound on their distance
+            stack_lo = np.empty(128, dtype=np.int64)
+            stack_hi = np.empty(128, dtype=np.int64)
+            stack_bound = np.empty(128, dtype=np.float64)
+            stack_lo[0] = 0
+            stack_hi[0] = n
+            stack_bound[0] = 0.0
+            stack_size = 1
+
+            while stack_size > 0:
+                stack_size -= 1
+                lo = stack_lo[stack_size]
+                hi = stack_hi[stack_size]
+                if hi - lo <= 0 or stack_bound[stack_size] >= best_dist[k - 1]:
+                    continue
+
+                mid = (lo + hi) // 2
+                point = ix[mid]
+
+                if point != query:
+                    dist = 0.0
+                    for dim in range(dimensionality):
+                        dist += (np.float64(points[query, dim])
+                                 - points[point, dim]) ** 2
+                    if dist < best_dist[k - 1]:
+                        # Insertion in the sorted list of the best so far
+                        j = k - 1
+                        while j > 0 and best_dist[j - 1] > dist:
+                            best_dist[j] = best_dist[j - 1]
+                            best_ix[j] = best_ix[j - 1]
+                            j -= 1
+                        best_dist[j] = dist
+                        best_ix[j] = point
+
+                dim = split_dims[mid]
+                diff = (np.float64(points[query, dim])
+                        - points[point, dim])
+
+                # The far side is pushed first so that the near one is explored
+                # first and shrinks the search radius
+                if diff < 0:
+                    near_lo, near_hi, far_lo, far_hi = lo, mid, mid + 1, hi
+                else:
+                    near_lo, near_hi, far_lo, far_hi = mid + 1, hi, lo, mid
+
+                stack_lo[stack_size] = far_lo
+                stack_hi[stack_size] = far_hi
+                stack_bound[stack_size] = diff * diff
+                stack_lo[stack_size + 1] = near_lo
+                stack_hi[stack_size + 1] = near_hi
+                stack_bound[stack_size + 1] = 0.0
+                stack_size += 2
+
+            result[query] = best_ix
+
+        return result
+
+    _compiled['knn'] = Compiler.jit('spatial', 'knn', None, knn,
+                                    parallel=True)
+    return _compiled['knn']
+
+
+def compile_hilbert_keys():
+    if 'hilbert_keys' in _compiled:
+        return _compiled['hilbert_keys']
+
+    compiled_hilbert_index = Compiler.ufunc(hilbert_index)
+
+    # Hilbert index of each point (using its first two dimensions)
+    def hilbert_keys(points, bits):
+        n = points.shape[0]
+        x_min = points[:, 0].min()
+        y_min = points[:, 1].min()
+        extent = max(points[:, 0].max() - x_min, points[:, 1].max() - y_min,
+                     1e-30)
+        grid = (1 << bits) - 1
+
+        keys = np.empty(n, dtype=np.int64)
+        for i in numba.prange(n):
+            x = np.int64((points[i, 0] - x_min) / extent * grid)
+            y = np.int64((points[i, 1] - y_min) / extent * grid)
+            keys[i] = compiled_hilbert_index(bits, x, y)
+        return keys
+
+    _compiled['hilbert_keys'] = Compiler.jit('spatial', 'hilbert_keys', None,
+                                             hilbert_keys, parallel=True)
+    return _compiled['hilbert_keys']
+
+
+# Order of the points along a Hilbert curve
+def hilbert_order(points, bits=16):
+    keys = compile_hilbert_keys()(np.ascontiguousarray(points), bits)
+    return np.argsort(keys, kind='stable')
+
+
+# Returns the implicit kd-tree (see build_kdtree) of the points
+def kdtree(points):
+    return compile_build_kdtree()(np.ascontiguousarray(points))
+
+
+# Returns an (n, k) int32 array with the k nearest neighbors of each point
+def nearest_neighbors(points, k):
+    n = points.shape[0]
+    if not 0 < k < n:
+        raise ValueError(f"Number of neighbors should be in [1, {n - 1}]")
+
+    return compile_knn()(np.ascontiguousarray(points), k)
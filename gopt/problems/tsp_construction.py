@@ -0,0 +1,201 @@
+import numpy as np
+
+from ..compiler import Compiler
+from . import spatial
+
+# Construction heuristics for TSP tours
+#
+# They work on the coordinates and the kd-tree/neighbor lists computed when
+# preparing the problem data. They only allocate local memory and draw their
+# randomness from np.random so they can run in parallel for every member of
+# the population and give each of them a different tour.
+
+# Number of neighbors considered to build the candidate edges of the
+# greedy and savings constructions
+INIT_CANDIDATES = 10
+
+# Relative noise applied to the keys of the edges so that greedy
+# constructions differ between members of the population
+EDGE_NOISE = 0.05
+
+
+def TSPConstructions(num_cities, dimensionality):
+
+    kdtree_sizes = Compiler.ufunc(spatial.kdtree_sizes)
+    kdtree_remove = Compiler.ufunc(spatial.kdtree_remove)
+    kdtree_nearest = Compiler.ufunc(spatial.kdtree_nearest)
+
+    @Compiler.ufunc
+    def squared_distance(coords, a, b):
+        result = 0.0
+        for i in range(dimensionality):
+            result += (np.float64(coords[a, i]) - coords[b, i]) ** 2
+        return result
+
+    @Compiler.ufunc
+    def find(parents, i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    # Adds the edges (starts[e], ends[e]) in the order given by edge_order
+    # as long as they don't create a city of degree 3 or a cycle.
+    # The result is a set of paths stored in adjacency/degrees
+    @Compiler.ufunc
+    def match_edges(starts, ends, edge_order, adjacency, degrees):
+        parents = np.arange(num_cities)
+        for e in edge_order:
+            a = starts[e]
+            b = ends[e]
+            if degrees[a] >= 2 or degrees[b] >= 2:
+                continue
+            root_a = find(parents, a)
+            root_b = find(parents, b)
+            if root_a == root_b:
+                continue
+            parents[root_a] = root_b
+            adjacency[a, degrees[a]] = b
+            degrees[a] += 1
+            adjacency[b, degrees[b]] = a
+            degrees[b] += 1
+
+    # Writes in order a tour following the paths in adjacency. Paths are
+    # chained by jumping from the end of one to the closest end of a path
+    # not visited yet
+    @Compiler.ufunc
+    def join_paths(problem_data, adjacency, degrees, start, order):
+        coords = problem_data['coords']
+        ix = problem_data['kdtree']
+        split_dims = problem_data['kdtree_dims']
+        tree_position = problem_data['kdtree_position']
+
+        # Only the ends of the paths are kept in the tree
+        sizes = kdtree_sizes(num_cities)
+        alive = np.ones(num_cities, dtype=np.bool_)
+        for city in range(num_cities):
+            if degrees[city] == 2:
+                kdtree_remove(sizes, alive, tree_position[city])
+
+        current = start
+        previous = -1
+        kdtree_remove(sizes, alive, tree_position[current])
+        for i in range(num_cities):
+            order[i] = current
+            if i == num_cities - 1:
+                break
+
+            following = -1
+            for k in range(degrees[current]):
+                if adjacency[current, k] != previous:
+                    following = adjacency[current, k]
+
+            if following == -1:
+                # End of the path, jump to the closest unvisited one
+                if alive[tree_position[current]]:
+                    kdtree_remove(sizes, alive, tree_position[current])
+                following = kdtree_nearest(coords, ix, split_dims, sizes,
+                                           alive, current)
+                kdtree_remove(sizes, alive, tree_position[following])
+                previous = -1
+            else:
+                previous = current
+            current = following
+
+    @Compiler.ufunc
+    def candidate_edges(problem_data):
+        neighbors = problem_data['init_candidates']
+        k = neighbors.shape[1]
+        starts = np.empty(num_cities * k, dtype=np.int32)
+        ends = np.empty(num_cities * k, dtype=np.int32)
+        for city in range(num_cities):
+            for j in range(k):
+                starts[city * k + j] = city
+                ends[city * k + j] = neighbors[city, j]
+        return starts, ends
+
+    # Greedy edge matching: shortest candidate edges first
+    def greedy(order, problem_data):
+        coords = problem_data['coords']
+        starts, ends = candidate_edges(problem_data)
+        keys = np.empty(len(starts))
+        for e in range(len(starts)):
+            noise = 1 + EDGE_NOISE * np.random.random()
+            keys[e] = squared_distance(coords, starts[e], ends[e]) * noise
+
+        adjacency = np.empty((num_cities, 2), dtype=np.int32)
+        degrees = np.zeros(num_cities, dtype=np.int32)
+        match_edges(starts, ends, np.argsort(keys), adjacency, degrees)
+
+        # Any end of a path is a valid start
+        start = np.random.randint(0, num_cities)
+        while degrees[start] == 2:
+            start = (start + 1) % num_cities
+        join_paths(problem_data, adjacency, degrees, start, order)
+
+    # Clarke-Wright savings with a random hub: edges saving the most compared
+    # to going back to the hub are added first
+    def savings(order, problem_data):
+        coords = problem_data['coords']
+        hub = np.random.randint(0, num_cities)
+        starts, ends = candidate_edges(problem_data)
+        keys = np.empty(len(starts))
+        for e in range(len(starts)):
+            a = starts[e]
+            b = ends[e]
+            if a == hub or b == hub:
+                keys[e] = np.inf
+            else:
+                saving = (squared_distance(coords, hub, a)
+                          + squared_distance(coords, hub, b)
+                          - squared_distance(coords, a, b))
+                noise = 1 + EDGE_NOISE * np.random.random()
+                keys[e] = -saving * noise
+
+        adjacency = np.empty((num_cities, 2), dtype=np.int32)
+        degrees = np.zeros(num_cities, dtype=np.int32)
+        edge_order = np.argsort(keys)
+        # Edges of the hub are not part of the savings
+        num_edges = 0
+        for e in edge_order:
+            if keys[e] != np.inf:
+                num_edges += 1
+        match_edges(starts, ends, edge_order[:num_edges], adjacency, degrees)
+
+        join_paths(problem_data, adjacency, degrees, hub, order)
+
+    hilbert_index = Compiler.ufunc(spatial.hilbert_index)
+
+    # Cities sorted along a Hilbert curve (on the first two dimensions)
+    # The plane is randomly rotated so that members get different curves
+    def hilbert(order, problem_data):
+        coords = problem_data['coords']
+        bits = 16
+        angle = np.random.random() * 2 * np.pi
+        cos = np.cos(angle)
+        sin = np.sin(angle)
+
+        xs = np.empty(num_cities)
+        ys = np.empty(num_cities)
+        for city in range(num_cities):
+            xs[city] = cos * coords[city, 0] - sin * coords[city, 1]
+            ys[city] = sin * coords[city, 0] + cos * coords[city, 1]
+
+        x_min = xs.min()
+        y_min = ys.min()
+        extent = max(xs.max() - x_min, ys.max() - y_min, 1e-30)
+        grid = (1 << bits) - 1
+
+        keys = np.empty(num_cities, dtype=np.int64)
+        for city in range(num_cities):
+            x = np.int64((xs[city] - x_min) / extent * grid)
+            y = np.int64((ys[city] - y_min) / extent * grid)
+            keys[city] = hilbert_index(bits, x, y)
+
+        order[:] = np.argsort(keys)
+
+    return {
+        'greedy': Compiler.ufunc(greedy),
+        'savings': Compiler.ufunc(savings),
+        'hilbert': Compiler.ufunc(hilbert)
+    }
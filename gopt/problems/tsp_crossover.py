@@ -0,0 +1,262 @@
+import numpy as np
+
+from ..compiler import Compiler
+
+# Crossovers for TSP tours
+#
+# They write in child the tour obtained by recombining the tours parent_a
+# and parent_b. Like the constructions they only allocate local memory and
+# draw their randomness from np.random so they can run in parallel for
+# several pairs of parents.
+#
+# distance is the distance function of the problem. If candidates is not
+# None, the candidate lists of the problem data are used when reconnecting
+# subtours instead of looking at all the cities
+
+
+def TSPCrossovers(num_cities, distance, candidates=None):
+
+    # Cities considered to reconnect a city to another subtour
+    if candidates is not None:
+        num_others = candidates
+
+        @Compiler.ufunc
+        def other_city(problem_data, a, k):
+            return problem_data['candidates'][a, k]
+    else:
+        num_others = num_cities
+
+        @Compiler.ufunc
+        def other_city(problem_data, a, k):
+            return k
+
+    # Order crossover (OX): a random slice of parent_a is kept in place and
+    # the other cities are added in the order they appear in parent_b
+    def order_crossover(parent_a, parent_b, child, problem_data):
+        start = np.random.randint(0, num_cities)
+        end = np.random.randint(0, num_cities)
+        if start > end:
+            start, end = end, start
+
+        used = np.zeros(num_cities, dtype=np.bool_)
+        for i in range(start, end + 1):
+            child[i] = parent_a[i]
+            used[parent_a[i]] = True
+
+        j = (end + 1) % num_cities
+        for i in range(1, num_cities + 1):
+            city = parent_b[(end + i) % num_cities]
+            if not used[city]:
+                child[j] = city
+                j = (j + 1) % num_cities
+
+    # Both neighbors of each city in a tour
+    @Compiler.ufunc
+    def adjacency(order):
+        result = np.empty((num_cities, 2), dtype=np.int32)
+        for i in range(num_cities):
+            result[order[i], 0] = order[(i - 1) % num_cities]
+            result[order[i], 1] = order[(i + 1) % num_cities]
+        return result
+
+    @Compiler.ufunc
+    def has_edge(adj, a, b):
+        return adj[a, 0] == b or adj[a, 1] == b
+
+    @Compiler.ufunc
+    def replace_edge(adj, a, old, new):
+        if adj[a, 0] == old:
+            adj[a, 0] = new
+        else:
+            adj[a, 1] = new
+
+    # Labels the cycles of a graph where every city has degree 2, returns
+    # the number of cycles
+    @Compiler.ufunc
+    def label_cycles(adj, labels, sizes):
+        labels[:] = -1
+        num_cycles = 0
+        for start in range(num_cities):
+            if labels[start] != -1:
+                continue
+            size = 0
+            previous = -1
+            current = start
+            while labels[current] == -1:
+                labels[current] = num_cycles
+                size += 1
+                following = adj[current, 0]
+                if following == previous:
+                    following = adj[current, 1]
+                previous = current
+                current = following
+            sizes[num_cycles] = size
+            num_cycles += 1
+        return num_cycles
+
+    # Reconnects the smallest cycle to another one until only one is left
+    # The two edges removed and the two added are chosen to minimize the
+    # length of the result
+    @Compiler.ufunc
+    def merge_cycles(adj, problem_data):
+        labels = np.empty(num_cities, dtype=np.int32)
+        sizes = np.empty(num_cities, dtype=np.int32)
+        num_cycles = label_cycles(adj, labels, sizes)
+
+        while num_cycles > 1:
+            smallest = np.argmin(sizes[:num_cycles])
+
+            best = np.inf
+            best_a = best_an = best_b = best_bn = -1
+            best_cross = False
+            for a in range(num_cities):
+                if labels[a] != smallest:
+                    continue
+                for k in range(num_others):
+                    b = other_city(problem_data, a, k)
+                    if labels[b] == smallest:
+                        continue
+                    for i in range(2):
+                        an = adj[a, i]
+                        for j in range(2):
+                            bn = adj[b, j]
+                            removed = (distance(a, an, problem_data)
+                                       + distance(b, bn, problem_data))
+                            straight = (distance(a, b, problem_data)
+                                        + distance(an, bn, problem_data)
+                                        - removed)
+                            crossed = (distance(a, bn, problem_data)
+                                       + distance(an, b, problem_data)
+                                       - removed)
+                            if straight < best:
+                                best = straight
+                                best_a, best_an, best_b, best_bn = a, an, b, bn
+                                best_cross = False
+                            if crossed < best:
+                                best = crossed
+                                best_a, best_an, best_b, best_bn = a, an, b, bn
+                                best_cross = True
+
+            if best_a == -1:
+                # No candidate reaches another cycle, link the smallest one
+                # to any city outside of it
+                for a in range(num_cities):
+                    if labels[a] == smallest:
+                        best_a, best_an = a, adj[a, 0]
+                        break
+                for b in range(num_cities):
+                    if labels[b] != smallest:
+                        best_b, best_bn = b, adj[b, 0]
+                        break
+
+            a, an, b, bn = best_a, best_an, best_b, best_bn
+            if best_cross:
+                b, bn = bn, b
+            # Replace (a, an) and (b, bn) by (a, b) and (an, bn)
+            replace_edge(adj, a, an, b)
+            replace_edge(adj, an, a, bn)
+            replace_edge(adj, b, bn, a)
+            replace_edge(adj, bn, b, an)
+
+            target = labels[b]
+            for city in range(num_cities):
+                if labels[city] == smallest:
+                    labels[city] = target
+            sizes[target] += sizes[smallest]
+            # The last cycle takes the label of the merged one
+            last = num_cycles - 1
+            if smallest != last:
+                for city in range(num_cities):
+                    if labels[city] == last:
+                        labels[city] = smallest
+                sizes[smallest] = sizes[last]
+            num_cycles -= 1
+
+    # Edge assembly crossover (EAX), single strategy: an AB-cycle (a closed
+    # walk alternating between edges of parent_a and of parent_b that are
+    # not shared) is drawn at random. Its edges from parent_a are replaced
+    # by its edges from parent_b and the subtours created are merged back
+    # greedily
+    def edge_assembly_crossover(parent_a, parent_b, child, problem_data):
+        adj_a = adjacency(parent_a)
+        adj_b = adjacency(parent_b)
+
+        # Edges that are not shared by the two parents and not used yet by
+        # the AB-cycle
+        free_a = np.zeros((num_cities, 2), dtype=np.bool_)
+        free_b = np.zeros((num_cities, 2), dtype=np.bool_)
+        num_free = 0
+        for city in range(num_cities):
+            for i in range(2):
+                free_a[city, i] = not has_edge(adj_b, city, adj_a[city, i])
+                free_b[city, i] = not has_edge(adj_a, city, adj_b[city, i])
+                if free_a[city, i]:
+                    num_free += 1
+
+        if num_free == 0:
+            # Identical tours
+            child[:] = parent_a
+            return
+
+        start = np.random.randint(0, num_cities)
+        while not (free_a[start, 0] or free_a[start, 1]):
+            start = (start + 1) % num_cities
+
+        # Every city has as many free edges from both parents, so the walk
+        # can always continue and ends back at start after a B edge
+        walk = np.empty(2 * num_cities + 1, dtype=np.int32)
+        walk[0] = start
+        length = 0
+        current = start
+        from_a = True
+        while True:
+            if from_a:
+                free, source = free_a, adj_a
+            else:
+                free, source = free_b, adj_b
+            if free[current, 0] and free[current, 1]:
+                i = np.random.randint(0, 2)
+            elif free[current, 0]:
+                i = 0
+            else:
+                i = 1
+            following = source[current, i]
+            free[current, i] = False
+            if source[following, 0] == current and free[following, 0]:
+                free[following, 0] = False
+            else:
+                free[following, 1] = False
+
+            length += 1
+            walk[length] = following
+            current = following
+            from_a = not from_a
+            if from_a and current == start:
+                break
+
+        # Every city of the walk loses as many A edges as it gains B edges
+        # (A edges are the even steps of the walk)
+        adj = adj_a.copy()
+        for i in range(0, length, 2):
+            replace_edge(adj, walk[i], walk[i + 1], -1)
+            replace_edge(adj, walk[i + 1], walk[i], -1)
+        for i in range(1, length, 2):
+            replace_edge(adj, walk[i], -1, walk[i + 1])
+            replace_edge(adj, walk[i + 1], -1, walk[i])
+
+        merge_cycles(adj, problem_data)
+
+        previous = -1
+        current = 0
+        for i in range(num_cities):
+            child[i] = current
+            following = adj[current, 0]
+            if following == previous:
+                following = adj[current, 1]
+            previous = current
+            current = following
+
+    return {
+        'OX': Compiler.ufunc(order_crossover),
+        'EAX': Compiler.ufunc(edge_assembly_crossover)
+    }
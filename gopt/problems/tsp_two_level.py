@@ -0,0 +1,281 @@
+import numpy as np
+from types import SimpleNamespace
+
+from ..compiler import Compiler
+
+# Two-level doubly linked list representation of TSP tours (Fredman et al.,
+# Data structures for traveling salesmen, 1995)
+#
+# The tour is cut in segments of about sqrt(n) cities. The cities of segment
+# s are stored contiguously in order[seg_start[s]:seg_start[s] + seg_len[s]]
+# and seg_order lists the segments in tour order (seg_pos is its inverse).
+# Each segment has a reversal bit telling whether its cities are visited from
+# the end of its slice, the tour has one too telling whether seg_order is
+# read backwards. index and segment give the slot and the segment of each
+# city.
+#
+# next/prev/between are O(1). Reversing a path first splits the segments at
+# its ends so that it is made of whole segments, then reverses the order and
+# flips the bits of these segments (or of the rest of the tour and the bit of
+# the tour, whichever has fewer segments): O(sqrt(n)). Splits add segments,
+# when there are about twice as many as after build the list is rebuilt in
+# O(n), at most every sqrt(n) / 2 reversals.
+#
+# `order` is the tour only right after build_tour, tour_order gives it.
+
+
+def segment_size(num_cities):
+    return int(np.ceil(np.sqrt(num_cities)))
+
+
+# Reversal bits are uint8, numba doesn't support arrays of booleans in
+# records
+#
+# Segments allocated in the state: the segments of build_tour, as many that
+# can be created by splits before rebuilding and two for the reversal that
+# triggers the rebuild
+def max_segments(num_cities):
+    size = segment_size(num_cities)
+    return 2 * ((num_cities + size - 1) // size) + 2
+
+
+def two_level_fields(num_cities, tour_dtype):
+    segments = max_segments(num_cities)
+    return [
+        ('order', (tour_dtype, num_cities)),
+        ('index', (tour_dtype, num_cities)),
+        ('segment', (tour_dtype, num_cities)),
+        ('seg_start', (np.int32, segments)),
+        ('seg_len', (np.int32, segments)),
+        ('seg_reversed', (np.uint8, segments)),
+        ('seg_order', (np.int32, segments)),
+        ('seg_pos', (np.int32, segments)),
+        ('num_segments', np.int32),
+        ('reversed', np.uint8)
+    ]
+
+
+# Builds the list from the tour written in state['order']
+# Not compiled when called from python (decoding solutions)
+def build_tour(state):
+    order = state['order']
+    num_cities = order.shape[0]
+    size = int(np.ceil(np.sqrt(num_cities)))
+    num_segments = (num_cities + size - 1) // size
+    for s in range(num_segments):
+        state['seg_start'][s] = s * size
+        state['seg_len'][s] = min(size, num_cities - s * size)
+        state['seg_reversed'][s] = 0
+        state['seg_order'][s] = s
+        state['seg_pos'][s] = s
+    state['num_segments'] = num_segments
+    state['reversed'] = 0
+    for i in range(num_cities):
+        state['index'][order[i]] = i
+        state['segment'][order[i]] = i // size
+
+
+# Writes the tour in out
+# Not compiled when called from python (exporting solutions)
+def tour_order(state, out):
+    order = state['order']
+    num_segments = state['num_segments']
+    backwards = state['reversed']
+    i = 0
+    for k in range(num_segments):
+        if backwards:
+            s = state['seg_order'][num_segments - 1 - k]
+        else:
+            s = state['seg_order'][k]
+        start = state['seg_start'][s]
+        length = state['seg_len'][s]
+        if state['seg_reversed'][s] != backwards:
+            for j in range(length):
+                out[i + j] = order[start + length - 1 - j]
+        else:
+            for j in range(length):
+                out[i + j] = order[start + j]
+        i += length
+
+
+def TwoLevelList(num_cities):
+    limit = max_segments(num_cities)
+
+    build = Compiler.ufunc(build_tour)
+    linearize = Compiler.ufunc(tour_order)
+
+    # Whether the cities of s are visited from the end of its slice
+    @Compiler.ufunc
+    def backwards(state, s):
+        return state['seg_reversed'][s] != state['reversed']
+
+    @Compiler.ufunc
+    def first(state, s):
+        if backwards(state, s):
+            return state['order'][state['seg_start'][s]
+                                  + state['seg_len'][s] - 1]
+        return state['order'][state['seg_start'][s]]
+
+    @Compiler.ufunc
+    def last(state, s):
+        if backwards(state, s):
+            return state['order'][state['seg_start'][s]]
+        return state['order'][state['seg_start'][s]
+                              + state['seg_len'][s] - 1]
+
+    @Compiler.ufunc
+    def next_segment(state, s):
+        step = -1 if state['reversed'] else 1
+        return state['seg_order'][(state['seg_pos'][s] + step)
+                                  % state['num_segments']]
+
+    @Compiler.ufunc
+    def prev_segment(state, s):
+        step = 1 if state['reversed'] else -1
+        return state['seg_order'][(state['seg_pos'][s] + step)
+                                  % state['num_segments']]
+
+    @Compiler.ufunc
+    def next_city(state, c):
+        s = state['segment'][c]
+        i = state['index'][c]
+        if backwards(state, s):
+            if i > state['seg_start'][s]:
+                return state['order'][i - 1]
+        elif i < state['seg_start'][s] + state['seg_len'][s] - 1:
+            return state['order'][i + 1]
+        return first(state, next_segment(state, s))
+
+    @Compiler.ufunc
+    def prev_city(state, c):
+        s = state['segment'][c]
+        i = state['index'][c]
+        if backwards(state, s):
+            if i < state['seg_start'][s] + state['seg_len'][s] - 1:
+                return state['order'][i + 1]
+        elif i > state['seg_start'][s]:
+            return state['order'][i - 1]
+        return last(state, prev_segment(state, s))
+
+    # Position of c in the tour up to a rotation: increases along the tour
+    # except once, where it wraps around
+    @Compiler.ufunc
+    def sequence(state, c):
+        s = state['segment'][c]
+        p = state['seg_pos'][s]
+        if state['reversed']:
+            p = state['num_segments'] - 1 - p
+        rank = state['index'][c] - state['seg_start'][s]
+        if backwards(state, s):
+            rank = state['seg_len'][s] - 1 - rank
+        return np.int64(p) * num_cities + rank
+
+    # Whether b is on the path from a to c
+    @Compiler.ufunc
+    def between(state, a, b, c):
+        ka = sequence(state, a)
+        kb = sequence(state, b)
+        kc = sequence(state, c)
+        if ka <= kc:
+            return ka <= kb and kb <= kc
+        return kb >= ka or kb <= kc
+
+    # Makes c the first city of its segment. The part of the segment before
+    # c (or from c if it is smaller) becomes a new segment
+    @Compiler.ufunc
+    def split_before(state, c):
+        s = state['segment'][c]
+        start = state['seg_start'][s]
+        end = start + state['seg_len'][s]
+        # The slice is cut in [start, m) and [m, end)
+        m = state['index'][c]
+        if backwards(state, s):
+            m += 1
+        if m == start or m == end:
+            return
+
+        t = state['num_segments']
+        low_to_t = m - start <= end - m
+        if low_to_t:
+            state['seg_start'][t] = start
+            state['seg_len'][t] = m - start
+            state['seg_start'][s] = m
+            state['seg_len'][s] = end - m
+            lo, hi = start, m
+        else:
+            state['seg_start'][t] = m
+            state['seg_len'][t] = end - m
+            state['seg_len'][s] = m - start
+            lo, hi = m, end
+        for i in range(lo, hi):
+            state['segment'][state['order'][i]] = t
+        state['seg_reversed'][t] = state['seg_reversed'][s]
+
+        # In seg_order the low part comes first unless s is reversed
+        p = state['seg_pos'][s]
+        if low_to_t == (state['seg_reversed'][s] == 1):
+            p += 1
+        for k in range(t, p, -1):
+            moved = state['seg_order'][k - 1]
+            state['seg_order'][k] = moved
+            state['seg_pos'][moved] = k
+        state['seg_order'][p] = t
+        state['seg_pos'][t] = p
+        state['num_segments'] = t + 1
+
+    # Reverses the order and flips the bits of the count segments starting
+    # at position p of seg_order (wrapping around)
+    @Compiler.ufunc
+    def reverse_segments(state, p, count):
+        num_segments = state['num_segments']
+        seg_order = state['seg_order']
+        for k in range(count // 2):
+            a = (p + k) % num_segments
+            b = (p + count - 1 - k) % num_segments
+            seg_order[a], seg_order[b] = seg_order[b], seg_order[a]
+        for k in range(count):
+            a = (p + k) % num_segments
+            s = seg_order[a]
+            state['seg_pos'][s] = a
+            state['seg_reversed'][s] = 1 - state['seg_reversed'][s]
+
+    @Compiler.ufunc
+    def rebuild(state):
+        tour = state['order'].copy()
+        linearize(state, tour)
+        state['order'][:] = tour
+        build(state)
+
+    # Reverses the path from x to y: y ends up where x was and x where y
+    # was, so reverse(y, x) undoes it
+    @Compiler.ufunc
+    def reverse(state, x, y):
+        if x == y:
+            return
+        after = next_city(state, y)
+        if after == x:
+            # The whole tour
+            state['reversed'] = 1 - state['reversed']
+            return
+
+        if state['num_segments'] + 2 > limit:
+            rebuild(state)
+        split_before(state, x)
+        split_before(state, after)
+
+        num_segments = state['num_segments']
+        sx = state['seg_pos'][state['segment'][x]]
+        sy = state['seg_pos'][state['segment'][y]]
+        if state['reversed']:
+            sx, sy = sy, sx
+        count = (sy - sx) % num_segments + 1
+        if 2 * count <= num_segments:
+            reverse_segments(state, sx, count)
+        else:
+            # Same cycle, visited the other way around
+            reverse_segments(state, sy + 1, num_segments - count)
+            state['reversed'] = 1 - state['reversed']
+
+    return SimpleNamespace(build=build, tour_order=linearize,
+                           next=next_city, prev=prev_city, between=between,
+                           reverse=reverse)
@@ -1 +1,3 @@
 from .cpu_runner import CPURunner
+from .process_pool_runner import ProcessPoolRunner
+from .distributed import DistributedRunner, Coordinator
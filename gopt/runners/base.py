@@ -1,15 +1,63 @@
 import logging
 from time import time
 from abc import ABCMeta
+from pytimeparse import parse
+import numba
 import numpy as np
 
 from ..compiler import Compiler, Compilable
 from .code_runner import CodeRunner
+from .checkpoint import Checkpoint
+from .. import telemetry
 
 base_logger = logging.getLogger('gopt')
 
+
+# Numba can't pass records to the body of parallel loops so parallel kernels
+# get the problem data as a one element array instead
+def as_one_element_array(data):
+    if isinstance(data, np.void):
+        # Records obtained by indexing an array are views on it
+        if (isinstance(data.base, np.ndarray) and data.base.shape == (1,)
+                and data.base.dtype == data.dtype):
+            return data.base
+        result = np.empty(1, dtype=data.dtype)
+        result[0] = data
+        return result
+    return np.asarray(data)[np.newaxis]
+
+
+# Wall clock time in seconds, usable from compiled code once compiled with
+# compile_clock
+def clock():
+    with numba.objmode(now='float64'):
+        now = time()
+    return now
+
+
+# Numba can't inline functions containing an objmode block
+def compile_clock():
+    return Compiler.jit('ufunc', 'clock', None, clock, inline='never')
+
+
 class Runner(metaclass=ABCMeta):
 
+    # Target duration in seconds of the blocks of iterations run between two
+    # returns to python (see code_runner.BlockSizeController)
+    block_duration = 1.0
+
+    # Whether to show a progress bar (if tqdm is installed)
+    progress = True
+
+    # Maximum number of entries of the convergence trace (see
+    # telemetry.record_improvement)
+    trace_capacity = 4096
+
+    # problem_data can be a Checkpoint, in that case the prepared problem
+    # data is loaded from it and the population is not initialized (see
+    # resume). It can also be problem data already prepared, as a one
+    # element array of Problem.problem_data_dtype (see
+    # gopt.io.load_problem_data), which is used without copying it
     def __init__(self, Shuffler, problem_data):
         self._compiled = None
 
@@ -17,7 +65,32 @@ class Runner(metaclass=ABCMeta):
         self.Shuffler = Shuffler
         self.Optimizer = Shuffler.Optimizer
         self.Problem = self.Optimizer.Problem
-        self.problem_data = problem_data
+        # Members start at the rung of the ladder of their index
+        temperatures = getattr(self.Optimizer, 'temperatures', None)
+        if (temperatures is not None
+                and len(temperatures) != Shuffler.population_size):
+            raise ValueError(f"The optimizer has {len(temperatures)} "
+                             f"temperatures for a population of "
+                             f"{Shuffler.population_size}")
+        if isinstance(problem_data, Checkpoint):
+            resuming = True
+            self.problem_data_array = problem_data.problem_data_array()
+            self.problem_data = self.problem_data_array[0]
+        elif self.is_prepared(problem_data):
+            resuming = False
+            self.problem_data_array = problem_data
+            self.problem_data = problem_data[0]
+        else:
+            resuming = False
+            self.problem_data = self.Problem.prepare_data(problem_data)
+            self.problem_data_array = as_one_element_array(self.problem_data)
+
+        # Iterations done and time spent by the run we continue
+        self.resumed_progress = (0, 0.0)
+        self._checkpoint = None
+        self._checkpoint_path = None
+        self._checkpoint_interval = None
+        self._last_checkpoint = None
 
         # Compilation
         #############
@@ -52,41 +125,179 @@ class Runner(metaclass=ABCMeta):
             self.Optimizer.states_required
         )
 
+        # Telemetry counters of each member (see gopt.telemetry)
+        self.counters = telemetry.allocate_counters(
+            self.Shuffler.population_size)
+        self.timespecs = telemetry.allocate_timespecs(
+            self.Shuffler.population_size)
+        self.exporters = []
+        self.trace, self.trace_state = telemetry.allocate_trace(
+            self.trace_capacity)
+
         # State Initialization
         ######################
 
         self.logger = base_logger.getChild(type(self).__name__)
+        # Time spent initializing the population (without compilation)
+        self.init_time = 0.0
+        if resuming:
+            return
+
         self.logger.info('Start initializing states')
 
+        init_population = self.compile_init()
+
         start_time = time()
-        # TODO consider compiling this (prob not very useful though)
-        for pop_id in range(self.Shuffler.population_size):
-            self.problem_code.init_state(self.solution_states[pop_id, 0],
-                                         problem_data)
-
-            # Compute the loss of the newly inited solution
-            self.solution_losses[pop_id, 0] = self.problem_code.loss(
-                self.solution_states[pop_id, 0],
-                self.problem_data
-            )
-
-            # Even if the optimizer has state we might still init it
-            # It could write to the loss vector
-            if self.optimizer_states is not None:
-                opt_state = self.optimizer_states[pop_id]
-            else:
-                opt_state = None
-
-            self.optimizer_code.init_state(opt_state,
-                                           self.solution_states[pop_id],
-                                           self.solution_losses[pop_id],
-                                           problem_data)
+        init_population(self.solution_states, self.solution_losses,
+                        self.problem_data_array, self.optimizer_states)
 
         self.shuffler_code.init(self.shuffler_state, self.query_vector)
+        self.init_time = time() - start_time
         self.logger.info(
-            f'Done initializing states({time() - start_time:.2f}sec)')
+            f'Done initializing states({self.init_time:.2f}sec)')
+
+    def is_prepared(self, problem_data):
+        return (isinstance(problem_data, np.ndarray)
+                and problem_data.dtype == self.Problem.problem_data_dtype
+                and problem_data.shape == (1,))
+
+    # Creates a runner continuing the run checkpointed in path (see
+    # checkpoint). The Shuffler and the arguments of the runner have to be
+    # the same as the ones of the checkpointed run. The kernels still have to
+    # be compiled but come from the kernel cache if it is enabled. The budget
+    # given to run includes the iterations and the time of the previous run
+    @classmethod
+    def resume(cls, path, Shuffler, *args, **kwargs):
+        checkpoint = Checkpoint(path)
+        runner = cls(Shuffler, checkpoint, *args, **kwargs)
+        runner.resumed_progress = checkpoint.restore(runner)
+        runner.logger.info(f'Resumed from {path} after '
+                           f'{runner.resumed_progress[0]} iterations')
+        # Later snapshots go to the same checkpoint
+        runner._checkpoint = checkpoint
+        return runner
+
+    # Snapshots the state of the runner in the directory path (see
+    # checkpoint.Checkpoint), code_runner gives the progress of the run
+    def checkpoint(self, path, code_runner=None):
+        if self._checkpoint is None or self._checkpoint.path != path:
+            self._checkpoint = Checkpoint(path)
 
+        start_time = time()
+        if code_runner is None:
+            iterations, elapsed = self.resumed_progress
+        else:
+            iterations, elapsed = code_runner.current_iter, code_runner.elapsed()
+        self._checkpoint.save(self, iterations, elapsed)
+        self._last_checkpoint = time()
+        self.logger.debug(f'Checkpoint saved to {path} '
+                          f'({self._last_checkpoint - start_time:.2f}sec)')
+
+    # Creates the CodeRunner of a run, continuing the resumed run if any
+    def code_runner(self, max_iter, max_time, checkpoint=None,
+                    checkpoint_interval=None, count_iterations=None):
+        iterations, elapsed = self.resumed_progress
+        self.resumed_progress = (0, 0.0)
+
+        if checkpoint is not None:
+            if isinstance(checkpoint_interval, str):
+                checkpoint_interval = parse(checkpoint_interval)
+            self._last_checkpoint = time()
+        self._checkpoint_path = checkpoint
+        self._checkpoint_interval = checkpoint_interval
+        self._exported_blocks = 0
+
+        return CodeRunner(max_iter=max_iter, max_time=max_time,
+                          block_duration=self.block_duration,
+                          progress=self.progress,
+                          initial_iter=iterations, initial_time=elapsed,
+                          count_iterations=count_iterations)
+
+    # Called at the beginning of run, the trace of a resumed run continues
+    def start_trace(self):
+        if self.resumed_progress == (0, 0.0):
+            telemetry.reset_trace(self.trace_state)
+
+    # exporter is called after every block with a snapshot of the run (see
+    # telemetry_snapshot), like telemetry.PrometheusExporter
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def telemetry_snapshot(self, code_runner):
+        return dict(
+            time=time(),
+            iterations=int(code_runner.current_iter),
+            elapsed=float(code_runner.elapsed()),
+            best_loss=float(self.solution_losses[:, 0].min()),
+            counters=self.counters.copy()
+        )
+
+    # Called by run after every block, and at the end of the run for the
+    # last block if the run stopped before exporting it
+    def export_telemetry(self, code_runner):
+        if not self.exporters or code_runner.blocks == self._exported_blocks:
+            return
+        self._exported_blocks = code_runner.blocks
+        snapshot = self.telemetry_snapshot(code_runner)
+        for exporter in self.exporters:
+            try:
+                exporter(snapshot)
+            except OSError as e:
+                self.logger.warning(f'Could not export telemetry: {e}')
+
+    # Called by run after every block, snapshots the state when
+    # checkpoint_interval has passed since the last one (or if force is True)
+    def periodic_checkpoint(self, code_runner, force=False):
+        if self._checkpoint_path is None:
+            return
+        if (force or self._checkpoint_interval is None
+                or time() - self._last_checkpoint
+                >= self._checkpoint_interval):
+            self.checkpoint(self._checkpoint_path, code_runner)
+
+    # Generates the kernel initializing the whole population in parallel
+    def compile_init(self):
+        init_state = self.problem_code.init_state
+        loss = self.problem_code.loss
+        optimizer_init = self.optimizer_code.init_state
+        opt_state_dtype = self.Optimizer.state_dtype
+        population_size = self.Shuffler.population_size
+
+        def init_population(solutions, losses, problem_data_array,
+                            optimizer_states):
+            for pop_id in numba.prange(population_size):
+                problem_data = problem_data_array[0]
+                init_state(solutions[pop_id, 0], problem_data)
+
+                # Compute the loss of the newly inited solution
+                losses[pop_id, 0] = loss(solutions[pop_id, 0], problem_data)
+
+                # Even if the optimizer has state we might still init it
+                # It could write to the loss vector
+                if opt_state_dtype is None:
+                    opt_states = None
+                else:
+                    opt_states = optimizer_states[pop_id]
+
+                optimizer_init(opt_states, solutions[pop_id], losses[pop_id],
+                               problem_data, pop_id)
+
+        if self.Optimizer.state_dtype is None:
+            optimizer_states = numba.typeof(None)
+        else:
+            optimizer_states = numba.types.Array(self.Optimizer.state_ntype,
+                                                 1, 'C')
+
+        init_population_signature = numba.void(
+            numba.types.Array(self.Problem.state_ntype, 2, 'C'),
+            numba.types.Array(Compiler.loss_ntype, 2, 'C'),
+            numba.typeof(self.problem_data_array),
+            optimizer_states
+        )
 
+        return Compiler.jit(type(self).__name__, 'population initializer',
+                            init_population_signature, init_population,
+                            parallel=True)
 
     def run(self, max_iter=None, max_time=None):
         raise NotImplementedError
@@ -0,0 +1,214 @@
+import os
+from time import time
+import numba
+import numpy as np
+
+# numba doesn't expose the state of its generator, it is read and written
+# through its private _helperlib module. If a numba upgrade removes or
+# changes it, checkpoints fail with an error instead of resuming with a
+# different random state
+try:
+    from numba import _helperlib
+    numba_rng = (_helperlib.rnd_get_state, _helperlib.rnd_set_state,
+                 _helperlib.rnd_get_np_state_ptr)
+except (ImportError, AttributeError):
+    numba_rng = None
+
+# Snapshots of the state of a runner in a directory of .npy files
+#
+# Layout:
+# - problem_data.npy: the prepared problem data
+# - manifest.npy: which slot holds the last complete snapshot and the
+#   progress of the run (iterations and time spent) at that point
+# - slot0/ and slot1/: one .npy file per array of the runner (population,
+#   losses, optimizer and shuffler states, query vector, epoch statistics,
+#   telemetry counters and trace) and rng.npy
+#
+# The files are memory mapped when first written, later snapshots copy the
+# arrays into them and flush, only the pages that changed are written back.
+# Snapshots alternate between the two slots and the manifest is updated
+# last so a snapshot interrupted half way never corrupts the previous one.
+#
+# Only the random generator of the calling thread can be saved: the threads
+# running the parallel loops have their own generators and get new seeds
+# when resuming, resumed runs are not bit for bit identical
+
+ARRAYS = ['solution_states', 'solution_losses', 'optimizer_states',
+          'query_vector', 'epoch_stats', 'counters', 'trace', 'trace_state']
+
+MANIFEST_DTYPE = np.dtype([
+    # Slot of the last complete snapshot, -1 if there is none
+    ('slot', np.int64),
+    ('snapshots', np.int64),
+    ('iterations', np.int64),
+    ('elapsed', np.float64),
+    ('saved_at', np.float64)
+])
+
+MT_SIZE = 624
+RNG_DTYPE = np.dtype([
+    # State of the numba generator (the one used by compiled code)
+    ('numba_index', np.int64),
+    ('numba_keys', np.uint32, MT_SIZE),
+    # State of the numpy generator
+    ('numpy_pos', np.int64),
+    ('numpy_keys', np.uint32, MT_SIZE),
+    ('numpy_has_gauss', np.int64),
+    ('numpy_gauss', np.float64)
+])
+
+
+def numba_rng_functions():
+    if numba_rng is None:
+        raise RuntimeError(f'numba {numba.__version__} has no '
+                           f'_helperlib.rnd_get_state/rnd_set_state, the '
+                           f'state of its random generator can not be '
+                           f'checkpointed')
+    return numba_rng
+
+
+def get_rng_state():
+    get_state, _, state_ptr = numba_rng_functions()
+    state = np.zeros(1, dtype=RNG_DTYPE)
+    index, keys = get_state(state_ptr())
+    if len(keys) != MT_SIZE:
+        raise RuntimeError(f'numba {numba.__version__} uses a random '
+                           f'generator of {len(keys)} words instead of '
+                           f'{MT_SIZE}, its state can not be checkpointed')
+    state['numba_index'] = index
+    state['numba_keys'] = keys
+    _, keys, pos, has_gauss, gauss = np.random.get_state()
+    state['numpy_pos'] = pos
+    state['numpy_keys'] = keys
+    state['numpy_has_gauss'] = has_gauss
+    state['numpy_gauss'] = gauss
+    return state
+
+
+def set_rng_state(state):
+    _, set_state, state_ptr = numba_rng_functions()
+    state = state[0]
+    set_state(state_ptr(), (int(state['numba_index']),
+                            [int(k) for k in state['numba_keys']]))
+    np.random.set_state(('MT19937', state['numpy_keys'],
+                         int(state['numpy_pos']),
+                         int(state['numpy_has_gauss']),
+                         float(state['numpy_gauss'])))
+
+
+class Checkpoint:
+
+    def __init__(self, path):
+        self.path = path
+        self._problem_data_saved = False
+        # Memory mapped files of each slot
+        self._slots = [{}, {}]
+        self._manifest = None
+
+    def file(self, *parts):
+        return os.path.join(self.path, *parts)
+
+    def exists(self):
+        return os.path.exists(self.file('manifest.npy'))
+
+    def manifest(self):
+        if not self.exists():
+            raise FileNotFoundError(f'No checkpoint in {self.path}')
+        manifest = np.load(self.file('manifest.npy'))[0]
+        if manifest['slot'] == -1:
+            raise FileNotFoundError(f'No complete checkpoint in {self.path}')
+        return manifest
+
+    # The arrays of the runner to save, shuffler_state is a record so we save
+    # the array it comes from
+    @staticmethod
+    def arrays(runner):
+        arrays = {name: getattr(runner, name, None) for name in ARRAYS}
+        if runner.shuffler_state is not None:
+            shuffler_state = np.empty(1, dtype=runner.shuffler_state.dtype)
+            shuffler_state[0] = runner.shuffler_state
+            arrays['shuffler_state'] = shuffler_state
+        return {name: array for name, array in arrays.items()
+                if array is not None}
+
+    # An existing manifest is reused so that its last snapshot stays valid
+    # until a new one is complete
+    def open_manifest(self):
+        if self.exists():
+            manifest = np.load(self.file('manifest.npy'), mmap_mode='r+')
+            if manifest.dtype == MANIFEST_DTYPE and manifest.shape == (1,):
+                return manifest
+        manifest = np.lib.format.open_memmap(
+            self.file('manifest.npy'), mode='w+', dtype=MANIFEST_DTYPE,
+            shape=(1,))
+        manifest['slot'] = -1
+        return manifest
+
+    def write(self, files, name, array):
+        target = files.get(name)
+        if (target is None or target.shape != array.shape
+                or target.dtype != array.dtype):
+            target = np.lib.format.open_memmap(self.file(name), mode='w+',
+                                               dtype=array.dtype,
+                                               shape=array.shape)
+            files[name] = target
+        target[...] = array
+        target.flush()
+
+    def save(self, runner, iterations=0, elapsed=0.0):
+        os.makedirs(self.file('slot0'), exist_ok=True)
+        os.makedirs(self.file('slot1'), exist_ok=True)
+
+        if self._manifest is None:
+            self._manifest = self.open_manifest()
+
+        if not self._problem_data_saved:
+            temporary = self.file('problem_data.tmp.npy')
+            np.save(temporary, runner.problem_data_array)
+            os.replace(temporary, self.file('problem_data.npy'))
+            self._problem_data_saved = True
+
+        manifest = self._manifest[0]
+        slot = (manifest['slot'] + 1) % 2
+        files = self._slots[slot]
+        for name, array in self.arrays(runner).items():
+            self.write(files, os.path.join(f'slot{slot}', f'{name}.npy'),
+                       array)
+        self.write(files, os.path.join(f'slot{slot}', 'rng.npy'),
+                   get_rng_state())
+
+        manifest['iterations'] = iterations
+        manifest['elapsed'] = elapsed
+        manifest['saved_at'] = time()
+        manifest['snapshots'] += 1
+        manifest['slot'] = slot
+        self._manifest.flush()
+
+    def problem_data_array(self):
+        self.manifest()
+        return np.load(self.file('problem_data.npy'))
+
+    # Copies the last snapshot into the arrays of runner, returns the
+    # iterations done and the time spent when it was taken
+    def restore(self, runner):
+        manifest = self.manifest()
+        slot = f"slot{manifest['slot']}"
+
+        for name, array in self.arrays(runner).items():
+            filename = self.file(slot, f'{name}.npy')
+            if not os.path.exists(filename):
+                raise ValueError(f'Checkpoint {self.path} has no {name}')
+            saved = np.load(filename, mmap_mode='r')
+            if saved.shape != array.shape or saved.dtype != array.dtype:
+                raise ValueError(
+                    f'{name} of checkpoint {self.path} does not match the '
+                    f'runner: {saved.shape} {saved.dtype} instead of '
+                    f'{array.shape} {array.dtype}')
+            if name == 'shuffler_state':
+                for field in array.dtype.names:
+                    runner.shuffler_state[field] = saved[0][field]
+            else:
+                array[...] = saved
+
+        set_rng_state(np.load(self.file(slot, 'rng.npy')))
+        return int(manifest['iterations']), float(manifest['elapsed'])
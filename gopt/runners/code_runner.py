@@ -1,57 +1,249 @@
+import math
 import logging
+import weakref
 from time import time
-from tqdm import tqdm
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
 from pytimeparse import parse
-from collections import defaultdict, deque
+from collections import deque
+
+# Compiled code takes the number of iterations as an int32
+MAX_BLOCK_SIZE = 2 ** 31 - 1
+
+
+# Chooses the size of the blocks of iterations so that they last
+# target_duration seconds
+#
+# The speed of the code (iterations per second) is estimated with an
+# exponentially weighted moving average of the observed blocks, so it
+# follows iterations getting cheaper or more expensive during the run. The
+# block size predicted from it is corrected by a PI loop on the log of the
+# ratio between the target and the observed duration, which removes the
+# constant costs per block that the speed does not capture.
+#
+# Until the speed is known (calibration), blocks start at one iteration and
+# grow by calibration_growth until one lasts calibration_duration
+class BlockSizeController:
+
+    def __init__(self, target_duration=1.0, smoothing=0.3,
+                 proportional_gain=0.3, integral_gain=0.1, leak=0.8,
+                 calibration_duration=None, calibration_growth=8,
+                 max_growth=4, history_size=10):
+        if calibration_duration is None:
+            calibration_duration = target_duration / 20
+
+        self.target_duration = target_duration
+        self.smoothing = smoothing
+        self.proportional_gain = proportional_gain
+        self.integral_gain = integral_gain
+        self.leak = leak
+        self.calibration_duration = calibration_duration
+        self.calibration_growth = calibration_growth
+        self.max_growth = max_growth
+
+        # Estimated iterations per second (None while calibrating)
+        self.rate = None
+        self.error = 0.0
+        self.integral = 0.0
+        self.last_size = 0
+        self.proposed = 0
+        self.unconstrained = False
+        self.blocks = 0
+        self.calibration_blocks = 0
+        # (block size, iterations done, duration) of the last blocks
+        self.history = deque(maxlen=history_size)
+
+    @property
+    def calibrated(self):
+        return self.rate is not None
+
+    def correction(self):
+        return math.exp(self.proportional_gain * self.error
+                        + self.integral_gain * self.integral)
+
+    # remaining_time is the time left in the budget of the run, if any
+    def next_size(self, remaining_time=None):
+        # Whether the size only comes from the estimated speed
+        self.unconstrained = False
+        if not self.calibrated:
+            size = max(1, self.last_size * self.calibration_growth)
+        else:
+            size = self.rate * self.target_duration * self.correction()
+            self.unconstrained = True
+            if remaining_time is not None:
+                size = min(size, self.rate * remaining_time)
+                self.unconstrained = remaining_time >= self.target_duration
+            if size > self.last_size * self.max_growth:
+                size = self.last_size * self.max_growth
+                self.unconstrained = False
+        self.proposed = int(min(max(1, size), MAX_BLOCK_SIZE))
+        return self.proposed
+
+    # size is the block size requested, done the iterations that ran
+    def update(self, size, done, duration):
+        self.blocks += 1
+        self.last_size = size
+        self.history.append((size, done, duration))
+        if done <= 0 or duration <= 0:
+            return
+
+        rate = done / duration
+        if not self.calibrated:
+            self.calibration_blocks += 1
+            # The first block also pays for starting the threads
+            if self.blocks > 1 and duration >= self.calibration_duration:
+                self.rate = rate
+            return
+
+        self.rate += self.smoothing * (rate - self.rate)
+
+        # Only full blocks of the size asked for by the controller say
+        # something about its error (no windup while the size is limited)
+        if self.unconstrained and done == size == self.proposed:
+            self.error = math.log(self.target_duration / duration)
+            # Leaky so that the lag of the speed estimate while the speed
+            # changes is forgotten once it settles
+            self.integral = min(max(self.leak * self.integral + self.error,
+                                    -2.0), 2.0)
+
+    def runtime_info(self):
+        durations = [duration for _, _, duration in self.history]
+        return dict(
+            block_target=self.target_duration,
+            blocks=self.blocks,
+            calibration_blocks=self.calibration_blocks,
+            block_size=self.last_size,
+            block_rate=self.rate,
+            block_correction=self.correction(),
+            mean_block_duration=(sum(durations) / len(durations)
+                                 if durations else None)
+        )
+
+
+# Controllers of each kernel, kept between runs so that the next run of a
+# runner starts with the speed measured by the previous one
+_controllers = weakref.WeakKeyDictionary()
+# Bound methods are created anew at every access and would be dropped from
+# _controllers at once: theirs are kept with the object they are bound to,
+# by function
+_method_controllers = weakref.WeakKeyDictionary()
+
+
+def stored_controllers(code):
+    owner = getattr(code, '__self__', None)
+    function = getattr(code, '__func__', None)
+    if owner is None or function is None:
+        return _controllers, code
+    return _method_controllers.setdefault(owner, {}), function
+
 
 class CodeRunner:
 
-    def __init__(self, max_iter, max_time, block_freq=1.0, max_cache_size=10):
+    # initial_iter and initial_time are the iterations done and the time
+    # spent by a previous run that we continue (see Runner.resume), they
+    # count in the budget
+    #
+    # Code can stop before the end of a block (see CPURunner.run), in that
+    # case count_iterations is called after every block with its size and
+    # returns the number of iterations actually run
+    #
+    # Blocks are sized to last block_duration seconds (see
+    # BlockSizeController)
+    #
+    # The progress bar needs tqdm, its updates take measurable time when
+    # blocks are short
+    def __init__(self, max_iter, max_time, block_duration=1.0,
+                 initial_iter=0, initial_time=0.0, count_iterations=None,
+                 progress=True):
         self.omax_time = max_time
 
         if isinstance(max_time, str):
             max_time = parse(max_time)
 
-        def cache_creator():
-            return deque(maxlen=max_cache_size)
-
         self.max_time = max_time
         self.max_iter = max_iter
-        self.block_freq = block_freq
+        self.block_duration = block_duration
         self.start_time = None
-        self.current_iter = 0
-        self._timing_caches = defaultdict(cache_creator)
-        self.max_cache_size = max_cache_size
+        self.current_iter = initial_iter
+        # Blocks run by this runner
+        self.blocks = 0
+        # Why can_run_more stopped the run: 'deadline' or 'max_iter'
+        self.stop_reason = None
+        self.initial_time = initial_time
+        self.count_iterations = count_iterations
+        self.progress = progress and tqdm is not None
+        self.progress_bar = None
+        self._controllers = {}
         self.logger = logging.getLogger('gopt.code_runner')
 
     def start(self):
-        self.start_time = time()
-        self.progress_bar = tqdm(total=self.max_iter)
+        self.start_time = time() - self.initial_time
+        if self.progress:
+            self.progress_bar = tqdm(total=self.max_iter,
+                                     initial=self.current_iter)
+
+    def elapsed(self):
+        if self.start_time is None:
+            return self.initial_time
+        return time() - self.start_time
+
+    # Wall clock time at which the run started (earlier than the first
+    # block if it continues a previous run)
+    def start_timestamp(self):
+        return time() - self.elapsed()
+
+    # Wall clock time at which the time budget runs out
+    def deadline(self):
+        if self.max_time is None:
+            return float('inf')
+        return time() - self.elapsed() + self.max_time
 
     def can_run_more(self):
-        elapsed_time = time() - self.start_time
+        elapsed_time = self.elapsed()
 
         if self.max_time is not None and elapsed_time >= self.max_time:
             self.logger.info(f'Out of time')
+            self.stop_reason = 'deadline'
             return False
 
         if self.max_iter is not None and self.current_iter >= self.max_iter:
             self.logger.info(f'Reached max_iter')
+            self.stop_reason = 'max_iter'
             return False
 
         return True
 
-    def get_best_block_size(self, history):
+    def close(self):
+        if self.progress_bar is not None:
+            self.progress_bar.close()
+            self.progress_bar = None
 
-        # TODO we might want to improve that part of the code if it becomes
-        # a significant bottleneck
+    def controller(self, code):
+        controller = self._controllers.get(code)
+        if controller is not None:
+            return controller
 
         try:
-            best_ratio = max(iters / time for (iters, time) in history)
-            return max(1, int(best_ratio / self.block_freq))
-        except:
-            return 1
+            stored, key = stored_controllers(code)
+            controller = stored.get(key)
+        except TypeError:
+            stored, controller = None, None
+        if (controller is None
+                or controller.target_duration != self.block_duration):
+            controller = BlockSizeController(self.block_duration)
+            if stored is not None:
+                stored[key] = controller
+
+        self._controllers[code] = controller
+        return controller
 
+    def runtime_info(self):
+        if len(self._controllers) != 1:
+            return {}
+        controller, = self._controllers.values()
+        return controller.runtime_info()
 
     def run_block(self, code, *args, **kwargs):
 
@@ -64,16 +256,20 @@ class CodeRunner:
                     f'Time budget:{self.omax_time} ({self.max_time}sec)'
                 )
             if self.max_iter is None and self.max_time is None:
-                self.logger('Budget is unlimited, Press Ctrl+C to end optimization')
+                self.logger.info(
+                    'Budget is unlimited, Press Ctrl+C to end optimization')
 
             self.start()
 
         if not self.can_run_more():
-            self.progress_bar.close()
+            self.close()
             raise StopIteration
 
-        cache = self._timing_caches[code]
-        best_block_size = self.get_best_block_size(cache)
+        controller = self.controller(code)
+        remaining_time = None
+        if self.max_time is not None:
+            remaining_time = max(self.max_time - self.elapsed(), 0)
+        best_block_size = controller.next_size(remaining_time)
 
         if self.max_iter is not None:
             best_block_size = min(best_block_size, self.max_iter - self.current_iter)
@@ -82,9 +278,17 @@ class CodeRunner:
         result = code(*args, **kwargs, iterations=best_block_size)
         elapsed = time() - start_code
 
-        self.current_iter += best_block_size
-        self.progress_bar.update(best_block_size)
-        self.progress_bar.set_postfix({'loss': result, 'bs':best_block_size})
-        cache.append((best_block_size, elapsed))
+        if self.count_iterations is not None:
+            done = self.count_iterations(best_block_size)
+        else:
+            done = best_block_size
+
+        self.current_iter += done
+        self.blocks += 1
+        if self.progress_bar is not None:
+            self.progress_bar.update(done)
+            self.progress_bar.set_postfix({'loss': result,
+                                           'bs': best_block_size})
+        controller.update(best_block_size, done, elapsed)
 
         return result
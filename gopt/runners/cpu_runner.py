@@ -1,13 +1,79 @@
 from types import SimpleNamespace
+from contextlib import contextmanager
+import signal
+import socket
 import logging
+import threading
 import numpy as np
 import numba
 import psutil
 
-from .base import Runner
+from .base import Runner, compile_clock
 from ..result import Result
-from .code_runner import CodeRunner
 from ..compiler import Compilable, Compiler
+from .. import telemetry
+from ..telemetry import ITERATIONS, STEP_NS
+
+# Layout of the arrays shared with to_run (see CPURunner.compile)
+# control (int64):
+# - ABORT: set to stop as soon as possible (by abort or Ctrl+C)
+# - REASON: why to_run stopped before the end of the block (STOP_REASONS)
+# - DONE: iterations run by the last call
+# - CHECK_EVERY: iterations between two checks of the stopping criteria
+# - STAGNATION: iterations without improvement before stopping (0: never)
+# - SINCE_IMPROVEMENT: iterations since the best loss improved
+# - ITERATION: iterations of the run so far
+(ABORT, REASON, DONE, CHECK_EVERY, STAGNATION, SINCE_IMPROVEMENT,
+ ITERATION) = range(7)
+# limits (float64):
+# - DEADLINE: wall clock time at which to stop
+# - TARGET_LOSS: stop once a member reaches this loss
+# - BEST_LOSS: best loss seen during the run
+# - START_TIME: wall clock time at which the run started
+DEADLINE, TARGET_LOSS, BEST_LOSS, START_TIME = range(4)
+
+# The budget can also run out between two blocks, the run is then stopped
+# by the CodeRunner (with the same 'deadline' reason or 'max_iter')
+STOP_REASONS = [None, 'aborted', 'deadline', 'target_loss', 'stagnation',
+                'max_iter']
+
+
+# While active, Ctrl+C sets the abort flag of control instead of raising
+# KeyboardInterrupt. Python only runs signal handlers between two bytecodes
+# so a thread woken up by the wakeup fd sets it while compiled code runs
+@contextmanager
+def abort_on_interrupt(control):
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    reader, writer = socket.socketpair()
+    writer.setblocking(False)
+
+    def watch():
+        while True:
+            signals = reader.recv(64)
+            if not signals:
+                break
+            if signal.SIGINT in signals:
+                control[ABORT] = 1
+
+    def handler(signum, frame):
+        control[ABORT] = 1
+
+    previous_handler = signal.signal(signal.SIGINT, handler)
+    previous_fd = signal.set_wakeup_fd(writer.fileno(),
+                                       warn_on_full_buffer=False)
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    try:
+        yield
+    finally:
+        signal.set_wakeup_fd(previous_fd)
+        signal.signal(signal.SIGINT, previous_handler)
+        writer.close()
+        watcher.join()
+        reader.close()
 
 
 class CPURunner(Runner):
@@ -20,31 +86,98 @@ class CPURunner(Runner):
         self.logger.info(f'Using {num_cores} threads')
         self.num_cores = num_cores
 
-    def run(self, max_iter=None, max_time=None):
+        # Number of epochs (work scheduled by the shuffler followed by a
+        # shuffle), time spent in the optimizers and time spent shuffling
+        self.epoch_stats = np.zeros(3, dtype=np.float64)
+
+        # Stopping criteria checked by the compiled code (see the layout at
+        # the top of this file)
+        self.control = np.zeros(7, dtype=np.int64)
+        self.limits = np.zeros(4, dtype=np.float64)
+
+    # Stops the run in progress after at most check_every iterations, can be
+    # called from any thread
+    def abort(self):
+        self.control[ABORT] = 1
+
+    # Besides max_iter and max_time, the run stops as soon as a member
+    # reaches target_loss or when the best loss did not improve for
+    # `stagnation` iterations. These criteria, the time budget and the abort
+    # flag are checked by the compiled code every check_every iterations so
+    # runs stop on time even with large blocks.
+    #
+    # If checkpoint is a path, the state is saved there every
+    # checkpoint_interval (a duration, '5 min'... or None for after every
+    # block) and at the end of the run (see Runner.checkpoint and
+    # Runner.resume)
+    def run(self, max_iter=None, max_time=None, target_loss=None,
+            stagnation=None, check_every=1000, checkpoint=None,
+            checkpoint_interval='5 min'):
+        if check_every < 1:
+            raise ValueError("check_every should be positive")
+
         previous_numba_core_count = numba.get_num_threads()
         numba.set_num_threads(self.num_cores)
 
         runner_code = self.compile()
 
-        code_runner = CodeRunner(max_iter=max_iter,
-                                 max_time=max_time)
+        self.control[:] = 0
+        self.control[CHECK_EVERY] = check_every
+        self.control[STAGNATION] = 0 if stagnation is None else stagnation
+        self.limits[TARGET_LOSS] = (-np.inf if target_loss is None
+                                    else target_loss)
+        self.limits[BEST_LOSS] = np.inf
+        self.start_trace()
+
+        code_runner = self.code_runner(
+            max_iter, max_time, checkpoint, checkpoint_interval,
+            count_iterations=lambda block_size: int(self.control[DONE]))
 
+        self.control[ITERATION] = code_runner.current_iter
 
         logger = logging.getLogger('gopt').getChild(type(self).__name__)
         logger.info(f'Optimizing')
 
-        while True:
-            try:
-                code_runner.run_block(runner_code.to_run,
-                                      self.query_vector,
-                                      self.shuffler_state,
-                                      self.solution_states,
-                                      self.solution_losses,
-                                      self.problem_data,
-                                      self.optimizer_states)
-
-            except (KeyboardInterrupt, StopIteration):
-                break
+        with abort_on_interrupt(self.control):
+            while True:
+                self.limits[DEADLINE] = code_runner.deadline()
+                self.limits[START_TIME] = code_runner.start_timestamp()
+                try:
+                    code_runner.run_block(runner_code.to_run,
+                                          self.query_vector,
+                                          self.shuffler_state,
+                                          self.solution_states,
+                                          self.solution_losses,
+                                          self.problem_data_array,
+                                          self.optimizer_states,
+                                          self.epoch_stats,
+                                          self.counters,
+                                          self.timespecs,
+                                          self.control,
+                                          self.limits,
+                                          self.trace,
+                                          self.trace_state)
+
+                except KeyboardInterrupt:
+                    self.control[REASON] = STOP_REASONS.index('aborted')
+                    break
+                except StopIteration:
+                    self.control[REASON] = STOP_REASONS.index(
+                        code_runner.stop_reason)
+                    break
+
+                if self.control[REASON] != 0:
+                    logger.info('Stopped: '
+                                f'{STOP_REASONS[self.control[REASON]]}')
+                    break
+
+                self.between_blocks()
+                self.export_telemetry(code_runner)
+                self.periodic_checkpoint(code_runner)
+
+        code_runner.close()
+        self.export_telemetry(code_runner)
+        self.periodic_checkpoint(code_runner, force=True)
 
         final_result_ix = self.shuffler_code.final_result(
             self.shuffler_state,
@@ -57,13 +190,32 @@ class CPURunner(Runner):
 
         result = Result(
             self.solution_losses[final_result_ix, 0],
-            self.solution_states[final_result_ix, 0],
+            self.Problem.export_solution(
+                self.solution_states[final_result_ix, 0],
+                self.problem_data
+            ),
             self.Problem
         )
 
+        epochs, work_time, shuffle_time = self.epoch_stats.tolist()
+        result.set_runtime_info(
+            epochs=int(epochs),
+            work_time=work_time,
+            shuffle_time=shuffle_time,
+            epoch_time=(work_time + shuffle_time) / max(epochs, 1),
+            stop_reason=STOP_REASONS[self.control[REASON]],
+            **code_runner.runtime_info(),
+            **telemetry.summarize(self.counters),
+            trace=telemetry.trace_result(self.trace, self.trace_state)
+        )
+
         return result
 
 
+    # Called after every block of iterations, in python
+    def between_blocks(self):
+        pass
+
     def is_compiled(self):
         return self._compiled is not None
 
@@ -74,13 +226,62 @@ class CPURunner(Runner):
         opt_state_dtype = self.Optimizer.state_dtype
 
         schedule_work = self.shuffler_code.schedule_work
+        shuffle = self.shuffler_code.shuffle
         step = self.optimizer_code.step
-
+        compiled_clock = compile_clock()
+        monotonic_ns = Compiler.ufunc(telemetry.monotonic_ns)
+        record_improvement = Compiler.ufunc(telemetry.record_improvement)
+
+        # Returns why the run should stop (index in STOP_REASONS, 0 to keep
+        # going) after `iterations` iterations reaching chunk_loss
+        # Improvements of the best loss are added to the trace
+        @Compiler.ufunc
+        def check_stop(control, limits, trace, trace_state, chunk_loss,
+                       iterations):
+            control[ITERATION] += iterations
+            if chunk_loss < limits[BEST_LOSS]:
+                limits[BEST_LOSS] = chunk_loss
+                control[SINCE_IMPROVEMENT] = 0
+                record_improvement(trace, trace_state, control[ITERATION],
+                                   compiled_clock() - limits[START_TIME],
+                                   chunk_loss)
+            else:
+                control[SINCE_IMPROVEMENT] += iterations
+
+            if control[ABORT] != 0:
+                return 1
+            if (limits[DEADLINE] < np.inf
+                    and compiled_clock() >= limits[DEADLINE]):
+                return 2
+            if chunk_loss <= limits[TARGET_LOSS]:
+                return 3
+            if (control[STAGNATION] > 0
+                    and control[SINCE_IMPROVEMENT] >= control[STAGNATION]):
+                return 4
+            return 0
+
+        # Runs epochs until the iterations are exhausted: the members selected
+        # by the shuffler run in parallel for the iterations it asked for,
+        # then the shuffle happens without going back to python
+        #
+        # The iterations of an epoch are run by chunks of check_every, the
+        # stopping criteria are checked after each of them. If one is met the
+        # epoch ends early and the function returns. The shuffle of that
+        # epoch is skipped: schedule_work already counted all its iterations,
+        # shuffling now would migrate/select before they are run. Shufflers
+        # keeping track of the iterations shuffle at the next epoch instead
         def to_run(query_vector, shuffler_state, solutions, losses,
-                   problem_data, optimizer_states, iterations):
-
+                   problem_data_array, optimizer_states, epoch_stats,
+                   counters, timespecs, control, limits, trace, trace_state,
+                   iterations):
+
+            check_every = control[CHECK_EVERY]
+            control[REASON] = 0
+            done = 0
+            best_loss = np.inf
             it_left = iterations
-            while it_left > 0:
+            while it_left > 0 and control[REASON] == 0:
+                start_time = compiled_clock()
                 pop_size, num_iterations = schedule_work(
                     query_vector,
                     shuffler_state,
@@ -90,27 +291,55 @@ class CPURunner(Runner):
                 )
                 num_iterations = min(num_iterations, it_left)
 
-                best_loss = np.inf
-                for pop_ix in numba.prange(pop_size):
-                    pop_id = query_vector[pop_ix]
-
-                    if opt_state_dtype is None:
-                        opt_states = None
-                    else:
-                        opt_states = optimizer_states[pop_id]
-
-                    closs = step(
-                        opt_states,
-                        solutions[pop_id],
-                        losses[pop_id],
-                        problem_data,
-                        num_iterations
-                    )
-
-                    best_loss = min(best_loss, closs)
-
-                it_left -= num_iterations
-
+                epoch_done = 0
+                while epoch_done < num_iterations:
+                    chunk = min(check_every, num_iterations - epoch_done)
+
+                    chunk_loss = np.inf
+                    for pop_ix in numba.prange(pop_size):
+                        pop_id = query_vector[pop_ix]
+
+                        if opt_state_dtype is None:
+                            opt_states = None
+                        else:
+                            opt_states = optimizer_states[pop_id]
+
+                        step_start = monotonic_ns(timespecs[pop_id])
+                        closs = step(
+                            opt_states,
+                            solutions[pop_id],
+                            losses[pop_id],
+                            problem_data_array[0],
+                            chunk,
+                            counters[pop_id]
+                        )
+                        step_time = (monotonic_ns(timespecs[pop_id])
+                                     - step_start)
+                        counters[pop_id, ITERATIONS] += chunk
+                        counters[pop_id, STEP_NS] += step_time
+
+                        chunk_loss = min(chunk_loss, closs)
+
+                    epoch_done += chunk
+                    best_loss = min(best_loss, chunk_loss)
+                    reason = check_stop(control, limits, trace, trace_state,
+                                        chunk_loss, chunk)
+                    if reason != 0:
+                        control[REASON] = reason
+                        break
+
+                work_done_time = compiled_clock()
+                epoch_stats[1] += work_done_time - start_time
+                if control[REASON] == 0:
+                    shuffle(query_vector, shuffler_state, solutions, losses,
+                            problem_data_array, optimizer_states)
+                    epoch_stats[0] += 1
+                    epoch_stats[2] += compiled_clock() - work_done_time
+
+                it_left -= epoch_done
+                done += epoch_done
+
+            control[DONE] = done
             return best_loss
 
         solution_state_ntype = numba.types.Array(
@@ -123,18 +352,27 @@ class CPURunner(Runner):
             optimizer_states = numba.types.Array(self.Optimizer.state_ntype, 1, 'C')
 
 
-        to_run_signature = numba.float32(
+        to_run_signature = Compiler.loss_ntype(
             query_vector_ntype,
             self.Shuffler.state_ntype,
             solution_state_ntype,
             solution_losses_ntype,
-            self.Problem.pdata_ntype,
+            numba.typeof(self.problem_data_array),
             optimizer_states,
+            numba.types.Array(numba.float64, 1, 'C'),
+            numba.types.Array(numba.int64, 2, 'C'),
+            numba.types.Array(numba.int64, 2, 'C'),
+            numba.types.Array(numba.int64, 1, 'C'),
+            numba.types.Array(numba.float64, 1, 'C'),
+            numba.typeof(self.trace),
+            numba.types.Array(numba.int64, 1, 'C'),
             numba.int32
         )
 
+        # Without the GIL so that other threads can set the abort flag
         compiled_to_run = Compiler.jit(type(self).__name__, 'to_run',
-                                       to_run_signature, to_run, parallel=True)
+                                       to_run_signature, to_run, parallel=True,
+                                       nogil=True)
 
         self._compiled = SimpleNamespace(
             to_run=compiled_to_run
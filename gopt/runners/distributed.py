@@ -0,0 +1,373 @@
+import socket
+import struct
+import asyncio
+import logging
+import threading
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+# Not the builtin TimeoutError before Python 3.11
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pytimeparse import parse
+import numpy as np
+
+from .cpu_runner import CPURunner
+
+logger = logging.getLogger('gopt').getChild('distributed')
+
+# Wire format
+#
+# Every message is prefixed by its length (4 bytes, big endian). A message
+# is a header followed by `count` solutions:
+# - request (node -> coordinator):
+#   node_id (u32), best_loss (f64), max_reply (u32), max_reply_bytes (u32),
+#   count (u32)
+# - reply (coordinator -> node): best_loss (f64) of all the nodes, count (u32)
+# - solution: loss (f64), size (u32), followed by the solution encoded by
+#   Problem.encode_solution. The loss only ranks the solutions in the pool
+#   of the coordinator, nodes compute it again
+REQUEST_HEADER = struct.Struct('!IdIII')
+REPLY_HEADER = struct.Struct('!dI')
+SOLUTION_HEADER = struct.Struct('!dI')
+LENGTH = struct.Struct('!I')
+
+
+def pack_solutions(solutions):
+    parts = []
+    for loss, data in solutions:
+        parts.append(SOLUTION_HEADER.pack(loss, len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def unpack_solutions(payload, offset, count):
+    solutions = []
+    for _ in range(count):
+        loss, size = SOLUTION_HEADER.unpack_from(payload, offset)
+        offset += SOLUTION_HEADER.size
+        solutions.append((loss, bytes(payload[offset:offset + size])))
+        offset += size
+    return solutions
+
+
+# Keeps the first solutions of the list fitting in max_count and max_bytes
+def bounded(solutions, max_count, max_bytes):
+    result = []
+    size = 0
+    for loss, data in solutions[:max_count]:
+        size += SOLUTION_HEADER.size + len(data)
+        if size > max_bytes:
+            break
+        result.append((loss, data))
+    return result
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+# Keeps the best solutions sent by the nodes and sends them back to the
+# other nodes. It never waits for a node, every exchange is answered right
+# away with what it knows so far so slow or dead nodes don't hold the
+# others back.
+#
+# Requests carry at most max_bytes bytes of solutions (the max_bytes of the
+# nodes), the connection of a client announcing a longer one is dropped
+# before anything is read or allocated.
+#
+# It can run in its own process (serve_forever) or in a background thread of
+# one of the nodes (start/stop), which is handy to try things on a single
+# machine
+class Coordinator:
+
+    def __init__(self, host='127.0.0.1', port=0, pool_size=16,
+                 max_bytes=1 << 20):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.max_bytes = max_bytes
+        # (loss, node_id, data) sorted by loss
+        self.pool = []
+        self.best_loss = np.inf
+        # Time of the last exchange of each node
+        self.last_seen = {}
+        self.exchanges = 0
+
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    def add(self, node_id, solutions):
+        for loss, data in solutions:
+            self.best_loss = min(self.best_loss, loss)
+            if any(data == other for _, _, other in self.pool):
+                continue
+            self.pool.append((loss, node_id, data))
+        self.pool.sort(key=lambda entry: entry[0])
+        del self.pool[self.pool_size:]
+
+    # Best solutions found by the other nodes
+    def migrants(self, node_id, max_count, max_bytes):
+        candidates = [(loss, data) for loss, other, data in self.pool
+                      if other != node_id]
+        return bounded(candidates, max_count, max_bytes)
+
+    def exchange(self, payload):
+        node_id, best_loss, max_reply, max_reply_bytes, count = \
+            REQUEST_HEADER.unpack_from(payload)
+        solutions = unpack_solutions(payload, REQUEST_HEADER.size, count)
+
+        self.exchanges += 1
+        self.last_seen[node_id] = time()
+        self.best_loss = min(self.best_loss, best_loss)
+        self.add(node_id, solutions)
+
+        migrants = self.migrants(node_id, max_reply,
+                                 min(max_reply_bytes, self.max_bytes))
+        return (REPLY_HEADER.pack(self.best_loss, len(migrants))
+                + pack_solutions(migrants))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    length, = LENGTH.unpack(
+                        await reader.readexactly(LENGTH.size))
+                    if length > REQUEST_HEADER.size + self.max_bytes:
+                        raise ValueError(f'Request of {length} bytes, the '
+                                         f'limit is {self.max_bytes} bytes '
+                                         f'of solutions')
+                    payload = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                reply = self.exchange(payload)
+                writer.write(LENGTH.pack(len(reply)) + reply)
+                await writer.drain()
+        except (ConnectionError, struct.error, ValueError) as e:
+            logger.warning(f'Dropping connection: {e}')
+        finally:
+            writer.close()
+
+    async def serve(self, ready=None):
+        self._server = await asyncio.start_server(self.handle, self.host,
+                                                  self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f'Coordinator listening on {self.host}:{self.port}')
+        if ready is not None:
+            ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    # Runs the coordinator in a background thread, returns its address
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.serve(ready))
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.host, self.port
+
+    def stop(self):
+        def shutdown():
+            self._server.close()
+            for task in asyncio.all_tasks():
+                task.cancel()
+
+        if self._server is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(shutdown)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+# A CPURunner acting as one island of an optimization spread over several
+# machines. Every exchange_interval (a duration, '5s'...) it sends its
+# `migrants` best solutions to the coordinator at `address` and receives the
+# best ones found by the other nodes, which replace its worst members when
+# they are better.
+#
+# Exchanges run in a background thread so the optimization never waits for
+# the network: migrants received are injected between two blocks of
+# iterations. Each exchange carries at most `migrants` solutions and
+# max_bytes bytes each way. If the coordinator is unreachable the node keeps
+# optimizing on its own and retries at the next exchange
+class DistributedRunner(CPURunner):
+
+    def __init__(self, Shuffler, problem_data, address, node_id=0,
+                 exchange_interval='5s', migrants=2, max_bytes=1 << 20,
+                 timeout=5.0, num_cores=None):
+        super().__init__(Shuffler, problem_data, num_cores=num_cores)
+
+        if isinstance(exchange_interval, str):
+            exchange_interval = parse(exchange_interval)
+
+        self.address = tuple(address)
+        self.node_id = node_id
+        self.exchange_interval = exchange_interval
+        self.migrants = migrants
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self._socket = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        self._last_exchange = time()
+        # Scratch state the migrants are decoded in (see inject)
+        self._migrant = self.problem_code.allocator(1, 1)[0]
+
+        self.exchange_stats = dict(exchanges=0, failed_exchanges=0,
+                                   migrants_received=0, migrants_accepted=0,
+                                   bytes_sent=0, bytes_received=0,
+                                   global_best_loss=np.inf)
+
+    def elites(self):
+        losses = self.solution_losses[:, 0]
+        best = np.argsort(losses)[:self.migrants]
+        return [(float(losses[i]),
+                 self.Problem.encode_solution(self.solution_states[i, 0]))
+                for i in best]
+
+    def connect(self):
+        if self._socket is None:
+            self._socket = socket.create_connection(self.address,
+                                                    timeout=self.timeout)
+        return self._socket
+
+    # Runs in the background thread
+    def exchange(self, best_loss, elites):
+        request = (REQUEST_HEADER.pack(self.node_id, best_loss,
+                                       self.migrants, self.max_bytes,
+                                       len(elites))
+                   + pack_solutions(elites))
+        try:
+            sock = self.connect()
+            sock.sendall(LENGTH.pack(len(request)) + request)
+            length, = LENGTH.unpack(recv_exactly(sock, LENGTH.size))
+            if length > REPLY_HEADER.size + self.max_bytes:
+                raise ConnectionError(f'Reply of {length} bytes, the limit '
+                                      f'is {self.max_bytes} bytes of '
+                                      f'solutions')
+            reply = recv_exactly(sock, length)
+        except OSError:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+            raise
+
+        global_best_loss, count = REPLY_HEADER.unpack_from(reply)
+        migrants = unpack_solutions(reply, REPLY_HEADER.size, count)
+        return global_best_loss, migrants, len(request), len(reply)
+
+    # Replaces the worst members by the migrants that are better. Like with
+    # IslandShuffler every state of the member is replaced so that its
+    # search continues from the migrant
+    #
+    # Migrants come from the network: they are decoded in a scratch state
+    # (decode_solution rejects invalid ones) and their loss is computed
+    # again instead of trusting the one sent with them
+    def inject(self, migrants):
+        accepted = 0
+        order = np.argsort(self.solution_losses[:, 0])[::-1]
+        candidate = self._migrant[0]
+        for target, (_, data) in zip(order, migrants):
+            try:
+                self.Problem.decode_solution(data, candidate)
+            except ValueError as e:
+                logger.warning(f'Invalid migrant: {e}')
+                continue
+            loss = self.problem_code.loss(candidate, self.problem_data)
+            if loss >= self.solution_losses[target, 0]:
+                continue
+            self.solution_states[target, :] = candidate
+            self.solution_losses[target, :] = loss
+            accepted += 1
+        return accepted
+
+    # Gathers the result of the exchange in flight, migrants are only added
+    # to the population if inject is True
+    def collect(self, inject=True):
+        stats = self.exchange_stats
+        try:
+            global_best, migrants, sent, received = self._pending.result(
+                timeout=self.timeout)
+        except (OSError, struct.error, FutureTimeoutError) as e:
+            stats['failed_exchanges'] += 1
+            logger.warning(f'Node {self.node_id}: exchange failed ({e})')
+        else:
+            stats['exchanges'] += 1
+            stats['bytes_sent'] += sent
+            stats['bytes_received'] += received
+            stats['migrants_received'] += len(migrants)
+            if inject:
+                stats['migrants_accepted'] += self.inject(migrants)
+            stats['global_best_loss'] = min(stats['global_best_loss'],
+                                            global_best)
+        self._pending = None
+
+    def start_exchange(self):
+        self._last_exchange = time()
+        elites = bounded(self.elites(), self.migrants, self.max_bytes)
+        best_loss = float(self.solution_losses[:, 0].min())
+        self._pending = self._executor.submit(self.exchange, best_loss,
+                                              elites)
+
+    def between_blocks(self):
+        if self._pending is not None and self._pending.done():
+            self.collect()
+
+        if (self._pending is None
+                and time() - self._last_exchange >= self.exchange_interval):
+            self.start_exchange()
+
+    def run(self, max_iter=None, max_time=None, **kwargs):
+        result = super().run(max_iter=max_iter, max_time=max_time, **kwargs)
+
+        # Last exchange so that the coordinator knows our final solutions
+        # The result points to our population so migrants are not injected
+        if self._pending is not None:
+            self.collect(inject=False)
+        self.start_exchange()
+        self.collect(inject=False)
+
+        result.set_runtime_info(**self.exchange_stats)
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+# python -m gopt.runners.distributed --host 0.0.0.0 --port 7777
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='GOPT coordinator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--pool-size', type=int, default=16)
+    parser.add_argument('--max-bytes', type=int, default=1 << 20)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s [%(name)s]:%(message)s',
+                        level=logging.INFO)
+    Coordinator(args.host, args.port, args.pool_size,
+                args.max_bytes).serve_forever()
@@ -0,0 +1,416 @@
+import os
+import glob
+import logging
+import threading
+import multiprocessing
+from time import time
+from multiprocessing import shared_memory
+import numpy as np
+import numba
+
+from .base import Runner
+from ..result import Result
+from ..compiler import Compiler
+from .. import telemetry
+from ..telemetry import ITERATIONS, STEP_NS
+
+# Commands sent to the workers
+STOP = 0
+RUN = 1
+
+# How often the main process checks that the workers are alive and how long
+# it waits for them to exit (seconds)
+WATCHDOG_INTERVAL = 1.0
+STOP_TIMEOUT = 10.0
+
+# Threading layers the main process can use before forking the workers
+FORK_SAFE_LAYERS = ('workqueue', 'omp')
+
+
+# Lists of the cpus of each NUMA node (a single node with all the cpus we are
+# allowed to use if the topology is not available)
+def numa_nodes():
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node*/cpulist')):
+        with open(path) as f:
+            cpus = parse_cpulist(f.read()) & allowed
+        if cpus:
+            nodes.append(sorted(cpus))
+    if not nodes:
+        nodes.append(sorted(allowed))
+    return nodes
+
+
+# Parses the cpu lists of the kernel (like 0-3,8-11)
+def parse_cpulist(cpulist):
+    cpus = set()
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+# Runs the population in num_workers processes instead of threads
+#
+# The population, the losses, the states of the optimizer and the shuffler
+# and the problem data live in shared memory. Each worker runs the compiled
+# step function on its slice of the members scheduled by the shuffler, the
+# main process runs schedule_work and shuffle between two epochs. Epochs are
+# synchronized with a barrier.
+#
+# pin:
+# - 'core': each worker is pinned to a core, spread over the NUMA nodes
+# - 'node': each worker is pinned to all the cores of a NUMA node
+# - None: no pinning
+#
+# Workers are forked so that they inherit the compiled code, this runner is
+# only available on platforms supporting fork.
+#
+# Epochs can be arbitrarily long so there is no timeout on the barrier by
+# default (barrier_timeout, in seconds). A watchdog thread breaks it if a
+# worker process dies so that the main process doesn't wait forever.
+#
+# TBB is not fork safe: processes using it that forked hang. The threading
+# layer is chosen once for the whole process by the first parallel kernel
+# (the initialization of the population for instance) and the default one
+# of the Compiler is TBB, so using this runner is an opt-in: set
+# Compiler.threading_layer to 'workqueue' (or 'omp') before creating any
+# runner. Other layers are refused, including numba's 'forksafe' and
+# 'default' that pick TBB when it is installed
+class ProcessPoolRunner(Runner):
+
+    def __init__(self, Shuffler, problem_data, num_workers=None, pin='core',
+                 barrier_timeout=None):
+        if Compiler.threading_layer not in FORK_SAFE_LAYERS:
+            raise ValueError(f"The '{Compiler.threading_layer}' threading "
+                             f"layer is not fork safe, set "
+                             f"Compiler.threading_layer to 'workqueue' "
+                             f"before creating any runner to use "
+                             f"ProcessPoolRunner")
+
+        super().__init__(Shuffler, problem_data)
+
+        if pin not in ('core', 'node', None):
+            raise ValueError("pin should be 'core', 'node' or None")
+
+        nodes = numa_nodes()
+        if num_workers is None:
+            num_workers = sum(len(cpus) for cpus in nodes)
+
+        self.num_workers = num_workers
+        self.barrier_timeout = barrier_timeout
+        self.worker_cpus = self.assign_cpus(nodes, pin)
+        self.logger.info(f'Using {num_workers} processes on '
+                         f'{len(nodes)} NUMA nodes')
+
+        # Move all the state shared by the workers to shared memory
+        self._shared_memory = []
+        self.solution_states = self.share(self.solution_states)
+        self.solution_losses = self.share(self.solution_losses)
+        self.query_vector = self.share(self.query_vector)
+        self.counters = self.share(self.counters)
+        self.problem_data_array = self.share(self.problem_data_array)
+        self.problem_data = self.problem_data_array[0]
+        if self.optimizer_states is not None:
+            self.optimizer_states = self.share(self.optimizer_states)
+        if self.shuffler_state is not None:
+            self.shuffler_state = self.share(
+                self.shuffler_state.base)[0]
+
+        # Command, number of members to run, iterations
+        self.control = self.share(np.zeros(3, dtype=np.int64))
+        # Best loss seen by each worker during the last epoch
+        self.worker_losses = self.share(np.full(num_workers, np.inf))
+
+        # Number of epochs, time spent in the optimizers and time spent
+        # shuffling (see CPURunner)
+        self.epoch_stats = np.zeros(3, dtype=np.float64)
+
+    # Allocates a copy of array in shared memory
+    def share(self, array):
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(array.nbytes, 1))
+        self._shared_memory.append(shm)
+        result = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        result[...] = array
+        return result
+
+    def assign_cpus(self, nodes, pin):
+        if pin is None:
+            return [None] * self.num_workers
+        if pin == 'node':
+            return [nodes[w % len(nodes)] for w in range(self.num_workers)]
+
+        # Round robin over the nodes so that workers are spread evenly
+        cores = []
+        for i in range(max(len(cpus) for cpus in nodes)):
+            for cpus in nodes:
+                if i < len(cpus):
+                    cores.append(cpus[i])
+        return [[cores[w % len(cores)]] for w in range(self.num_workers)]
+
+    def close(self):
+        for shm in self._shared_memory:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._shared_memory = []
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def is_compiled(self):
+        return self._compiled is not None
+
+    def compile(self):
+        if self.is_compiled():
+            return self._compiled
+
+        opt_state_dtype = self.Optimizer.state_dtype
+        step = self.optimizer_code.step
+        monotonic_ns = Compiler.ufunc(telemetry.monotonic_ns)
+
+        # Runs the members scheduled at positions [start, stop) of the
+        # query_vector
+        def run_members(query_vector, start, stop, solutions, losses,
+                        problem_data, optimizer_states, counters, timespecs,
+                        iterations):
+            best_loss = np.inf
+            for pop_ix in range(start, stop):
+                pop_id = query_vector[pop_ix]
+
+                if opt_state_dtype is None:
+                    opt_states = None
+                else:
+                    opt_states = optimizer_states[pop_id]
+
+                step_start = monotonic_ns(timespecs[pop_id])
+                closs = step(
+                    opt_states,
+                    solutions[pop_id],
+                    losses[pop_id],
+                    problem_data,
+                    iterations,
+                    counters[pop_id]
+                )
+                counters[pop_id, ITERATIONS] += iterations
+                counters[pop_id, STEP_NS] += (monotonic_ns(timespecs[pop_id])
+                                              - step_start)
+                best_loss = min(best_loss, closs)
+
+            return best_loss
+
+        if opt_state_dtype is None:
+            optimizer_states = numba.typeof(None)
+        else:
+            optimizer_states = numba.types.Array(self.Optimizer.state_ntype,
+                                                 1, 'C')
+
+        run_members_signature = Compiler.loss_ntype(
+            numba.types.Array(numba.int32, 1, 'C'),
+            numba.int64,
+            numba.int64,
+            numba.types.Array(self.Problem.state_ntype, 2, 'C'),
+            numba.types.Array(Compiler.loss_ntype, 2, 'C'),
+            self.Problem.pdata_ntype,
+            optimizer_states,
+            numba.types.Array(numba.int64, 2, 'C'),
+            numba.types.Array(numba.int64, 2, 'C'),
+            numba.int64
+        )
+
+        self._compiled = Compiler.jit(type(self).__name__, 'run_members',
+                                      run_members_signature, run_members)
+
+        return self._compiled
+
+    def worker(self, worker_id, barrier):
+        run_members = self._compiled
+        cpus = self.worker_cpus[worker_id]
+        if cpus is not None:
+            try:
+                os.sched_setaffinity(0, cpus)
+            except OSError as e:
+                self.logger.warning(f'Could not pin worker {worker_id}: {e}')
+
+        try:
+            while True:
+                barrier.wait()
+                command, pop_size, iterations = self.control
+                if command == STOP:
+                    return
+
+                start = pop_size * worker_id // self.num_workers
+                stop = pop_size * (worker_id + 1) // self.num_workers
+                self.worker_losses[worker_id] = run_members(
+                    self.query_vector, start, stop,
+                    self.solution_states, self.solution_losses,
+                    self.problem_data, self.optimizer_states, self.counters,
+                    self.timespecs, iterations)
+                barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        except BaseException:
+            self.logger.exception(f'Worker {worker_id} failed')
+            barrier.abort()
+
+    # Breaks the barrier as soon as a worker is dead, until stopped is set
+    @staticmethod
+    def watchdog(workers, barrier, stopped):
+        while not stopped.wait(WATCHDOG_INTERVAL):
+            if any(not w.is_alive() for w in workers):
+                barrier.abort()
+                return
+
+    # Runs epochs until the iterations are exhausted (see
+    # CPURunner.compile's to_run)
+    def run_epochs(self, barrier, iterations):
+        best_loss = np.inf
+        it_left = iterations
+        while it_left > 0:
+            pop_size, num_iterations = self.shuffler_code.schedule_work(
+                self.query_vector,
+                self.shuffler_state,
+                self.solution_states,
+                self.solution_losses,
+                it_left
+            )
+            num_iterations = min(num_iterations, it_left)
+
+            start_time = time()
+            self.worker_losses[:] = np.inf
+            self.control[:] = (RUN, pop_size, num_iterations)
+            barrier.wait()
+            barrier.wait()
+            best_loss = self.worker_losses.min()
+
+            # Convergence trace, after every epoch
+            self._iteration += num_iterations
+            if best_loss < self._best_loss:
+                self._best_loss = best_loss
+                telemetry.record_improvement(self.trace, self.trace_state,
+                                             self._iteration,
+                                             time() - self._start_time,
+                                             best_loss)
+
+            work_done_time = time()
+            self.shuffler_code.shuffle(self.query_vector,
+                                       self.shuffler_state,
+                                       self.solution_states,
+                                       self.solution_losses,
+                                       self.problem_data_array,
+                                       self.optimizer_states)
+
+            self.epoch_stats[0] += 1
+            self.epoch_stats[1] += work_done_time - start_time
+            self.epoch_stats[2] += time() - work_done_time
+
+            it_left -= num_iterations
+
+        return best_loss
+
+    # See CPURunner.run for checkpoint and checkpoint_interval
+    def run(self, max_iter=None, max_time=None, checkpoint=None,
+            checkpoint_interval='5 min'):
+        self.compile()
+
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(self.num_workers + 1,
+                                  timeout=self.barrier_timeout)
+        workers = [context.Process(target=self.worker, args=(w, barrier),
+                                   daemon=True)
+                   for w in range(self.num_workers)]
+        for w in workers:
+            w.start()
+        stopped = threading.Event()
+        watchdog = threading.Thread(target=self.watchdog,
+                                    args=(workers, barrier, stopped),
+                                    daemon=True)
+        watchdog.start()
+
+        self.start_trace()
+        code_runner = self.code_runner(max_iter, max_time, checkpoint,
+                                       checkpoint_interval)
+        self._iteration = code_runner.current_iter
+        self._start_time = code_runner.start_timestamp()
+        self._best_loss = np.inf
+
+        logger = logging.getLogger('gopt').getChild(type(self).__name__)
+        logger.info('Optimizing')
+
+        try:
+            while True:
+                try:
+                    code_runner.run_block(self.run_epochs, barrier)
+                except (KeyboardInterrupt, StopIteration):
+                    break
+                except threading.BrokenBarrierError:
+                    dead = {w: p.exitcode for w, p in enumerate(workers)
+                            if not p.is_alive()}
+                    if dead:
+                        raise RuntimeError(f'Workers stopped (worker: exit '
+                                           f'code): {dead}')
+                    raise RuntimeError(f'Workers did not finish their epoch '
+                                       f'within {self.barrier_timeout}s')
+                # The workers are waiting at the barrier, the state is
+                # consistent
+                self.export_telemetry(code_runner)
+                self.periodic_checkpoint(code_runner)
+        finally:
+            stopped.set()
+            watchdog.join()
+            if not barrier.broken:
+                self.control[0] = STOP
+                try:
+                    barrier.wait()
+                except threading.BrokenBarrierError:
+                    pass
+            for w in workers:
+                w.join(timeout=STOP_TIMEOUT)
+                if w.is_alive():
+                    w.terminate()
+
+        code_runner.close()
+        self.export_telemetry(code_runner)
+        self.periodic_checkpoint(code_runner, force=True)
+
+        final_result_ix = self.shuffler_code.final_result(
+            self.shuffler_state,
+            self.solution_states,
+            self.solution_losses,
+            self.Shuffler.population_size
+        )
+
+        result = Result(
+            self.solution_losses[final_result_ix, 0],
+            self.Problem.export_solution(
+                self.solution_states[final_result_ix, 0].copy(),
+                self.problem_data
+            ),
+            self.Problem
+        )
+
+        epochs, work_time, shuffle_time = self.epoch_stats.tolist()
+        result.set_runtime_info(
+            epochs=int(epochs),
+            work_time=work_time,
+            shuffle_time=shuffle_time,
+            epoch_time=(work_time + shuffle_time) / max(epochs, 1),
+            num_workers=self.num_workers,
+            **code_runner.runtime_info(),
+            **telemetry.summarize(self.counters),
+            trace=telemetry.trace_result(self.trace, self.trace_state)
+        )
+
+        return result
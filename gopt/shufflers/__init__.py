@@ -1,2 +1,5 @@
 from .independent import IndependentShuffler
 from .win_take_all import WinnerTakesAll
+from .island import IslandShuffler
+from .parallel_tempering import ParallelTempering
+from .memetic import MemeticShuffler
@@ -25,7 +25,8 @@ class Shuffler(Compilable, metaclass=ABCMeta):
     #  - int, saying how many iterations shoulr be ran before the next shuffle
     #
     #  The indices of the population that should be run should be written
-    #  in the query_vector array
+    #  in the query_vector array. Each member is run with its own optimizer
+    #  state, wherever it is in the query_vector
     #
     # Please note the lack of *self* as the first argument!
     @staticmethod
@@ -36,11 +37,21 @@ class Shuffler(Compilable, metaclass=ABCMeta):
 
     # This function implements the shuffle operation
     #
+    # It is called by the runner (inside the compiled loop) every time the
+    # iterations returned by schedule_work are done. This defines the epochs
+    # of the optimization. Shufflers migrating less often can keep track of
+    # the iterations in their state and do nothing in between
+    #
+    # It receives the query_vector used for the epoch that just finished,
+    # the problem data as a one element array (so that it can be used in
+    # parallel loops) and the optimizer states of the members (None if the
+    # optimizer has no state)
+    #
     # Please note the lack of *self* as the first argument!
     @staticmethod
     @abstractmethod
-    def shuffle(shuffler_state, solution_states,
-                solution_losses):
+    def shuffle(query_vector, shuffler_state, solution_states,
+                solution_losses, problem_data_array, optimizer_states):
         raise NotImplementedError
 
     # This is the function called to initialize the state of the shuffler
@@ -92,6 +103,12 @@ class Shuffler(Compilable, metaclass=ABCMeta):
             cls.Optimizer.Problem.state_ntype, 2, 'C')
         solution_losses_ntype = numba.types.Array(Compiler.loss_ntype, 2, 'C')
         query_vector_ntype = numba.types.Array(numba.int32, 1, 'C')
+        cls.Optimizer.compile()
+        if cls.Optimizer.state_dtype is None:
+            optimizer_states_ntype = numba.typeof(None)
+        else:
+            optimizer_states_ntype = numba.types.Array(
+                cls.Optimizer.state_ntype, 1, 'C')
 
         # Shoud match the signature of cls.schedule_work(...)
         schedule_work_ret_type = numba.types.Tuple((numba.int32, numba.int32))
@@ -105,9 +122,12 @@ class Shuffler(Compilable, metaclass=ABCMeta):
 
         # Should match the signature of cls.shuffle(...)
         shuffle_signature = numba.void(
+            query_vector_ntype,
             cls.state_ntype,
             solution_state_ntype,
-            solution_losses_ntype
+            solution_losses_ntype,
+            numba.types.Array(cls.Optimizer.Problem.pdata_ntype, 1, 'C'),
+            optimizer_states_ntype
         )
 
         init_signature = numba.void(
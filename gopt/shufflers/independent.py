@@ -18,8 +18,8 @@ def IndependentShuffler(Optimizer, population_size):
 
         # Optimizers are independent in the IndependentShuffler
         @staticmethod
-        def shuffle(shuffler_state, solution_states,
-                    solution_losses):
+        def shuffle(query_vector, shuffler_state, solution_states,
+                    solution_losses, problem_data_array, optimizer_states):
             pass
 
     IndependentShuffler.Optimizer = Optimizer
@@ -0,0 +1,152 @@
+import math
+import numpy as np
+
+from .base import Shuffler
+
+TOPOLOGIES = ['ring', 'torus', 'random']
+
+# The population is split in num_islands islands of island_size members
+# (members [i * island_size, (i + 1) * island_size) form the island i).
+# Every migration_interval iterations (or after every block of iterations run
+# by the runner if None) each island sends, with probability migration_rate,
+# its best `migrants` members to another island where they replace the worst
+# ones (if they are better).
+#
+# topology decides where an island sends its migrants:
+# - 'ring': to the next island
+# - 'torus': islands are laid out on a grid of torus_width columns and send
+#   to their east, south, west and north neighbor in turn
+# - 'random': along a ring over a random permutation of the islands drawn at
+#   each migration
+#
+# Every island receives from a single one so migrants and replaced members
+# never overlap (hence migrants <= island_size // 2) and only the slots
+# involved in the migration are touched
+#
+# A migrant replaces every state of the member it takes the place of, so
+# the search of that member continues from the migrant (like the children of
+# MemeticShuffler)
+def IslandShuffler(Optimizer, num_islands, island_size, topology='ring',
+                   migrants=1, migration_rate=1.0, migration_interval=None,
+                   torus_width=None):
+
+    Optimizer.compile()
+
+    if topology not in TOPOLOGIES:
+        raise ValueError(f"Unknown topology {topology}, "
+                         f"available: {', '.join(TOPOLOGIES)}")
+    if not 1 <= migrants <= island_size // 2:
+        raise ValueError(f"migrants should be in [1, {island_size // 2}]")
+
+    if migration_interval is None:
+        migration_interval = 0
+    elif migration_interval <= 0:
+        raise ValueError("migration_interval should be positive")
+
+    if topology == 'torus':
+        if torus_width is None:
+            # Closest to a square grid
+            torus_width = max(w for w in range(1, math.isqrt(num_islands) + 1)
+                              if num_islands % w == 0)
+        elif num_islands % torus_width != 0:
+            raise ValueError("torus_width should divide num_islands")
+    else:
+        torus_width = 1
+    torus_height = num_islands // torus_width
+
+    ring = topology == 'ring'
+    torus = topology == 'torus'
+
+    population_size = num_islands * island_size
+    states_required = Optimizer.states_required
+
+    class IslandShuffler(Shuffler):
+
+        state_dtype = np.dtype([
+            # Iterations left before the next migration
+            ('until_migration', np.int64),
+            ('migrations', np.int64)
+        ])
+
+        @staticmethod
+        def schedule_work(query_vector, shuffler_state, solution_states,
+                          solution_losses, total_iterations):
+            if migration_interval == 0:
+                return population_size, total_iterations
+
+            num_iterations = min(shuffler_state['until_migration'],
+                                 total_iterations)
+            shuffler_state['until_migration'] -= num_iterations
+            return population_size, num_iterations
+
+        @staticmethod
+        def init(shuffler_state, query_vector):
+            shuffler_state['until_migration'] = migration_interval
+            shuffler_state['migrations'] = 0
+            for i in range(population_size):
+                query_vector[i] = i
+
+        @staticmethod
+        def shuffle(query_vector, shuffler_state, solution_states,
+                    solution_losses, problem_data_array, optimizer_states):
+            if migration_interval != 0:
+                if shuffler_state['until_migration'] > 0:
+                    return
+                shuffler_state['until_migration'] = migration_interval
+
+            # Destination of the migrants of each island
+            destinations = np.empty(num_islands, dtype=np.int64)
+            if ring:
+                for island in range(num_islands):
+                    destinations[island] = (island + 1) % num_islands
+            elif torus:
+                direction = shuffler_state['migrations'] % 4
+                for island in range(num_islands):
+                    row = island // torus_width
+                    col = island % torus_width
+                    if direction == 0:
+                        col = (col + 1) % torus_width
+                    elif direction == 1:
+                        row = (row + 1) % torus_height
+                    elif direction == 2:
+                        col = (col - 1) % torus_width
+                    else:
+                        row = (row - 1) % torus_height
+                    destinations[island] = row * torus_width + col
+            else:
+                permutation = np.random.permutation(num_islands)
+                for i in range(num_islands):
+                    destinations[permutation[i]] = permutation[
+                        (i + 1) % num_islands]
+            shuffler_state['migrations'] += 1
+
+            # Members of each island sorted by loss, the first ones are sent
+            # and the last ones replaced
+            ranking = np.empty((num_islands, island_size), dtype=np.int64)
+            for island in range(num_islands):
+                start = island * island_size
+                losses = np.empty(island_size, dtype=solution_losses.dtype)
+                for i in range(island_size):
+                    losses[i] = solution_losses[start + i, 0]
+                ranking[island] = start + np.argsort(losses)
+
+            for island in range(num_islands):
+                if np.random.random() >= migration_rate:
+                    continue
+                destination = destinations[island]
+                if destination == island:
+                    continue
+                for i in range(migrants):
+                    source = ranking[island, i]
+                    target = ranking[destination, island_size - 1 - i]
+                    if solution_losses[source, 0] < solution_losses[target, 0]:
+                        for s in range(states_required):
+                            solution_states[target][s] = \
+                                solution_states[source][0]
+                            solution_losses[target, s] = \
+                                solution_losses[source, 0]
+
+    IslandShuffler.Optimizer = Optimizer
+    IslandShuffler.population_size = population_size
+
+    return IslandShuffler
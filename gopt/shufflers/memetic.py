@@ -0,0 +1,143 @@
+import numba
+import numpy as np
+
+from .base import Shuffler
+from ..compiler import Compiler
+
+# Memetic algorithm: a genetic algorithm where the offspring are improved by
+# the optimizer before competing with the rest of the population
+#
+# Every generation_interval iterations (or after every block of iterations
+# run by the runner if None) the `offspring` worst members of the population
+# are replaced by the recombination (Problem.crossover) of two parents
+# selected by tournaments of tournament_size among the other members.
+# Offspring are written in place in the slots of the members they replace
+# and bred in parallel.
+#
+# Only the offspring are run by the optimizer between two generations
+# (except before the first one where the whole population is improved)
+def MemeticShuffler(Optimizer, population_size, offspring,
+                    tournament_size=2, generation_interval=None):
+
+    Optimizer.compile()
+    problem = Optimizer.Problem.compile()
+
+    if problem.crossover is None:
+        raise ValueError(f"{Optimizer.Problem.__name__} does not provide "
+                         "a crossover")
+    if not 1 <= offspring <= population_size - 2:
+        raise ValueError(f"offspring should be in [1, {population_size - 2}]")
+    if tournament_size < 1:
+        raise ValueError("tournament_size should be positive")
+
+    if generation_interval is None:
+        generation_interval = 0
+    elif generation_interval <= 0:
+        raise ValueError("generation_interval should be positive")
+
+    # We have to extract the functions from the namespace object
+    # Otherwise numba will be confused
+    crossover = problem.crossover
+    loss = problem.loss
+    copy_state = problem.copy_state
+
+    states_required = Optimizer.states_required
+    num_parents = population_size - offspring
+
+    def breed(children, parents_a, parents_b, solution_states,
+              solution_losses, problem_data_array):
+        for i in numba.prange(len(children)):
+            problem_data = problem_data_array[0]
+            child = children[i]
+            crossover(solution_states[parents_a[i], 0],
+                      solution_states[parents_b[i], 0],
+                      solution_states[child, 0], problem_data)
+
+            child_loss = loss(solution_states[child, 0], problem_data)
+            solution_losses[child, 0] = child_loss
+            # Every state of the optimizer starts from the child
+            for s in range(1, states_required):
+                copy_state(solution_states[child], 0,
+                           solution_states[child], s)
+                solution_losses[child, s] = child_loss
+
+    # The breeding loop is parallel, it can't be inlined in shuffle
+    breed = Compiler.jit('MemeticShuffler', 'breed', None, breed,
+                         parallel=True, inline='never')
+
+    # Members are given sorted by loss so the winner of a tournament is the
+    # one with the lowest rank
+    @Compiler.ufunc
+    def tournament(ranking):
+        best = num_parents
+        for _ in range(tournament_size):
+            best = min(best, np.random.randint(0, num_parents))
+        return ranking[best]
+
+    class MemeticShuffler(Shuffler):
+
+        state_dtype = np.dtype([
+            # Iterations left before the next generation
+            ('until_generation', np.int64),
+            ('generations', np.int64)
+        ])
+
+        @staticmethod
+        def schedule_work(query_vector, shuffler_state, solution_states,
+                          solution_losses, total_iterations):
+            if shuffler_state['generations'] == 0:
+                pop_size = population_size
+            else:
+                pop_size = offspring
+
+            if generation_interval == 0:
+                return pop_size, total_iterations
+
+            num_iterations = min(shuffler_state['until_generation'],
+                                 total_iterations)
+            shuffler_state['until_generation'] -= num_iterations
+            return pop_size, num_iterations
+
+        @staticmethod
+        def init(shuffler_state, query_vector):
+            shuffler_state['until_generation'] = generation_interval
+            shuffler_state['generations'] = 0
+            for i in range(population_size):
+                query_vector[i] = i
+
+        @staticmethod
+        def shuffle(query_vector, shuffler_state, solution_states,
+                    solution_losses, problem_data_array, optimizer_states):
+            if generation_interval != 0:
+                if shuffler_state['until_generation'] > 0:
+                    return
+                shuffler_state['until_generation'] = generation_interval
+
+            losses = np.empty(population_size, dtype=solution_losses.dtype)
+            for i in range(population_size):
+                losses[i] = solution_losses[i, 0]
+            ranking = np.argsort(losses)
+
+            children = ranking[num_parents:].copy()
+            parents_a = np.empty(offspring, dtype=np.int64)
+            parents_b = np.empty(offspring, dtype=np.int64)
+            for i in range(offspring):
+                parents_a[i] = tournament(ranking)
+                parents_b[i] = tournament(ranking)
+                # A few more tries to get two different parents
+                for _ in range(8):
+                    if parents_b[i] != parents_a[i]:
+                        break
+                    parents_b[i] = tournament(ranking)
+
+            breed(children, parents_a, parents_b, solution_states,
+                  solution_losses, problem_data_array)
+
+            for i in range(offspring):
+                query_vector[i] = children[i]
+            shuffler_state['generations'] += 1
+
+    MemeticShuffler.Optimizer = Optimizer
+    MemeticShuffler.population_size = population_size
+
+    return MemeticShuffler
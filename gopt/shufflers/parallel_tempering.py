@@ -0,0 +1,99 @@
+import numpy as np
+
+from .base import Shuffler
+
+# Replica exchange between the members of a SimulatedAnnealing optimizer
+# created with a ladder of temperatures (see its temperatures argument)
+#
+# The i-th member starts at temperatures[i]. Every exchange_interval
+# iterations (or after every block of iterations run by the runner if None)
+# replicas at neighboring temperatures are swapped with the Metropolis
+# criterion on their current loss, alternating between even and odd pairs.
+#
+# An exchange swaps the temperatures in the optimizer states of the two
+# members: solutions never move, an exchange is O(1). The shuffler state
+# keeps which member runs at each rung of the ladder
+def ParallelTempering(Optimizer, exchange_interval=None):
+
+    Optimizer.compile()
+
+    temperatures = getattr(Optimizer, 'temperatures', None)
+    if temperatures is None:
+        raise ValueError("ParallelTempering needs a SimulatedAnnealing "
+                         "optimizer with a ladder of temperatures")
+
+    if exchange_interval is None:
+        exchange_interval = 0
+    elif exchange_interval <= 0:
+        raise ValueError("exchange_interval should be positive")
+
+    population_size = len(temperatures)
+    inverse_temperatures = 1 / temperatures
+
+    # SimulatedAnnealing keeps the current solution of the chain at index 1
+    current = 1
+
+    class ParallelTempering(Shuffler):
+
+        state_dtype = np.dtype([
+            # Iterations left before the next exchange
+            ('until_exchange', np.int64),
+            ('exchanges', np.int64),
+            ('accepted', np.int64),
+            ('attempted', np.int64),
+            # Member running at each temperature of the ladder
+            ('members', np.int32, population_size)
+        ])
+
+        @staticmethod
+        def schedule_work(query_vector, shuffler_state, solution_states,
+                          solution_losses, total_iterations):
+            if exchange_interval == 0:
+                return population_size, total_iterations
+
+            num_iterations = min(shuffler_state['until_exchange'],
+                                 total_iterations)
+            shuffler_state['until_exchange'] -= num_iterations
+            return population_size, num_iterations
+
+        @staticmethod
+        def init(shuffler_state, query_vector):
+            shuffler_state['until_exchange'] = exchange_interval
+            shuffler_state['exchanges'] = 0
+            shuffler_state['accepted'] = 0
+            shuffler_state['attempted'] = 0
+            for i in range(population_size):
+                query_vector[i] = i
+                shuffler_state['members'][i] = i
+
+        @staticmethod
+        def shuffle(query_vector, shuffler_state, solution_states,
+                    solution_losses, problem_data_array, optimizer_states):
+            if exchange_interval != 0:
+                if shuffler_state['until_exchange'] > 0:
+                    return
+                shuffler_state['until_exchange'] = exchange_interval
+
+            members = shuffler_state['members']
+            first = shuffler_state['exchanges'] % 2
+            for rung in range(first, population_size - 1, 2):
+                cold = members[rung]
+                hot = members[rung + 1]
+                log_ratio = ((inverse_temperatures[rung]
+                              - inverse_temperatures[rung + 1])
+                             * (solution_losses[cold, current]
+                                - solution_losses[hot, current]))
+                shuffler_state['attempted'] += 1
+                if log_ratio >= 0 or np.random.random() < np.exp(log_ratio):
+                    optimizer_states[cold]['temperature'] = temperatures[
+                        rung + 1]
+                    optimizer_states[hot]['temperature'] = temperatures[rung]
+                    members[rung] = hot
+                    members[rung + 1] = cold
+                    shuffler_state['accepted'] += 1
+            shuffler_state['exchanges'] += 1
+
+    ParallelTempering.Optimizer = Optimizer
+    ParallelTempering.population_size = population_size
+
+    return ParallelTempering
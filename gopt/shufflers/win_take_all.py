@@ -1,25 +1,56 @@
+import numpy as np
+
 from .base import Shuffler
 
-def WinnerTakesAll(Optimizer, population_size):
+# The best solution of the population replaces all the others every
+# migration_interval iterations (or after every block of iterations run by
+# the runner if None)
+#
+# The winner replaces every state of the other members (like the migrants of
+# IslandShuffler) so that their search continues from it
+def WinnerTakesAll(Optimizer, population_size, migration_interval=None):
 
     Optimizer.compile()
 
+    if migration_interval is None:
+        migration_interval = 0
+    elif migration_interval <= 0:
+        raise ValueError("migration_interval should be positive")
+
+    states_required = Optimizer.states_required
+
     class WinnerTakesAll(Shuffler):
 
+        state_dtype = np.dtype([
+            # Iterations left before the next migration
+            ('until_migration', np.int64)
+        ])
+
         @staticmethod
         def schedule_work(query_vector, shuffler_state, solution_states,
                           solution_losses, total_iterations):
-            return population_size, total_iterations
+            if migration_interval == 0:
+                return population_size, total_iterations
+
+            num_iterations = min(shuffler_state['until_migration'],
+                                 total_iterations)
+            shuffler_state['until_migration'] -= num_iterations
+            return population_size, num_iterations
 
         @staticmethod
         def init(shuffler_state, query_vector):
+            shuffler_state['until_migration'] = migration_interval
             for i in range(population_size):
                 query_vector[i] = i
 
-        # Optimizers are independent in the IndependentShuffler
         @staticmethod
-        def shuffle(shuffler_state, solution_states,
-                    solution_losses):
+        def shuffle(query_vector, shuffler_state, solution_states,
+                    solution_losses, problem_data_array, optimizer_states):
+            if migration_interval != 0:
+                if shuffler_state['until_migration'] > 0:
+                    return
+                shuffler_state['until_migration'] = migration_interval
+
             best_ix = 0
             best_loss = solution_losses[0][0]
             for i in range(1, population_size):
@@ -28,8 +59,9 @@ def WinnerTakesAll(Optimizer, population_size):
                     best_ix = i
 
             for i in range(population_size):
-                solution_states[i][0] = solution_states[best_ix][0]
-                solution_losses[i][0] = solution_losses[best_ix][0]
+                for s in range(states_required):
+                    solution_states[i][s] = solution_states[best_ix][0]
+                    solution_losses[i, s] = solution_losses[best_ix, 0]
 
     WinnerTakesAll.Optimizer = Optimizer
     WinnerTakesAll.population_size = population_size
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import numpy as np
+from numba import types
+
+# Counters kept for each member of the population (one row per member)
+# - iterations: iterations run
+# - accepted: moves accepted by the optimizer
+# - improved: moves improving the best solution of the member
+# - step_ns: time spent in the step function of the optimizer (nanoseconds)
+#
+# Iterations and time are counted by the runners, optimizers count the moves
+# in the row of the member they get in their step function
+COUNTERS = ['iterations', 'accepted', 'improved', 'step_ns']
+ITERATIONS, ACCEPTED, IMPROVED, STEP_NS = range(len(COUNTERS))
+
+
+def allocate_counters(population_size):
+    return np.zeros((population_size, len(COUNTERS)), dtype=np.int64)
+
+
+# Buffers the struct timespec of monotonic_ns is written to, one row per
+# member so that the members running in parallel don't share one and the hot
+# loop doesn't allocate
+def allocate_timespecs(population_size):
+    return np.zeros((population_size, 2), dtype=np.int64)
+
+
+# Monotonic clock in nanoseconds usable in compiled code (and in parallel
+# loops, unlike runners.base.clock), timespec is a row of
+# allocate_timespecs. The symbol is resolved when linking so kernels using
+# it can still be cached. Always 0 on platforms without clock_gettime
+if hasattr(time, 'CLOCK_MONOTONIC'):
+    clock_gettime = types.ExternalFunction(
+        'clock_gettime', types.int32(types.int32, types.voidptr))
+    CLOCK_MONOTONIC = time.CLOCK_MONOTONIC
+
+    def monotonic_ns(timespec):
+        clock_gettime(CLOCK_MONOTONIC, timespec.ctypes)
+        return timespec[0] * 1000000000 + timespec[1]
+else:
+    def monotonic_ns(timespec):
+        return 0
+
+
+# Totals of the counters of the population for Result.runtime_info
+def summarize(counters):
+    totals = counters.sum(axis=0)
+    iterations = int(totals[ITERATIONS])
+    return dict(
+        member_iterations=iterations,
+        accepted_moves=int(totals[ACCEPTED]),
+        improving_moves=int(totals[IMPROVED]),
+        acceptance_rate=float(totals[ACCEPTED] / max(iterations, 1)),
+        step_time=float(totals[STEP_NS] * 1e-9),
+        member_counters={name: counters[:, i].copy()
+                         for i, name in enumerate(COUNTERS)}
+    )
+
+
+# Convergence trace: (iteration, time, loss) each time the best loss of the
+# population improves, checked after every chunk of iterations of the
+# runners. Times are in seconds since the beginning of the run
+#
+# The trace has a fixed capacity and is filled without allocating. When it
+# is full every other entry is dropped and from then on only one
+# improvement out of `stride` (doubled at each downsampling) is kept, so
+# the entries stay evenly spread over the improvements of the whole run.
+# The last improvement is always recorded, in a provisional entry
+# overwritten by the next one if it is not kept
+TRACE_DTYPE = np.dtype([
+    ('iteration', np.int64),
+    ('time', np.float64),
+    ('loss', np.float64)
+])
+
+# Layout of trace_state
+TRACE_COUNT, TRACE_STRIDE, TRACE_EVENTS, TRACE_PENDING = range(4)
+
+
+def allocate_trace(capacity):
+    if capacity < 2:
+        raise ValueError("The capacity of the trace should be at least 2")
+    trace = np.zeros(capacity, dtype=TRACE_DTYPE)
+    trace_state = np.zeros(4, dtype=np.int64)
+    reset_trace(trace_state)
+    return trace, trace_state
+
+
+def reset_trace(trace_state):
+    trace_state[:] = 0
+    trace_state[TRACE_STRIDE] = 1
+
+
+def record_improvement(trace, trace_state, iteration, time, loss):
+    count = trace_state[TRACE_COUNT]
+    if trace_state[TRACE_PENDING] != 0:
+        count -= 1
+    elif count == len(trace):
+        half = (len(trace) + 1) // 2
+        for i in range(half):
+            trace[i] = trace[2 * i]
+        count = half
+        trace_state[TRACE_STRIDE] *= 2
+
+    trace[count]['iteration'] = iteration
+    trace[count]['time'] = time
+    trace[count]['loss'] = loss
+    trace_state[TRACE_COUNT] = count + 1
+    trace_state[TRACE_PENDING] = (trace_state[TRACE_EVENTS]
+                                  % trace_state[TRACE_STRIDE] != 0)
+    trace_state[TRACE_EVENTS] += 1
+
+
+# The entries of the trace for Result.runtime_info
+def trace_result(trace, trace_state):
+    return trace[:trace_state[TRACE_COUNT]].copy()
+
+
+# Exporters are given to Runner.add_exporter and called after every block
+# with a snapshot of the run (see Runner.telemetry_snapshot): time,
+# iterations, elapsed time, best loss and the counters of the members
+
+
+# Writes the last snapshot in the Prometheus text format (for the textfile
+# collector of node_exporter for example). labels are added to every sample
+class PrometheusExporter:
+
+    def __init__(self, path, labels=None):
+        self.path = path
+        self.labels = dict(labels or {})
+
+    def format_labels(self, **extra):
+        labels = {**self.labels, **extra}
+        if not labels:
+            return ''
+        content = ','.join(f'{k}="{v}"' for k, v in labels.items())
+        return '{' + content + '}'
+
+    def __call__(self, snapshot):
+        lines = []
+        labels = self.format_labels()
+
+        def metric(name, kind, help_text, value):
+            lines.append(f'# HELP gopt_{name} {help_text}')
+            lines.append(f'# TYPE gopt_{name} {kind}')
+            lines.append(f'gopt_{name}{labels} {value}')
+
+        metric('run_iterations_total', 'counter',
+               'Iterations of the run', snapshot['iterations'])
+        metric('run_elapsed_seconds', 'gauge',
+               'Time spent optimizing', snapshot['elapsed'])
+        metric('best_loss', 'gauge', 'Best loss of the population',
+               snapshot['best_loss'])
+
+        counters = snapshot['counters']
+        for i, name in enumerate(COUNTERS):
+            suffix = 'total'
+            values = counters[:, i]
+            if name == 'step_ns':
+                name, suffix = 'step', 'seconds_total'
+                values = values * 1e-9
+            lines.append(f'# HELP gopt_member_{name}_{suffix} {name} '
+                         'of each member')
+            lines.append(f'# TYPE gopt_member_{name}_{suffix} counter')
+            for member, value in enumerate(values):
+                lines.append(f'gopt_member_{name}_{suffix}'
+                             f'{self.format_labels(member=member)} {value}')
+
+        # Replaced atomically so that scrapers never see a partial file
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temporary, self.path)
+
+
+# Appends every snapshot to a JSON lines file
+class JSONLinesExporter:
+
+    def __init__(self, path, labels=None):
+        self.path = path
+        self.labels = dict(labels or {})
+
+    def __call__(self, snapshot):
+        record = dict(self.labels)
+        for key, value in snapshot.items():
+            if key == 'counters':
+                for i, name in enumerate(COUNTERS):
+                    record[f'member_{name}'] = value[:, i].tolist()
+            else:
+                record[key] = value
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from gopt.runners import CPURunner
+
+
+# Kernels compiled by the tests (and by the processes they start) go to a
+# cache of their own instead of the cache of the user
+@pytest.fixture(scope='session', autouse=True)
+def kernel_cache_dir(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        cache_dir = str(tmp_path_factory.mktemp('kernel_cache'))
+        monkeypatch.setenv('GOPT_CACHE_DIR', cache_dir)
+        yield cache_dir
+
+
+# Cities drawn uniformly in [0, 100)^2, in the float32 coordinates the
+# runners get
+def uniform_coords(num_cities, seed=0):
+    return np.random.default_rng(seed).uniform(
+        0, 100, (num_cities, 2)).astype(np.float32)
+
+
+# Squared length of the tour visiting the cities in order
+def tour_loss(coords, order):
+    tour = coords[order]
+    return ((tour - np.roll(tour, -1, axis=0)) ** 2).sum()
+
+
+# Single threaded runner without progress bar on uniform_coords(num_cities)
+def make_runner(Shuffler, num_cities, Runner=CPURunner, **kwargs):
+    runner = Runner(Shuffler, uniform_coords(num_cities), num_cores=1,
+                    **kwargs)
+    runner.progress = False
+    return runner
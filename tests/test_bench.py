@@ -0,0 +1,107 @@
+import copy
+import gzip
+
+import numpy as np
+import pytest
+
+from gopt.bench import (OPTIMA, available_instances, configurations,
+                        compare, load_instance, load_optimal_tour,
+                        tour_length)
+from gopt.bench.suite import DEFAULT_MATRIX
+
+
+def test_optimal_tour_length():
+    instance = load_instance('pcb442')
+    order = load_optimal_tour('pcb442')
+    assert sorted(order.tolist()) == list(range(instance.num_cities))
+    assert tour_length(instance.coords, order) == OPTIMA['pcb442']
+    assert instance.gap(OPTIMA['pcb442']) == 0
+
+
+def test_bundled_instances():
+    assert {'pr107', 'pcb442'} <= set(available_instances())
+    for name in available_instances():
+        instance = load_instance(name)
+        assert instance.name == name
+        assert instance.optimum == OPTIMA[name]
+        assert instance.coords.shape == (instance.num_cities, 2)
+
+
+# Distances are rounded to the nearest integer before they are summed
+def test_tour_length():
+    coords = [(0, 0), (3, 0), (3, 4)]
+    assert tour_length(coords, [0, 1, 2]) == 3 + 4 + 5
+    assert tour_length(coords, [2, 1, 0]) == 12
+    assert tour_length([(0, 0), (1, 1)], [0, 1]) == 2
+    assert tour_length([(0, 0), (1.5, 0), (0, 0)], [0, 1, 2]) == 4
+
+
+def test_load_instance_from_path(tmp_path):
+    path = str(tmp_path / 'square.tsp.gz')
+    with gzip.open(path, 'wt') as f:
+        f.write('NAME : square\nTYPE : TSP\nDIMENSION : 4\n'
+                'EDGE_WEIGHT_TYPE : EUC_2D\nNODE_COORD_SECTION\n'
+                '1 0 0\n2 10 0\n3 10 10\n4 0 10\nEOF\n')
+    instance = load_instance(path, optimum=40)
+    assert instance.name == 'square'
+    np.testing.assert_array_equal(instance.coords[2], [10, 10])
+    assert instance.gap(44) == pytest.approx(0.1)
+
+    path = str(tmp_path / 'geo.tsp')
+    with open(path, 'w') as f:
+        f.write('NAME : geo\nTYPE : TSP\nDIMENSION : 1\n'
+                'EDGE_WEIGHT_TYPE : GEO\nNODE_COORD_SECTION\n1 0 0\nEOF\n')
+    with pytest.raises(ValueError, match='EUC_2D'):
+        load_instance(path)
+
+
+def test_configurations():
+    configs = configurations(optimizer=['local_search', 'annealing'],
+                             population=[4, 8, 16])
+    assert len(configs) == 6
+    assert {c['population'] for c in configs} == {4, 8, 16}
+    for config in configs:
+        assert config['neighborhood'] == DEFAULT_MATRIX['neighborhood'][0]
+    with pytest.raises(ValueError, match='colour'):
+        configurations(colour=['red'])
+
+
+def make_result(instance='pr107', **overrides):
+    result = dict(instance=instance, config=dict(population=8),
+                  iterations_per_second=1e6, compile_time=2.0,
+                  init_time=0.5,
+                  time_to_target={'5%': 1.0, '1%': 4.0, '0.1%': None})
+    result.update(overrides)
+    return result
+
+
+def test_compare():
+    baseline = dict(results=[make_result(), make_result('pcb442'),
+                             make_result('eil51')])
+    current = copy.deepcopy(baseline)
+    assert compare(baseline, current) == []
+
+    # Within the tolerance, or not in the baseline
+    current['results'][0]['iterations_per_second'] = 0.95e6
+    current['results'][0]['compile_time'] = 2.1
+    current['results'].append(make_result('kroA100',
+                                          iterations_per_second=1.0))
+    assert compare(baseline, current) == []
+
+    slower = current['results'][0]
+    slower['iterations_per_second'] = 0.5e6
+    slower['compile_time'] = 5.0
+    slower['time_to_target'] = {'5%': 1.5, '1%': None, '0.1%': 10.0}
+    current['results'][1] = dict(instance='pcb442',
+                                 config=dict(population=8), error='boom')
+    regressions = compare(baseline, current)
+    assert {(r['instance'], r['metric']) for r in regressions} == {
+        ('pr107', 'iterations_per_second'), ('pr107', 'compile_time'),
+        ('pr107', 'time_to_5%'), ('pr107', 'time_to_1%'),
+        ('pcb442', 'error')}
+    speed, = [r for r in regressions
+              if r['metric'] == 'iterations_per_second']
+    assert (speed['baseline'], speed['current']) == (1e6, 0.5e6)
+
+    # The same report is not a regression for a looser tolerance
+    assert len(compare(baseline, current, tolerance=1.0)) == 3
@@ -0,0 +1,90 @@
+import os
+import sys
+import subprocess
+
+from gopt import cache
+from gopt.cache import evict, fingerprint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import numba
+import helpers
+from gopt.compiler import Compiler
+
+def kernel(x):
+    return helpers.scale(x) + 1
+
+compiled = Compiler.jit('test', 'kernel', numba.float64(numba.float64),
+                        kernel)
+print(sum(compiled.stats.cache_hits.values()) > 0, compiled(2.0))
+'''
+
+HELPERS = '''
+import numba
+
+FACTOR = {factor}
+
+@numba.njit
+def scale(x):
+    return x * FACTOR
+'''
+
+
+def make_kernel(constant):
+    def kernel(x):
+        return x * constant
+    return kernel
+
+
+def test_key_follows_captured_constants():
+    assert (fingerprint('test', make_kernel(2))
+            == fingerprint('test', make_kernel(2)))
+    assert (fingerprint('test', make_kernel(2))
+            != fingerprint('test', make_kernel(3)))
+
+
+def test_default_dir(monkeypatch):
+    monkeypatch.setenv('GOPT_CACHE_DIR', '/gopt')
+    assert cache.default_cache_dir() == '/gopt'
+    monkeypatch.delenv('GOPT_CACHE_DIR')
+    monkeypatch.setenv('XDG_CACHE_HOME', '/xdg')
+    assert cache.default_cache_dir() == os.path.join('/xdg', 'gopt')
+
+
+# The kernel reaches helpers.scale (and FACTOR) through a module defined in
+# another file: its entry is reused by a fresh process until that code
+# changes
+def test_hit_in_a_fresh_process(tmp_path):
+    script = tmp_path / 'script.py'
+    script.write_text(SCRIPT)
+    env = dict(os.environ, GOPT_CACHE_DIR=str(tmp_path / 'cache'),
+               PYTHONPATH=os.pathsep.join([ROOT, str(tmp_path)]))
+
+    def run(factor):
+        (tmp_path / 'helpers.py').write_text(HELPERS.format(factor=factor))
+        output = subprocess.run([sys.executable, str(script)], env=env,
+                                cwd=str(tmp_path), check=True,
+                                capture_output=True, text=True).stdout
+        hit, value = output.split()
+        return hit == 'True', float(value)
+
+    assert run(2.0) == (False, 5.0)
+    assert run(2.0) == (True, 5.0)
+    assert run(3.0) == (False, 7.0)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    for i, name in enumerate(['a', 'b', 'c', 'd']):
+        path = tmp_path / f'{name}.nbc'
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000 + i, 1000 + i))
+    # Recently loaded
+    os.utime(tmp_path / 'a.nbc', (2000, 2000))
+    (tmp_path / 'a.nbi').write_bytes(b'x' * 1000)
+
+    evict(str(tmp_path), 250)
+    assert sorted(os.listdir(tmp_path)) == ['a.nbc', 'a.nbi', 'd.nbc']
+    evict(str(tmp_path), None)
+    assert len(os.listdir(tmp_path)) == 3
+
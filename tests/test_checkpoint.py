@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import SimulatedAnnealing
+from gopt.shufflers import IslandShuffler
+from gopt.runners import CPURunner
+from gopt.runners import checkpoint
+from gopt.runners.checkpoint import Checkpoint, get_rng_state
+from gopt.telemetry import ITERATIONS, TRACE_COUNT
+
+from conftest import make_runner as make_cpu_runner
+
+NUM_CITIES = 60
+ARRAYS = ['solution_states', 'solution_losses', 'optimizer_states',
+          'query_vector', 'epoch_stats', 'counters', 'trace', 'trace_state']
+
+
+def make_shuffler():
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+    return IslandShuffler(SimulatedAnnealing(TSP), 2, 2,
+                          migration_interval=500)
+
+
+def make_runner():
+    return make_cpu_runner(make_shuffler(), NUM_CITIES)
+
+
+def resume(path):
+    runner = CPURunner.resume(path, make_shuffler(), num_cores=1)
+    runner.progress = False
+    return runner
+
+
+def state_of(runner):
+    state = {name: getattr(runner, name).copy() for name in ARRAYS}
+    state['shuffler_state'] = runner.shuffler_state.copy()
+    return state
+
+
+def assert_restored(runner, state):
+    for name in ARRAYS:
+        np.testing.assert_array_equal(getattr(runner, name), state[name],
+                                      err_msg=name)
+    assert runner.shuffler_state == state['shuffler_state']
+
+
+def test_round_trip(tmp_path):
+    runner = make_runner()
+    runner.run(max_iter=5000, checkpoint=str(tmp_path))
+    # Snapshotted at the end of the run
+    saved = state_of(runner)
+    rng = get_rng_state()
+    assert saved['shuffler_state']['migrations'] > 0
+    assert saved['trace_state'][TRACE_COUNT] > 0
+
+    np.random.seed(1)
+    resumed = resume(str(tmp_path))
+    assert_restored(resumed, saved)
+    np.testing.assert_array_equal(get_rng_state(), rng)
+    iterations, elapsed = resumed.resumed_progress
+    assert iterations == 5000 and elapsed > 0
+
+    # The budget covers the whole run, the trace and counters continue
+    resumed.run(max_iter=8000)
+    assert (resumed.counters[:, ITERATIONS] == 8000).all()
+    assert (resumed.trace_state[TRACE_COUNT]
+            >= saved['trace_state'][TRACE_COUNT])
+
+
+def test_interrupted_snapshot_keeps_the_previous_one(tmp_path, monkeypatch):
+    runner = make_runner()
+    runner.run(max_iter=2000, checkpoint=str(tmp_path))
+    saved = state_of(runner)
+    slot = Checkpoint(str(tmp_path)).manifest()['slot']
+
+    # The next snapshot dies after writing its first file
+    runner.solution_losses[:] = 0
+    write = Checkpoint.write
+    written = []
+
+    def interrupted(self, files, name, array):
+        if written:
+            raise KeyboardInterrupt
+        written.append(name)
+        write(self, files, name, array)
+
+    monkeypatch.setattr(Checkpoint, 'write', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        runner.checkpoint(str(tmp_path))
+    monkeypatch.setattr(Checkpoint, 'write', write)
+
+    assert written[0].startswith(f'slot{1 - slot}')
+    assert Checkpoint(str(tmp_path)).manifest()['slot'] == slot
+    assert_restored(resume(str(tmp_path)), saved)
+
+    # A complete snapshot goes to the other slot and is the one resumed
+    runner.checkpoint(str(tmp_path))
+    assert Checkpoint(str(tmp_path)).manifest()['slot'] == 1 - slot
+    assert (resume(str(tmp_path)).solution_losses == 0).all()
+
+
+def test_missing_numba_rng_fails_loudly(tmp_path, monkeypatch):
+    runner = make_runner()
+    monkeypatch.setattr(checkpoint, 'numba_rng', None)
+    with pytest.raises(RuntimeError, match='random generator'):
+        runner.checkpoint(str(tmp_path))
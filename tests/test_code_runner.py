@@ -0,0 +1,147 @@
+import gc
+
+import pytest
+
+from gopt.runners import code_runner
+from gopt.runners.code_runner import CodeRunner
+
+
+# Time only moves when the fake kernel runs: rate iterations per second plus
+# a constant cost per block
+class FakeKernel:
+
+    def __init__(self, clock, rate, overhead=0.0):
+        self.clock = clock
+        self.rate = rate
+        self.overhead = overhead
+        self.sizes = []
+
+    def __call__(self, iterations):
+        self.sizes.append(iterations)
+        self.clock.now += self.overhead + iterations / self.rate
+        return 0.0
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(code_runner, 'time', clock)
+    return clock
+
+
+def run(kernel, max_iter=None, max_time=None, blocks=None):
+    runner = CodeRunner(max_iter, max_time, progress=False)
+    while blocks is None or len(kernel.sizes) < blocks:
+        try:
+            runner.run_block(kernel)
+        except StopIteration:
+            break
+    return runner
+
+
+# Blocks grow 8x from one iteration until one lasts 1/20 of the target
+def test_calibration(clock):
+    kernel = FakeKernel(clock, rate=1e6)
+    runner = run(kernel, blocks=10)
+    assert kernel.sizes[:7] == [8 ** k for k in range(7)]
+    controller, = runner._controllers.values()
+    assert controller.calibration_blocks == 7
+    assert controller.rate == pytest.approx(1e6)
+    # Then one second blocks
+    assert kernel.sizes[-1] == pytest.approx(1e6, rel=0.01)
+
+
+# The first block pays for starting the threads: slow as it is, it doesn't
+# end the calibration
+def test_calibration_ignores_the_first_block(clock):
+    kernel = FakeKernel(clock, rate=1e6)
+    kernel.overhead = 1.0
+    runner = CodeRunner(None, None, progress=False)
+    runner.run_block(kernel)
+    kernel.overhead = 0.0
+    for _ in range(6):
+        runner.run_block(kernel)
+    assert kernel.sizes == [8 ** k for k in range(7)]
+
+
+def test_growth_is_capped(clock):
+    kernel = FakeKernel(clock, rate=1e4)
+    run(kernel, blocks=15)
+    slow_size = kernel.sizes[-1]
+    assert slow_size == pytest.approx(1e4, rel=0.01)
+
+    # 1000x faster: once the speed is measured, the blocks follow at most
+    # 4x at a time
+    kernel.rate = 1e7
+    run(kernel, blocks=30)
+    sizes = kernel.sizes[14:]
+    for previous, size in zip(sizes, sizes[1:]):
+        assert size <= 4 * previous
+    assert sizes[2] == 4 * sizes[1]
+    assert sizes[-1] == pytest.approx(1e7, rel=0.05)
+
+
+# Constant costs per block are removed by the correction
+def test_block_duration_with_overhead(clock):
+    kernel = FakeKernel(clock, rate=1e6, overhead=0.2)
+    run(kernel, blocks=60)
+    duration = 0.2 + kernel.sizes[-1] / 1e6
+    assert duration == pytest.approx(1.0, rel=0.05)
+
+
+# Near the end of the time budget blocks are sized from the time left
+def test_last_blocks_fit_the_time_budget(clock):
+    kernel = FakeKernel(clock, rate=1e6)
+    runner = run(kernel, max_time=10.5)
+    assert runner.elapsed() == pytest.approx(10.5, rel=1e-3)
+    assert kernel.sizes[-1] < 0.6e6
+    assert runner.current_iter == sum(kernel.sizes)
+    assert runner.stop_reason == 'deadline'
+
+
+def test_iteration_budget(clock):
+    kernel = FakeKernel(clock, rate=1e6)
+    runner = run(kernel, max_iter=2500000)
+    assert runner.current_iter == 2500000
+    assert runner.stop_reason == 'max_iter'
+
+
+# The speed measured by a run is kept for the next run of the same kernel,
+# bound methods included: they are created anew at every access
+class Runner:
+
+    def __init__(self, clock):
+        self.kernel = FakeKernel(clock, rate=1e6)
+
+    def run_epochs(self, iterations):
+        return self.kernel(iterations)
+
+
+def test_history_of_bound_methods(clock):
+    runner = Runner(clock)
+    first = CodeRunner(None, None, progress=False)
+    for _ in range(10):
+        first.run_block(runner.run_epochs)
+    calibrated = len(runner.kernel.sizes)
+
+    second = CodeRunner(None, None, progress=False)
+    second.run_block(runner.run_epochs)
+    assert runner.kernel.sizes[calibrated] == pytest.approx(1e6, rel=0.05)
+    controller, = second._controllers.values()
+    assert controller.blocks == 11
+
+    # Dropped with the object
+    assert len(code_runner._method_controllers) > 0
+    del runner, first, second, controller
+    gc.collect()
+    assert all(not isinstance(owner, Runner)
+               for owner in code_runner._method_controllers)
@@ -0,0 +1,135 @@
+import threading
+from time import time, sleep
+
+import numpy as np
+
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import RandomLocalSearch
+from gopt.shufflers import IndependentShuffler, IslandShuffler
+from gopt.runners.cpu_runner import (CHECK_EVERY, DONE, REASON, DEADLINE,
+                                     TARGET_LOSS, BEST_LOSS, START_TIME,
+                                     STOP_REASONS)
+from gopt.telemetry import ITERATIONS
+
+from conftest import make_runner as make_cpu_runner
+
+NUM_CITIES = 30
+CHECK_EVERY_ITERATIONS = 100
+
+
+def make_runner(Shuffler=None):
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+    if Shuffler is None:
+        Shuffler = IndependentShuffler(RandomLocalSearch(TSP), 2)
+    else:
+        Shuffler = Shuffler(RandomLocalSearch(TSP))
+    return make_cpu_runner(Shuffler, NUM_CITIES)
+
+
+# Every member ran the same iterations, fewer than the budget
+def assert_stopped_early(runner, max_iter):
+    iterations = runner.counters[:, ITERATIONS]
+    assert (iterations == iterations[0]).all()
+    assert 0 < iterations[0] < max_iter
+
+
+def test_target_loss():
+    runner = make_runner()
+    target = 0.8 * runner.solution_losses[:, 0].min()
+    result = runner.run(max_iter=10 ** 9, target_loss=target,
+                        check_every=CHECK_EVERY_ITERATIONS)
+    assert result.runtime_info['stop_reason'] == 'target_loss'
+    assert result.loss <= target
+    assert_stopped_early(runner, 10 ** 9)
+
+
+def test_stagnation():
+    runner = make_runner()
+    result = runner.run(max_iter=10 ** 9, stagnation=20000,
+                        check_every=CHECK_EVERY_ITERATIONS)
+    assert result.runtime_info['stop_reason'] == 'stagnation'
+    assert_stopped_early(runner, 10 ** 9)
+    # The last improvement happened at least stagnation iterations before
+    trace = result.runtime_info['trace']
+    assert runner.counters[0, ITERATIONS] - trace['iteration'][-1] >= 20000
+
+
+# Blocks are calibrated against a 100s block duration: they grow until one
+# lasts 5s, past the time budget, only the deadline checked in the
+# compiled code stops the run on time
+def test_deadline():
+    runner = make_runner()
+    runner.block_duration = 100
+    start = time()
+    result = runner.run(max_time=0.5, check_every=CHECK_EVERY_ITERATIONS)
+    assert time() - start < 2
+    assert result.runtime_info['stop_reason'] == 'deadline'
+    assert_stopped_early(runner, 10 ** 9)
+
+
+# The budget can also run out between two blocks, before the compiled code
+# checks it
+def test_budget_spent_between_blocks():
+    runner = make_runner()
+    result = runner.run(max_iter=5000)
+    assert result.runtime_info['stop_reason'] == 'max_iter'
+    assert (runner.counters[:, ITERATIONS] == 5000).all()
+
+    # Continues a run that already spent the time budget
+    runner.resumed_progress = (5000, 1.0)
+    result = runner.run(max_time=0.5)
+    assert result.runtime_info['stop_reason'] == 'deadline'
+    assert (runner.counters[:, ITERATIONS] == 5000).all()
+
+
+def test_abort():
+    runner = make_runner()
+    runner.block_duration = 100
+
+    def abort():
+        sleep(0.5)
+        runner.abort()
+
+    threading.Thread(target=abort).start()
+    start = time()
+    result = runner.run(max_iter=10 ** 12, check_every=CHECK_EVERY_ITERATIONS)
+    assert time() - start < 3
+    assert result.runtime_info['stop_reason'] == 'aborted'
+    assert_stopped_early(runner, 10 ** 12)
+
+
+# schedule_work counts the iterations of the whole epoch: the shuffle of an
+# epoch cut short by a stopping criterion waits for the next epoch
+def test_interrupted_epoch_skips_its_shuffle():
+    runner = make_runner(lambda Optimizer: IslandShuffler(
+        Optimizer, 2, 2, migration_interval=1000))
+    to_run = runner.compile().to_run
+
+    def call(iterations, target_loss):
+        runner.control[CHECK_EVERY] = CHECK_EVERY_ITERATIONS
+        runner.limits[DEADLINE] = np.inf
+        runner.limits[TARGET_LOSS] = target_loss
+        runner.limits[BEST_LOSS] = np.inf
+        runner.limits[START_TIME] = time()
+        to_run(runner.query_vector, runner.shuffler_state,
+               runner.solution_states, runner.solution_losses,
+               runner.problem_data_array, runner.optimizer_states,
+               runner.epoch_stats, runner.counters, runner.timespecs,
+               runner.control, runner.limits, runner.trace,
+               runner.trace_state, iterations)
+
+    # Any loss reaches the target, the epoch stops after its first chunk
+    call(5000, np.inf)
+    assert STOP_REASONS[runner.control[REASON]] == 'target_loss'
+    assert runner.control[DONE] == CHECK_EVERY_ITERATIONS
+    assert runner.shuffler_state['until_migration'] == 0
+    assert runner.shuffler_state['migrations'] == 0
+    assert runner.epoch_stats[0] == 0
+
+    # The next call shuffles before scheduling a new epoch
+    call(500, -np.inf)
+    assert runner.control[REASON] == 0
+    assert runner.control[DONE] == 500
+    assert runner.shuffler_state['migrations'] == 1
+    assert runner.shuffler_state['until_migration'] == 500
+    assert runner.epoch_stats[0] == 2
@@ -0,0 +1,180 @@
+import socket
+import threading
+import multiprocessing
+from time import time, sleep
+
+import numpy as np
+import pytest
+
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import SimulatedAnnealing
+from gopt.shufflers import IndependentShuffler
+from gopt.runners import DistributedRunner
+from gopt.runners.distributed import (Coordinator, LENGTH, REQUEST_HEADER,
+                                      REPLY_HEADER, SOLUTION_HEADER,
+                                      pack_solutions, recv_exactly)
+
+from conftest import make_runner
+
+NUM_CITIES = 100
+RUN_TIME = 5
+
+
+def run_node(address, node_id, results):
+    np.random.seed(node_id)
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+    Shuffler = IndependentShuffler(SimulatedAnnealing(TSP, start_temp=10), 4)
+    runner = make_runner(Shuffler, NUM_CITIES, Runner=DistributedRunner,
+                         address=address, node_id=node_id,
+                         exchange_interval=0.2)
+    # Not counting the compilation in the duration of the run
+    runner.compile()
+    start = time()
+    result = runner.run(max_time=RUN_TIME)
+    runner.close()
+    results.put((node_id, (time() - start, dict(result.runtime_info))))
+
+
+# A coordinator in a thread of this process and two nodes in their own
+# processes, plus a client that sends half a request and never finishes it
+def test_two_local_nodes():
+    coordinator = Coordinator(pool_size=8)
+    address = coordinator.start()
+
+    straggler = socket.create_connection(address)
+    straggler.sendall(LENGTH.pack(100) + b'\0' * 10)
+
+    # Other tests already ran TBB kernels in this process and TBB is not
+    # fork safe: the nodes start in fresh interpreters (see
+    # test_process_pool_runner.in_fresh_process) and compile their kernels
+    # themselves
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    nodes = [context.Process(target=run_node, args=(address, i, results))
+             for i in range(2)]
+    for node in nodes:
+        node.start()
+    try:
+        infos = dict(results.get(timeout=600) for _ in nodes)
+    finally:
+        for node in nodes:
+            node.join(timeout=30)
+            if node.is_alive():
+                node.terminate()
+        straggler.close()
+        coordinator.stop()
+
+    assert sorted(coordinator.last_seen) == [0, 1]
+    for node_id, (duration, info) in infos.items():
+        assert info['exchanges'] > 0
+        assert info['failed_exchanges'] == 0
+        # The solutions of the other node arrived
+        assert info['migrants_received'] > 0
+        # Stopped by max_time, not by an exchange waiting on the straggler
+        assert duration < RUN_TIME + 30
+    # The straggler didn't hold the exchanges of the nodes back
+    assert coordinator.exchanges >= 4
+
+
+def request(sock, node_id, solutions, max_reply_bytes=1 << 20):
+    payload = (REQUEST_HEADER.pack(node_id, 1.0, 4, max_reply_bytes,
+                                   len(solutions))
+               + pack_solutions(solutions))
+    sock.sendall(LENGTH.pack(len(payload)) + payload)
+    length, = LENGTH.unpack(recv_exactly(sock, LENGTH.size))
+    return recv_exactly(sock, length)
+
+
+# A length prefix above the bound drops the connection before anything is
+# read, the other clients are served
+def test_coordinator_bounds_requests():
+    coordinator = Coordinator(max_bytes=100)
+    address = coordinator.start()
+    try:
+        hostile = socket.create_connection(address, timeout=5)
+        hostile.sendall(LENGTH.pack(2 ** 32 - 1))
+        assert hostile.recv(1) == b''
+        hostile.close()
+
+        client = socket.create_connection(address, timeout=5)
+        # The largest request allowed
+        size = 100 - SOLUTION_HEADER.size
+        request(client, 0, [(1.0, b'a' * size)])
+        # Replies are bounded too, whatever the node asks for
+        reply = request(client, 1, [], max_reply_bytes=10 ** 6)
+        assert len(reply) == REPLY_HEADER.size + 100
+        reply = request(client, 1, [], max_reply_bytes=50)
+        assert len(reply) == REPLY_HEADER.size
+        client.close()
+    finally:
+        coordinator.stop()
+    assert coordinator.exchanges == 3
+
+
+def make_node(address, timeout, candidates=None):
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random', candidates=candidates)
+    return make_runner(IndependentShuffler(SimulatedAnnealing(TSP), 2),
+                       NUM_CITIES, Runner=DistributedRunner, address=address,
+                       max_bytes=1000, timeout=timeout)
+
+
+# An exchange stuck past the timeout or announcing a reply above the bound
+# fails, the node goes on
+def test_failed_exchanges():
+    server = socket.create_server(('127.0.0.1', 0))
+    address = server.getsockname()
+
+    def serve():
+        connection, _ = server.accept()
+        recv_exactly(connection, LENGTH.size)
+        connection.sendall(LENGTH.pack(10 ** 9))
+        connection.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    runner = make_node(address, timeout=5)
+    runner.start_exchange()
+    runner.collect()
+    assert runner.exchange_stats['failed_exchanges'] == 1
+    thread.join()
+    server.close()
+
+    runner.timeout = 0.1
+    runner.exchange = lambda best_loss, elites: sleep(2)
+    start = time()
+    runner.start_exchange()
+    runner.collect()
+    assert time() - start < 1
+    assert runner.exchange_stats['failed_exchanges'] == 2
+    assert runner.exchange_stats['exchanges'] == 0
+    runner.close()
+
+
+# Migrants that are not a permutation of the cities are dropped, the loss
+# sent with the others is ignored
+@pytest.mark.parametrize('candidates', [None, 5])
+def test_malformed_migrants(candidates):
+    runner = make_node(('127.0.0.1', 1), timeout=1, candidates=candidates)
+    states = runner.solution_states.copy()
+    losses = runner.solution_losses.copy()
+    best = losses[:, 0].argmin()
+    valid = runner.Problem.encode_solution(states[best, 0])
+    order = np.frombuffer(valid, dtype=np.uint16)
+    out_of_range = order.copy()
+    out_of_range[0] = 65000
+    malformed = [np.zeros(NUM_CITIES, np.uint16).tobytes(),
+                 out_of_range.tobytes(), order[:-1].tobytes(),
+                 valid + b'\0', b'']
+
+    assert runner.inject([(-1.0, data) for data in malformed]) == 0
+    np.testing.assert_array_equal(runner.solution_states, states)
+    np.testing.assert_array_equal(runner.solution_losses, losses)
+
+    # Replaces the worst member with the loss of the tour it holds
+    assert runner.inject([(-1.0, valid)]) == 1
+    worst = losses[:, 0].argmax()
+    assert (runner.solution_losses[worst] == losses[best, 0]).all()
+    for slot in range(runner.solution_states.shape[1]):
+        np.testing.assert_array_equal(
+            runner.solution_states[worst, slot], states[best, 0])
+    runner.close()
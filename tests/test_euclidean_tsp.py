@@ -0,0 +1,319 @@
+import numba
+import numpy as np
+import pytest
+
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import RandomLocalSearch, SimulatedAnnealing
+from gopt.shufflers import (IndependentShuffler, IslandShuffler,
+                            MemeticShuffler, WinnerTakesAll)
+from gopt.runners import CPURunner
+
+from conftest import make_runner, tour_loss, uniform_coords
+
+
+def problem_data_of(TSP, coords):
+    problem_data = np.zeros(1, dtype=TSP.problem_data_dtype)
+    problem_data[0] = TSP.prepare_data(coords)
+    return problem_data
+
+
+def run(TSP, coords, population=2, max_iter=2000):
+    runner = CPURunner(IndependentShuffler(RandomLocalSearch(TSP), population),
+                       coords, num_cores=1)
+    runner.progress = False
+    result = runner.run(max_iter=max_iter)
+    return runner, result
+
+
+# Grid coordinates are off by at most half a grid step in each dimension, so
+# each edge by e = sqrt(dimensionality) * grid_scale and its squared length
+# by e * (2 * length + e)
+@pytest.mark.parametrize('dtype', [np.uint16, np.int32])
+def test_grid_losses_within_quantization_error(dtype):
+    num_cities = 200
+    coords = np.random.default_rng(0).uniform(-300, 700, (num_cities, 2))
+    runner, _ = run(EuclieanTSP(num_cities, 2, dtype=dtype), coords)
+
+    assert runner.problem_data['coords'].dtype == dtype
+    error = np.sqrt(2) * runner.problem_data['grid_scale']
+    for member in range(2):
+        order = runner.solution_states[member, 0]['order']
+        tour = coords[order]
+        lengths = np.sqrt(((tour - np.roll(tour, -1, axis=0)) ** 2).sum(1))
+        bound = (error * (2 * lengths + error)).sum()
+        loss = runner.solution_losses[member, 0]
+        assert abs(loss - tour_loss(coords, order)) <= bound * (1 + 1e-6)
+        # The bound is not vacuous
+        assert bound < 1e-3 * loss
+
+
+# The position of a city in the tour has to fit in the tour dtype, the
+# last positions of int16 tours are the first to overflow
+@pytest.mark.parametrize('num_cities, tour_dtype', [(32767, np.int16),
+                                                    (32768, np.int32)])
+def test_tour_dtype_boundary(num_cities, tour_dtype):
+    coords = np.random.default_rng(0).uniform(
+        0, 1000, (num_cities, 2)).astype(np.float32)
+    TSP = EuclieanTSP(num_cities, 2, init='random', candidates=5)
+    runner, result = run(TSP, coords, population=1, max_iter=200000)
+
+    order = runner.solution_states[0, 0]['order']
+    assert order.dtype == tour_dtype
+    assert np.array_equal(np.sort(order), np.arange(num_cities))
+    coords = coords.astype(np.float64)
+    assert result.loss == pytest.approx(tour_loss(coords, order), rel=1e-5)
+    assert result.loss == pytest.approx(
+        tour_loss(coords, result.solution['order']), rel=1e-5)
+
+
+# Draws moves with the sampler of the problem from a random tour and checks
+# each of them: the delta of the move against the loss recomputed after
+# applying it, and every other move undone. The compiled functions take
+# records, which numba passes by value, the state and the problem data are
+# handed over in one element arrays
+def check_moves(TSP, coords, num_moves=3000):
+    code = TSP.compile()
+    init, loss, sample = code.init_state, code.loss, code.sample_move
+    move_delta, apply_move, undo = code.move_delta, code.apply_move, code.undo
+
+    @numba.njit
+    def moves(states, problem_data, deltas, differences, undone):
+        state = states[0]
+        data = problem_data[0]
+        init(state, data)
+        direction = np.zeros(4, dtype=np.int32)
+        for k in range(deltas.shape[0]):
+            before = loss(state, data)
+            saved = state['order'].copy()
+            sample(state, data, direction)
+            deltas[k] = move_delta(state, data, direction)
+            apply_move(state, data, direction)
+            differences[k] = loss(state, data) - before
+            if k % 2 == 0:
+                undo(state, data, direction)
+                undone[k] = (state['order'] == saved).all()
+            else:
+                undone[k] = True
+
+    np.random.seed(0)
+    states = np.zeros(1, dtype=TSP.state_dtype)
+    problem_data = problem_data_of(TSP, coords)
+    deltas = np.zeros(num_moves)
+    differences = np.zeros(num_moves)
+    undone = np.zeros(num_moves, dtype=np.bool_)
+    moves(states, problem_data, deltas, differences, undone)
+
+    scale = code.loss(states[0], problem_data[0])
+    np.testing.assert_allclose(deltas, differences, rtol=0,
+                               atol=1e-9 * scale)
+    assert (deltas != 0).mean() > 0.5
+    assert undone.all()
+    order = states[0]['order']
+    assert np.array_equal(np.sort(order), np.arange(len(coords)))
+    if 'position' in TSP.state_dtype.names:
+        assert np.array_equal(states[0]['position'][order],
+                              np.arange(len(coords)))
+
+
+# Segment insertions, drawn uniformly or from the candidate lists, segments
+# ending at the last position and insertions at the start of the tour
+# included
+@pytest.mark.parametrize('neighborhood', ['or-opt', '3-opt'])
+@pytest.mark.parametrize('candidates', [None, 5])
+def test_segment_move_deltas(neighborhood, candidates):
+    TSP = EuclieanTSP(30, 2, neighborhood=neighborhood, init='random',
+                      candidates=candidates)
+    check_moves(TSP, uniform_coords(30))
+
+
+DISTANCE_MODES = [('coords', np.float32), ('matrix', np.float32),
+                  ('matrix', np.uint16)]
+
+
+@pytest.mark.parametrize('distance_mode, matrix_dtype', DISTANCE_MODES)
+@pytest.mark.parametrize('neighborhood', ['swap-2', '2-opt', 'or-opt'])
+def test_move_deltas_by_distance_mode(distance_mode, matrix_dtype,
+                                      neighborhood):
+    TSP = EuclieanTSP(30, 2, neighborhood=neighborhood, init='random',
+                      distance_mode=distance_mode, matrix_dtype=matrix_dtype)
+    check_moves(TSP, uniform_coords(30))
+
+
+# The float32 matrix rounds the squared distances to float32, the uint16
+# one to the nearest of its levels, spaced by a constant ratio
+@pytest.mark.parametrize('distance_mode, matrix_dtype', DISTANCE_MODES)
+def test_distance_mode_losses(distance_mode, matrix_dtype):
+    num_cities = 200
+    coords = uniform_coords(num_cities)
+    TSP = EuclieanTSP(num_cities, 2, init='random',
+                      distance_mode=distance_mode, matrix_dtype=matrix_dtype)
+    problem_data = problem_data_of(TSP, coords)
+    tolerance = 1e-6
+    if matrix_dtype == np.uint16:
+        levels = problem_data[0]['distance_levels']
+        tolerance = np.sqrt(levels[2] / levels[1]) - 1
+        assert tolerance < 1e-3
+
+    loss = TSP.compile().loss
+    states = np.zeros(1, dtype=TSP.state_dtype)
+    exact = coords.astype(np.float64)
+    for seed in range(5):
+        order = np.random.default_rng(seed).permutation(num_cities)
+        states[0]['order'] = order
+        expected = tour_loss(exact, order)
+        assert abs(loss(states[0], problem_data[0]) - expected) \
+            <= tolerance * expected
+
+
+def test_auto_distance_mode():
+    assert 'distances' in EuclieanTSP(
+        100, 2, distance_mode='auto').problem_data_dtype.names
+    # 100 * 99 / 2 float32 distances don't fit
+    assert 'distances' not in EuclieanTSP(
+        100, 2, distance_mode='auto',
+        memory_budget=4 * 4950 - 1).problem_data_dtype.names
+
+
+# Constructions on tiny instances, duplicated cities and a regular instance
+@pytest.mark.parametrize('init', ['random', 'NN', 'greedy', 'savings',
+                                  'hilbert'])
+@pytest.mark.parametrize('num_cities', [2, 3, 5, 64])
+def test_initial_tours(init, num_cities):
+    coords = uniform_coords(num_cities, seed=num_cities)
+    if num_cities == 5:
+        coords[3] = coords[1]
+    TSP = EuclieanTSP(num_cities, 2, init=init,
+                      candidates=min(4, num_cities - 1))
+    init_state = TSP.compile().init_state
+
+    @numba.njit
+    def initialize(states, problem_data):
+        for i in range(states.shape[0]):
+            init_state(states[i], problem_data[0])
+
+    states = np.zeros(20, dtype=TSP.state_dtype)
+    initialize(states, problem_data_of(TSP, coords))
+    for state in states:
+        assert np.array_equal(np.sort(state['order']),
+                              np.arange(num_cities))
+        assert np.array_equal(state['position'][state['order']],
+                              np.arange(num_cities))
+
+
+# Cities are renumbered inside the runner, the solution of the result is
+# in the numbering of the coordinates given
+@pytest.mark.parametrize('tour, candidates', [('array', None), ('array', 5),
+                                              ('two-level', 5)])
+def test_renumbered_solution(tour, candidates):
+    coords = uniform_coords(200)
+    TSP = EuclieanTSP(200, 2, renumber=True, tour=tour,
+                      candidates=candidates)
+    runner, result = run(TSP, coords, max_iter=20000)
+
+    original_ids = runner.problem_data['original_ids']
+    assert not np.array_equal(original_ids, np.arange(200))
+    np.testing.assert_array_equal(runner.problem_data['coords'],
+                                  coords[original_ids])
+
+    solution = result.solution
+    assert np.array_equal(np.sort(solution['order']), np.arange(200))
+    exact = coords.astype(np.float64)
+    assert result.loss == pytest.approx(tour_loss(exact, solution['order']),
+                                        rel=1e-5)
+    if 'position' in solution.dtype.names:
+        assert np.array_equal(solution['position'][solution['order']],
+                              np.arange(200))
+
+
+# Every state of every member has the loss of its tour
+def assert_losses_match(runner):
+    loss = runner.Problem.compile().loss
+    for member in range(runner.solution_states.shape[0]):
+        for slot in range(runner.solution_states.shape[1]):
+            state = runner.solution_states[member, slot]
+            assert runner.solution_losses[member, slot] == pytest.approx(
+                loss(state, runner.problem_data), rel=1e-9)
+
+
+@pytest.mark.parametrize('topology, distance_mode', [
+    ('ring', 'coords'), ('torus', 'coords'), ('random', 'matrix')])
+def test_island_losses_match_tours(topology, distance_mode):
+    TSP = EuclieanTSP(60, 2, init='random', distance_mode=distance_mode)
+    Shuffler = IslandShuffler(SimulatedAnnealing(TSP), 4, 2,
+                              topology=topology, torus_width=2,
+                              migration_interval=500)
+    runner = make_runner(Shuffler, 60)
+    runner.run(max_iter=20000)
+    assert runner.shuffler_state['migrations'] > 0
+    assert_losses_match(runner)
+
+
+# The chain of SimulatedAnnealing runs in slot 1: every slot of every member
+# continues from the winner
+def test_winner_takes_all_losses_match_tours():
+    TSP = EuclieanTSP(60, 2, init='random')
+    Shuffler = WinnerTakesAll(SimulatedAnnealing(TSP), 4,
+                              migration_interval=500)
+    runner = make_runner(Shuffler, 60)
+    runner.run(max_iter=20000)
+    assert_losses_match(runner)
+
+    runner.shuffler_state['until_migration'] = 0
+    runner.shuffler_code.shuffle(
+        runner.query_vector, runner.shuffler_state, runner.solution_states,
+        runner.solution_losses, runner.problem_data_array,
+        runner.optimizer_states)
+    assert_losses_match(runner)
+    winner = runner.solution_states[0, 0]['order']
+    assert (runner.solution_states['order'] == winner).all()
+    assert (runner.solution_losses == runner.solution_losses[0, 0]).all()
+
+
+# Children of random parents, of a parent with itself and of parents that
+# only differ by a reversal
+@pytest.mark.parametrize('crossover', ['OX', 'EAX'])
+@pytest.mark.parametrize('num_cities, candidates, tour', [
+    (5, None, 'array'), (50, None, 'array'), (50, 5, 'array'),
+    (50, 5, 'two-level')])
+def test_crossover_children(crossover, num_cities, candidates, tour):
+    TSP = EuclieanTSP(num_cities, 2, init='random', crossover=crossover,
+                      candidates=candidates, tour=tour)
+    code = TSP.compile()
+    init_state, recombine = code.init_state, code.crossover
+
+    @numba.njit
+    def breed(parents, children, problem_data):
+        for i in range(parents.shape[0]):
+            init_state(parents[i], problem_data[0])
+        for i in range(children.shape[0]):
+            a = i % parents.shape[0]
+            b = (i * 7 + 3) % parents.shape[0]
+            if i % 5 == 0:
+                b = a
+            recombine(parents[a], parents[b], children[i], problem_data[0])
+
+    problem_data = problem_data_of(TSP, uniform_coords(num_cities))
+    parents = np.zeros(10, dtype=TSP.state_dtype)
+    children = np.zeros(40, dtype=TSP.state_dtype)
+    np.random.seed(0)
+    breed(parents, children, problem_data)
+
+    for child in children:
+        order = TSP.export_solution(child, problem_data[0])['order']
+        assert np.array_equal(np.sort(order), np.arange(num_cities))
+        if 'position' in TSP.state_dtype.names:
+            assert np.array_equal(child['position'][child['order']],
+                                  np.arange(num_cities))
+
+
+@pytest.mark.parametrize('crossover', ['OX', 'EAX'])
+@pytest.mark.parametrize('distance_mode', ['coords', 'matrix'])
+def test_memetic_losses_match_tours(crossover, distance_mode):
+    TSP = EuclieanTSP(60, 2, init='random', crossover=crossover,
+                      distance_mode=distance_mode)
+    Shuffler = MemeticShuffler(SimulatedAnnealing(TSP), 6, 2,
+                               generation_interval=500)
+    runner = make_runner(Shuffler, 60)
+    runner.run(max_iter=20000)
+    assert runner.shuffler_state['generations'] > 0
+    assert_losses_match(runner)
@@ -0,0 +1,226 @@
+import gzip
+import os
+
+import numba
+import numpy as np
+import pytest
+
+from gopt import io
+from gopt.io import (load_coordinates, load_edge_weights, load_problem_data,
+                     EDGE_WEIGHT_LAYOUTS)
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import RandomLocalSearch
+from gopt.shufflers import IndependentShuffler
+from gopt.runners import CPURunner
+
+NUM_CITIES = 40
+# Small chunks so that sections span several of them
+CHUNK_SIZE = 7
+
+
+@pytest.fixture
+def coords():
+    return np.random.default_rng(0).uniform(-50, 50, (NUM_CITIES, 2))
+
+
+def write_text(path, lines):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def tsplib_lines(n, sections):
+    return ['NAME: test', 'TYPE: TSP', 'COMMENT: written by the tests',
+            f'DIMENSION: {n}', *sections, 'EOF']
+
+
+def format_values(values, per_line):
+    return [' '.join(f'{v:.17g}' for v in values[i:i + per_line])
+            for i in range(0, len(values), per_line)]
+
+
+# Node ids out of order, a section we don't use after the coordinates
+@pytest.mark.parametrize('name', ['test.tsp', 'test.tsp.gz'])
+def test_tsplib_node_coords(tmp_path, coords, name):
+    ids = np.random.default_rng(1).permutation(NUM_CITIES)
+    lines = tsplib_lines(NUM_CITIES, [
+        'EDGE_WEIGHT_TYPE: EUC_2D',
+        'NODE_COORD_SECTION',
+        *(f'{i + 1} {coords[i, 0]:.17g} {coords[i, 1]:.17g}' for i in ids),
+        'DISPLAY_DATA_SECTION',
+        *(f'{i + 1} 0 0' for i in ids)])
+    path = write_text(str(tmp_path / name), lines)
+    loaded = load_coordinates(path, dtype=np.float64, cache=False,
+                              chunk_size=CHUNK_SIZE)
+    np.testing.assert_array_equal(loaded, coords)
+
+
+# The values of the section for each format, from the definitions of the
+# TSPLIB documentation. The diagonal is not a weight, it is made nonzero to
+# check that it is skipped
+def edge_weight_values(matrix, edge_weight_format):
+    n = len(matrix)
+    if edge_weight_format == 'FULL_MATRIX':
+        return matrix.ravel()
+    kind, by = edge_weight_format.rsplit('_', 1)
+    include = {'UPPER': lambda i, j: j > i, 'LOWER': lambda i, j: j < i,
+               'UPPER_DIAG': lambda i, j: j >= i,
+               'LOWER_DIAG': lambda i, j: j <= i}[kind]
+    if by == 'ROW':
+        cells = [(i, j) for i in range(n) for j in range(n) if include(i, j)]
+    else:
+        cells = [(i, j) for j in range(n) for i in range(n) if include(i, j)]
+    return np.array([matrix[i, j] for i, j in cells])
+
+
+@pytest.mark.parametrize('edge_weight_format', list(EDGE_WEIGHT_LAYOUTS))
+def test_tsplib_edge_weights(tmp_path, edge_weight_format):
+    n = 9
+    rng = np.random.default_rng(2)
+    weights = rng.integers(1, 1000, (n, n))
+    matrix = np.triu(weights, 1) + np.triu(weights, 1).T
+    matrix[np.diag_indices(n)] = 12345
+    values = edge_weight_values(matrix, edge_weight_format)
+    lines = tsplib_lines(n, [
+        'EDGE_WEIGHT_TYPE: EXPLICIT',
+        f'EDGE_WEIGHT_FORMAT: {edge_weight_format}',
+        'EDGE_WEIGHT_SECTION', *format_values(values, 4)])
+    path = write_text(str(tmp_path / 'test.tsp'), lines)
+
+    loaded = load_edge_weights(path, cache=False, chunk_size=CHUNK_SIZE)
+    # Packed lower triangle, (a, b) with a > b at a * (a - 1) // 2 + b
+    np.testing.assert_array_equal(loaded, matrix[np.tril_indices(n, -1)])
+
+    # A missing weight is an error
+    write_text(path, lines[:-2] + lines[-1:])
+    with pytest.raises(ValueError, match='edge weights'):
+        load_edge_weights(path, cache=False, chunk_size=CHUNK_SIZE)
+
+
+# Header and blank lines skipped, extra columns selected out
+@pytest.mark.parametrize('name', ['test.csv', 'test.csv.gz', 'test.txt'])
+def test_csv(tmp_path, coords, name):
+    delimiter = ',' if '.csv' in name else ' '
+    lines = [delimiter.join(['x', 'y', 'id'])]
+    for i, (x, y) in enumerate(coords):
+        lines.append(delimiter.join([f'{x:.17g}', f'{y:.17g}', str(i)]))
+        if i % 10 == 0:
+            lines.append('')
+    path = write_text(str(tmp_path / name), lines)
+    loaded = load_coordinates(path, dtype=np.float64, usecols=(0, 1),
+                              cache=False, chunk_size=CHUNK_SIZE)
+    np.testing.assert_array_equal(loaded, coords)
+
+
+def test_npy(tmp_path, coords):
+    path = str(tmp_path / 'test.npy')
+    np.save(path, coords.astype(np.float32))
+    # Mapped as is
+    loaded = load_coordinates(path, dtype=np.float32, cache=False)
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, coords.astype(np.float32))
+    # Converted
+    loaded = load_coordinates(path, dtype=np.float64, cache=False,
+                              chunk_size=CHUNK_SIZE)
+    np.testing.assert_array_equal(loaded, coords.astype(np.float32))
+
+
+def test_binary(tmp_path, coords):
+    path = str(tmp_path / 'test.bin')
+    coords.tofile(path)
+    loaded = load_coordinates(path, dtype=np.float64, source_dtype=np.float64,
+                              dimensionality=2, cache=False)
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, coords)
+    loaded = load_coordinates(path, dtype=np.float32, source_dtype=np.float64,
+                              dimensionality=2, cache=False,
+                              chunk_size=CHUNK_SIZE)
+    np.testing.assert_array_equal(loaded, coords.astype(np.float32))
+
+    with pytest.raises(ValueError, match='dimensionality'):
+        load_coordinates(path, cache=False)
+    with pytest.raises(ValueError, match='multiple'):
+        load_coordinates(path, source_dtype=np.float64, dimensionality=3,
+                         cache=False)
+
+
+# The cache is used while the file keeps its modification time, a new one
+# is parsed when it changes, even to the same content
+def test_cache_follows_the_source(tmp_path, coords, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    path = str(tmp_path / 'test.csv')
+
+    def write(coords, mtime):
+        write_text(path, [f'{x:.17g},{y:.17g}' for x, y in coords])
+        os.utime(path, ns=(mtime, mtime))
+
+    def cache_files():
+        return sorted(os.listdir(io.data_cache_dir(cache_dir)))
+
+    write(coords, 10 ** 18)
+    first = load_coordinates(path, dtype=np.float64, cache_dir=cache_dir)
+    np.testing.assert_array_equal(first, coords)
+    cached = cache_files()
+    assert len(cached) == 1
+
+    # Hit: nothing is parsed
+    read_csv = io.read_csv
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError('parsed again')
+
+    monkeypatch.setattr(io, 'read_csv', no_parsing)
+    again = load_coordinates(path, dtype=np.float64, cache_dir=cache_dir)
+    np.testing.assert_array_equal(again, coords)
+    assert cache_files() == cached
+
+    # Miss: same size, other coordinates and modification time
+    monkeypatch.setattr(io, 'read_csv', read_csv)
+    write(coords[::-1], 2 * 10 ** 18)
+    loaded = load_coordinates(path, dtype=np.float64, cache_dir=cache_dir)
+    np.testing.assert_array_equal(loaded, coords[::-1])
+    assert len(cache_files()) == 2
+
+    # Miss: same content, touched
+    os.utime(path, ns=(3 * 10 ** 18, 3 * 10 ** 18))
+    load_coordinates(path, dtype=np.float64, cache_dir=cache_dir)
+    assert len(cache_files()) == 3
+
+
+# The problem data is mapped from the cache and used in place, it has the
+# type of the data the runner prepares itself (the same compiled code runs
+# on both)
+def test_runner_on_loaded_problem_data(tmp_path, coords):
+    cache_dir = str(tmp_path / 'cache')
+    path = str(tmp_path / 'test.npy')
+    np.save(path, coords)
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+    problem_data = load_problem_data(TSP, path, cache_dir=cache_dir)
+    assert isinstance(problem_data.base, np.memmap)
+    # Next to the cached coordinates
+    cache_file, = [os.path.join(io.data_cache_dir(cache_dir), name)
+                   for name in os.listdir(io.data_cache_dir(cache_dir))
+                   if '-problem_data-' in name]
+    saved = open(cache_file, 'rb').read()
+
+    def runner(problem_data):
+        runner = CPURunner(IndependentShuffler(RandomLocalSearch(TSP), 2),
+                           problem_data, num_cores=1)
+        runner.progress = False
+        return runner
+
+    loaded = runner(problem_data)
+    assert loaded.problem_data_array is problem_data
+    prepared = runner(coords.astype(np.float32))
+    assert (numba.typeof(loaded.problem_data_array)
+            == numba.typeof(prepared.problem_data_array))
+    assert loaded.problem_data_array.tobytes() == \
+        prepared.problem_data_array.tobytes()
+
+    result = loaded.run(max_iter=20000)
+    tour = coords[result.solution['order']].astype(np.float32)
+    expected = ((tour - np.roll(tour, -1, axis=0)) ** 2).sum()
+    assert result.loss == pytest.approx(expected, rel=1e-5)
+    # Mapped copy on write, the cache is never written to
+    assert open(cache_file, 'rb').read() == saved
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import SimulatedAnnealing
+from gopt.shufflers import IndependentShuffler, ParallelTempering
+
+from conftest import make_runner as make_cpu_runner, tour_loss, uniform_coords
+
+NUM_CITIES = 50
+
+
+def make_runner(temperatures, exchange_interval=None):
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+    Optimizer = SimulatedAnnealing(TSP, temperatures=temperatures)
+    runner = make_cpu_runner(ParallelTempering(Optimizer, exchange_interval),
+                             NUM_CITIES)
+    return runner, uniform_coords(NUM_CITIES).astype(np.float64)
+
+
+# Two replicas with fixed losses: in the stationary distribution of the
+# exchanges pi(swapped) / pi(ordered) = exp(-(1/T0 - 1/T1) * (L1 - L0)),
+# detailed balance holds if the moves between the two configurations are
+# accepted with probabilities in that ratio
+def test_detailed_balance():
+    np.random.seed(0)
+    runner, _ = make_runner([1.0, 2.0])
+    shuffle = runner.shuffler_code.shuffle
+    ratio = 0.3
+    runner.solution_losses[0, 1] = 0.0
+    runner.solution_losses[1, 1] = -np.log(ratio) / (1.0 - 0.5)
+
+    moves = {0: [0, 0], 1: [0, 0]}
+    for _ in range(20000):
+        before = runner.shuffler_state['members'][0]
+        attempted = runner.shuffler_state['attempted']
+        shuffle(runner.query_vector, runner.shuffler_state,
+                runner.solution_states, runner.solution_losses,
+                runner.problem_data_array, runner.optimizer_states)
+        if runner.shuffler_state['attempted'] == attempted:
+            continue
+        after = runner.shuffler_state['members'][0]
+        moves[before][0] += 1
+        moves[before][1] += before != after
+
+        # Temperatures follow the members, solutions don't move
+        members = runner.shuffler_state['members']
+        assert runner.optimizer_states['temperature'][members[0]] == 1.0
+        assert runner.optimizer_states['temperature'][members[1]] == 2.0
+        assert runner.solution_losses[1, 1] > runner.solution_losses[0, 1]
+
+    forward = moves[0][1] / moves[0][0]
+    backward = moves[1][1] / moves[1][0]
+    assert backward == 1.0
+    assert forward == pytest.approx(ratio, abs=0.02)
+
+
+def test_losses_match_tours_after_exchanges():
+    temperatures = [1.0, 10.0, 100.0, 1000.0]
+    runner, coords = make_runner(temperatures, exchange_interval=50)
+    runner.run(max_iter=20000)
+
+    state = runner.shuffler_state
+    assert state['accepted'] > 0
+    members = state['members']
+    assert sorted(members.tolist()) == list(range(len(temperatures)))
+    for rung, member in enumerate(members):
+        assert (runner.optimizer_states['temperature'][member]
+                == temperatures[rung])
+    for member in range(len(temperatures)):
+        for slot in range(runner.solution_losses.shape[1]):
+            order = runner.solution_states[member, slot]['order']
+            assert sorted(order.tolist()) == list(range(NUM_CITIES))
+            assert runner.solution_losses[member, slot] == pytest.approx(
+                tour_loss(coords, order), rel=1e-5)
+
+
+# Each member needs its own rung of the ladder
+def test_ladder_sizes_the_population():
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+    Optimizer = SimulatedAnnealing(TSP, temperatures=[1.0, 2.0])
+    with pytest.raises(ValueError, match='2 temperatures'):
+        make_cpu_runner(IndependentShuffler(Optimizer, 8), NUM_CITIES)
+    runner = make_cpu_runner(IndependentShuffler(Optimizer, 2), NUM_CITIES)
+    assert runner.optimizer_states['temperature'].tolist() == [1.0, 2.0]
@@ -0,0 +1,136 @@
+import os
+import signal
+import threading
+import multiprocessing
+from time import time, sleep
+
+import numpy as np
+import pytest
+
+from gopt.compiler import Compiler
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import RandomLocalSearch
+from gopt.shufflers import IndependentShuffler
+from gopt.telemetry import ITERATIONS
+
+from conftest import tour_loss, uniform_coords
+
+NUM_CITIES = 100
+POPULATION = 4
+
+
+def make_shuffler():
+    TSP = EuclieanTSP(NUM_CITIES, 2)
+    return IndependentShuffler(RandomLocalSearch(TSP), POPULATION)
+
+
+def make_coords():
+    return uniform_coords(NUM_CITIES)
+
+
+def snapshot(runner, result):
+    return dict(loss=float(result.loss),
+                order=np.array(result.solution['order']),
+                losses=np.array(runner.solution_losses[:, 0]),
+                orders=np.array(runner.solution_states[:, 0]['order']),
+                iterations=np.array(runner.counters[:, ITERATIONS]))
+
+
+def run_both(results):
+    from gopt.runners import CPURunner, ProcessPoolRunner
+    coords = make_coords()
+
+    cpu = CPURunner(make_shuffler(), coords, num_cores=1)
+    pool = ProcessPoolRunner(make_shuffler(), coords, num_workers=2)
+    initial = (cpu.solution_losses[:, 0].copy(),
+               pool.solution_losses[:, 0].copy())
+    for runner in (cpu, pool):
+        runner.progress = False
+    try:
+        outputs = [snapshot(r, r.run(max_iter=20000)) for r in (cpu, pool)]
+    finally:
+        pool.close()
+    results.put((initial, outputs))
+
+
+def kill_worker(results):
+    from gopt.runners import ProcessPoolRunner
+    runner = ProcessPoolRunner(make_shuffler(), make_coords(), num_workers=2)
+    runner.progress = False
+    killed = []
+
+    def killer():
+        while len(multiprocessing.active_children()) < 2:
+            sleep(0.05)
+        sleep(1)
+        worker = multiprocessing.active_children()[0]
+        killed.append(time())
+        os.kill(worker.pid, signal.SIGKILL)
+
+    threading.Thread(target=killer, daemon=True).start()
+    try:
+        runner.run(max_time=120)
+        results.put(('no error', None))
+    except RuntimeError as e:
+        results.put((str(e), time() - killed[0]))
+    finally:
+        runner.close()
+
+
+# numba picks the threading layer once per process and the other tests use
+# TBB: the runner is exercised in a fresh interpreter that opts in to
+# workqueue
+def in_fresh_process(scenario):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=opt_in_and_run,
+                              args=(scenario, results))
+    process.start()
+    try:
+        return results.get(timeout=900)
+    finally:
+        process.join(timeout=30)
+        if process.is_alive():
+            process.terminate()
+
+
+def opt_in_and_run(scenario, results):
+    Compiler.threading_layer = 'workqueue'
+    scenario(results)
+
+
+def test_refuses_tbb():
+    from gopt.runners import ProcessPoolRunner
+    assert Compiler.threading_layer == 'tbb'
+    with pytest.raises(ValueError, match='workqueue'):
+        ProcessPoolRunner(make_shuffler(), make_coords(), num_workers=2)
+
+
+def test_matches_cpu_runner():
+    (cpu_initial, pool_initial), (cpu, pool) = in_fresh_process(run_both)
+    coords = make_coords().astype(np.float64)
+
+    # Same iterations for every member
+    np.testing.assert_array_equal(cpu['iterations'], pool['iterations'])
+    assert (pool['iterations'] == 20000).all()
+
+    # Random streams differ between processes (starting cities of the
+    # initialization, moves), the tours can't be compared but they have to
+    # be valid and as good
+    for output, initial in ((cpu, cpu_initial), (pool, pool_initial)):
+        for order, loss in zip(output['orders'], output['losses']):
+            assert sorted(order.tolist()) == list(range(NUM_CITIES))
+            assert loss == pytest.approx(tour_loss(coords, order), rel=1e-5)
+        assert (output['losses'] <= initial).all()
+        assert output['loss'] == output['losses'].min()
+        assert output['loss'] == pytest.approx(
+            tour_loss(coords, output['order']), rel=1e-5)
+    assert pool['loss'] <= 1.5 * cpu['loss']
+
+
+def test_dead_worker_stops_the_run():
+    message, delay = in_fresh_process(kill_worker)
+    assert 'Workers stopped' in message
+    assert str(-signal.SIGKILL) in message
+    # Found by the watchdog, not by the end of the time budget
+    assert delay < 10
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import SimulatedAnnealing
+from gopt.shufflers import IndependentShuffler
+
+from conftest import make_runner, tour_loss, uniform_coords
+
+NUM_CITIES = 50
+
+
+# The optimizer evaluates moves with move_delta, with neighbor + undo or
+# with neighbor on a copy of the state depending on what the problem has
+@pytest.mark.parametrize('moves', ['delta', 'undo', 'copy'])
+def test_best_state_matches_its_loss(moves):
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+
+    class Problem(TSP):
+        pass
+
+    if moves != 'delta':
+        Problem.move_delta = None
+        Problem.apply_move = None
+    if moves == 'copy':
+        Problem.undo = None
+
+    # Hot enough to accept moves that make the chain leave its best solution
+    Optimizer = SimulatedAnnealing(Problem, start_temp=1e4, temp_decay=1e-3)
+    runner = make_runner(IndependentShuffler(Optimizer, 4), NUM_CITIES)
+    runner.run(max_iter=5000)
+
+    coords = uniform_coords(NUM_CITIES).astype(np.float64)
+    for member in range(4):
+        best = runner.solution_states[member, 0]['order']
+        current = runner.solution_states[member, 1]['order']
+        assert sorted(best.tolist()) == list(range(NUM_CITIES))
+        assert runner.solution_losses[member, 0] == pytest.approx(
+            tour_loss(coords, best), rel=1e-5)
+        assert runner.solution_losses[member, 1] == pytest.approx(
+            tour_loss(coords, current), rel=1e-5)
+        assert (runner.solution_losses[member, 0]
+                <= runner.solution_losses[member, 1])
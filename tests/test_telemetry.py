@@ -0,0 +1,154 @@
+import json
+import os
+
+import numba
+import numpy as np
+import pytest
+
+from gopt import telemetry
+from gopt.problems import EuclieanTSP
+from gopt.optimizers import RandomLocalSearch
+from gopt.shufflers import IndependentShuffler
+from gopt.runners import CPURunner
+from gopt.telemetry import (PrometheusExporter, JSONLinesExporter,
+                            ITERATIONS, STEP_NS, allocate_counters,
+                            allocate_timespecs, allocate_trace,
+                            record_improvement, trace_result, TRACE_COUNT,
+                            TRACE_STRIDE, TRACE_PENDING)
+
+from conftest import make_runner as make_cpu_runner
+
+NUM_CITIES = 30
+
+
+def make_runner():
+    TSP = EuclieanTSP(NUM_CITIES, 2, init='random')
+    runner = make_cpu_runner(IndependentShuffler(RandomLocalSearch(TSP), 2),
+                             NUM_CITIES)
+    # Short blocks, many of them
+    runner.block_duration = 0.02
+    return runner
+
+
+def snapshot(iterations):
+    counters = allocate_counters(2)
+    counters[:, ITERATIONS] = iterations
+    return dict(time=0.0, iterations=2 * iterations, elapsed=1.5,
+                best_loss=10.0, counters=counters)
+
+
+# The clock writes to the row of the member instead of allocating
+@pytest.mark.skipif(not hasattr(telemetry, 'clock_gettime'),
+                    reason='No clock_gettime')
+def test_monotonic_ns():
+    monotonic_ns = numba.njit(telemetry.monotonic_ns)
+    timespecs = allocate_timespecs(2)
+    first = monotonic_ns(timespecs[1])
+    assert (timespecs[0] == 0).all()
+    assert first == timespecs[1, 0] * 10 ** 9 + timespecs[1, 1] > 0
+    assert monotonic_ns(timespecs[1]) >= first
+
+    runner = make_runner()
+    runner.run(max_iter=10000)
+    assert (runner.counters[:, STEP_NS] > 0).all()
+    assert (runner.timespecs != 0).all()
+
+
+# The file is written next to its destination and moved over it: the
+# destination holds a complete snapshot at any time
+def test_prometheus_replaces_the_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'gopt.prom')
+    exporter = PrometheusExporter(path, labels=dict(run='a'))
+    exporter(snapshot(100))
+    first = open(path).read()
+    assert 'gopt_run_iterations_total{run="a"} 200\n' in first
+    assert 'gopt_member_iterations_total{run="a",member="1"} 100\n' in first
+
+    replace = os.replace
+    seen = []
+
+    def checked_replace(source, destination):
+        seen.append((open(source).read(), open(destination).read()))
+        replace(source, destination)
+
+    monkeypatch.setattr(telemetry.os, 'replace', checked_replace)
+    exporter(snapshot(300))
+    (written, previous), = seen
+    assert previous == first
+    assert written == open(path).read()
+    assert ('gopt_member_iterations_total'
+            '{run="a",member="1"} 300\n') in written
+    assert os.listdir(tmp_path) == ['gopt.prom']
+
+
+# Runs end between blocks (iteration budget, deadline) or in the middle of
+# one (deadline, target loss), the last block is exported once either way
+@pytest.mark.parametrize('stop', ['max_iter', 'deadline', 'target_loss'])
+def test_json_lines_one_record_per_block(tmp_path, stop):
+    path = str(tmp_path / 'gopt.jsonl')
+    runner = make_runner()
+    runner.add_exporter(JSONLinesExporter(path, labels=dict(run='a')))
+    if stop == 'max_iter':
+        result = runner.run(max_iter=300000)
+    elif stop == 'deadline':
+        result = runner.run(max_time=0.3)
+    else:
+        target = 0.8 * runner.solution_losses[:, 0].min()
+        result = runner.run(max_iter=10 ** 9, target_loss=target,
+                            check_every=100)
+    assert result.runtime_info['stop_reason'] == stop
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == result.runtime_info['blocks'] > 1
+    iterations = [record['iterations'] for record in records]
+    assert iterations == sorted(set(iterations))
+    last = records[-1]
+    assert last['run'] == 'a'
+    assert last['member_iterations'] == runner.counters[:, ITERATIONS].tolist()
+    assert last['best_loss'] == result.loss
+
+
+# Improvement number e is recorded at iteration 10 * e. The entries kept are
+# the improvements 0, stride, 2 * stride... (the stride doubles each time
+# the trace is full and halved), followed by the latest improvement. With an
+# odd capacity the last entry is one of them and survives the halving
+@pytest.mark.parametrize('capacity', [2, 3, 8, 9])
+def test_trace(capacity):
+    trace, trace_state = allocate_trace(capacity)
+    count, stride, halvings = 0, 1, 0
+    for event in range(1000):
+        # Not counting the provisional entry
+        full = count == capacity and not trace_state[TRACE_PENDING]
+        record_improvement(trace, trace_state, 10 * event, 0.1 * event,
+                           1000.0 - event)
+        count = trace_state[TRACE_COUNT]
+        assert trace_state[TRACE_STRIDE] == (2 * stride if full else stride)
+        stride = trace_state[TRACE_STRIDE]
+        halvings += full
+        assert 1 <= count <= capacity
+
+        entries = trace_result(trace, trace_state)
+        events = list(entries['iteration'] // 10)
+        assert events[-1] == event
+        kept = list(range(0, event + 1, stride))
+        if kept[-1] != event:
+            kept.append(event)
+        assert events == kept
+        np.testing.assert_allclose(entries['time'], 0.1 * entries['iteration']
+                                   / 10)
+        assert (entries['loss'] == 1000.0 - entries['iteration'] // 10).all()
+
+    assert stride == 2 ** halvings > 1
+
+
+def test_trace_of_a_run(monkeypatch):
+    monkeypatch.setattr(CPURunner, 'trace_capacity', 8)
+    runner = make_runner()
+    result = runner.run(max_iter=300000)
+    trace = result.runtime_info['trace']
+    assert 2 <= len(trace) <= 8
+    assert (np.diff(trace['iteration']) > 0).all()
+    assert (np.diff(trace['loss']) < 0).all()
+    assert trace['loss'][-1] == result.loss
+    assert trace['iteration'][-1] <= runner.counters[0, ITERATIONS]
@@ -0,0 +1,83 @@
+import numba
+import numpy as np
+import pytest
+
+from gopt.problems.tsp_two_level import (TwoLevelList, two_level_fields,
+                                         build_tour, max_segments)
+
+
+# Applies random 2-opt reversals to a two-level list and to a plain array
+# and checks after every move that they describe the same tour. Small
+# instances go through the rebuild of the list (when splits doubled the
+# segments) every few moves
+@pytest.mark.parametrize('num_cities', [2, 3, 7, 20, 101])
+def test_matches_array_tour(num_cities):
+    n = num_cities
+    tour = TwoLevelList(n)
+    # numba can't type the namespace itself
+    tour_reverse, tour_next, tour_prev = tour.reverse, tour.next, tour.prev
+    tour_between, tour_order = tour.between, tour.tour_order
+
+    # The functions of the list take records that numba passes by value,
+    # the state is handed over in a one element array
+    @numba.njit
+    def reverse(states, x, y):
+        tour_reverse(states[0], x, y)
+
+    @numba.njit
+    def neighbors(states, following, preceding):
+        for c in range(following.shape[0]):
+            following[c] = tour_next(states[0], c)
+            preceding[c] = tour_prev(states[0], c)
+
+    @numba.njit
+    def between(states, a, b, c):
+        return tour_between(states[0], a, b, c)
+
+    @numba.njit
+    def linearize(states, out):
+        tour_order(states[0], out)
+
+    rng = np.random.default_rng(n)
+    states = np.zeros(1, dtype=two_level_fields(n, np.int16))
+    reference = rng.permutation(n)
+    states[0]['order'][:] = reference
+    build_tour(states[0])
+
+    following = np.empty(n, dtype=np.int64)
+    preceding = np.empty(n, dtype=np.int64)
+    order = np.empty(n, dtype=np.int64)
+    rebuilds = 0
+    for _ in range(400):
+        x, y = (int(c) for c in rng.integers(0, n, 2))
+        segments = states[0]['num_segments']
+        reverse(states, x, y)
+        rebuilds += states[0]['num_segments'] < segments
+        assert states[0]['num_segments'] <= max_segments(n)
+
+        # Reversing the path from x to y in the array
+        i = int(np.flatnonzero(reference == x)[0])
+        length = (int(np.flatnonzero(reference == y)[0]) - i) % n + 1
+        path = (i + np.arange(length)) % n
+        reference[path] = reference[path[::-1]]
+
+        # Same cyclic sequence
+        linearize(states, order)
+        start = int(np.flatnonzero(reference == order[0])[0])
+        np.testing.assert_array_equal(order, np.roll(reference, -start))
+
+        neighbors(states, following, preceding)
+        np.testing.assert_array_equal(following[reference],
+                                      np.roll(reference, -1))
+        np.testing.assert_array_equal(preceding[reference],
+                                      np.roll(reference, 1))
+
+        position = np.empty(n, dtype=np.int64)
+        position[reference] = np.arange(n)
+        for a, b, c in rng.integers(0, n, (5, 3)):
+            expected = ((position[b] - position[a]) % n
+                        <= (position[c] - position[a]) % n)
+            assert between(states, a, b, c) == expected
+
+    if n >= 20:
+        assert rebuilds > 0